@@ -1,2 +1,3 @@
 from dscribe.core.system import System
 from dscribe.core.lattice import Lattice
+from dscribe.core.blocktensor import BlockSparseTensor
@@ -0,0 +1,126 @@
+from __future__ import absolute_import, division, print_function
+import numpy as np
+
+
+class BlockSparseTensor(object):
+    """A tensor that only stores the blocks along its last axis that are
+    present. Each block is identified by the indices of the leading axes, e.g.
+    the indices of an element combination, and the blocks of the other index
+    combinations are zero.
+
+    The blocks are stored as rows of a single two-dimensional array, so that
+    they can be used without creating the full tensor. The full tensor is
+    only created when requested with toarray() or np.asarray().
+    """
+    def __init__(self, shape, indices, data):
+        """
+        Args:
+            shape (tuple): The shape of the full tensor.
+            indices (np.ndarray): The indices of the leading axes for each
+                block as an integer array of shape [n_blocks, len(shape)-1].
+                The indices should not contain duplicates.
+            data (np.ndarray): The values of the blocks as an array of shape
+                [n_blocks, shape[-1]].
+        """
+        shape = tuple(int(x) for x in shape)
+        indices = np.asarray(indices).reshape(-1, len(shape) - 1)
+        data = np.asarray(data).reshape(-1, shape[-1])
+        if len(indices) != len(data):
+            raise ValueError(
+                "The number of block indices ({}) does not match the number of "
+                "blocks ({}).".format(len(indices), len(data))
+            )
+        if len(indices) != 0 and (indices.min() < 0 or np.any(indices.max(axis=0) >= shape[:-1])):
+            raise ValueError(
+                "The block indices are out of bounds for the shape {}."
+                .format(shape)
+            )
+        self.shape = shape
+        self.indices = indices
+        self.data = data
+        self._rows = None
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        """The number of stored blocks."""
+        return len(self.indices)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return self._get_row(key) is not None
+
+    def __getitem__(self, key):
+        """Returns the block for the given indices of the leading axes. The
+        stored blocks are returned as views, and a new array of zeros is
+        returned for the blocks that are not stored.
+
+        Args:
+            key (tuple): The indices of the leading axes.
+
+        Returns:
+            np.ndarray: The values of the block.
+        """
+        key = self._check_key(key)
+        row = self._get_row(key)
+        if row is None:
+            return np.zeros(self.shape[-1], dtype=self.dtype)
+        return self.data[row]
+
+    def keys(self):
+        """Returns the indices of the stored blocks as a list of tuples."""
+        return [tuple(key) for key in self.indices.tolist()]
+
+    def items(self):
+        """Returns the indices and values of the stored blocks as a list of
+        tuples.
+        """
+        return list(zip(self.keys(), self.data))
+
+    def toarray(self):
+        """Returns the full tensor as a dense array."""
+        output = np.zeros(self.shape, dtype=self.dtype)
+        if len(self.indices) != 0:
+            output[tuple(self.indices.T)] = self.data
+        return output
+
+    def __array__(self, dtype=None):
+        output = self.toarray()
+        if dtype is not None:
+            output = output.astype(dtype, copy=False)
+        return output
+
+    def __repr__(self):
+        return "<BlockSparseTensor of shape {} with {} stored blocks>".format(self.shape, len(self))
+
+    def _check_key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) != self.ndim - 1:
+            raise IndexError(
+                "The block is indexed with {} indices, but the tensor has {} "
+                "leading axes.".format(len(key), self.ndim - 1)
+            )
+        key = tuple(int(x) for x in key)
+        for index, size in zip(key, self.shape):
+            if not 0 <= index < size:
+                raise IndexError(
+                    "The block index {} is out of bounds for the shape {}."
+                    .format(key, self.shape)
+                )
+        return key
+
+    def _get_row(self, key):
+        if self._rows is None:
+            self._rows = {key: row for row, key in enumerate(self.keys())}
+        if not isinstance(key, tuple):
+            key = (key,)
+        return self._rows.get(tuple(key))
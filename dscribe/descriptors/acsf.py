@@ -105,7 +105,7 @@ class ACSF(Descriptor):
         """
         # If single system given, skip the parallelization
         if isinstance(system, (Atoms, System)):
-            return self.create_single(system, positions)
+            return self.project(self.create_single(system, positions))
 
         # Combine input arguments
         if positions is None:
@@ -4,6 +4,7 @@ from future.utils import with_metaclass
 import numpy as np
 
 from scipy.sparse import coo_matrix
+import scipy.sparse
 
 from ase import Atoms
 from dscribe.core.system import System
@@ -27,6 +28,8 @@ class Descriptor(with_metaclass(ABCMeta)):
         self._atomic_numbers = None
         self._atomic_number_set = None
         self._species = None
+        self._columns = None
+        self._projection = None
 
     @abstractmethod
     def create(self, system, *args, **kwargs):
@@ -50,6 +53,165 @@ class Descriptor(with_metaclass(ABCMeta)):
             int: Number of features for this descriptor.
         """
 
+    @property
+    def projection(self):
+        """The projection that reduces the dimensionality of the output, or
+        None if the output is not projected. The projection is applied by
+        create() to the output of each system. When creating the output for
+        multiple systems, the projection is done inside each parallel job, so
+        only the reduced features are transferred from the jobs and stored.
+        The projected output is always a dense array.
+
+        The projection can be set to either a matrix of shape [n_features,
+        n_components] that the output is multiplied with, or a fitted
+        transformer with a transform()-method, such as PCA, IncrementalPCA or
+        SparseRandomProjection from scikit-learn. A transformer can be fitted
+        with fit_projection(). Setting it to None disables the projection.
+
+        Raises:
+            ValueError: If the projection does not match the number of
+            features or if the output is not flattened.
+        """
+        return self._projection
+
+    @projection.setter
+    def projection(self, value):
+        if value is not None:
+            if not self._flatten:
+                raise ValueError(
+                    "A projection can only be applied to flattened output."
+                )
+            if hasattr(value, "transform"):
+                if not hasattr(value, "n_components_"):
+                    raise ValueError(
+                        "The projection should be fitted before it is used."
+                    )
+                n_input = getattr(value, "n_features_in_", None)
+            else:
+                value = np.asarray(value)
+                if value.ndim != 2:
+                    raise ValueError(
+                        "The projection matrix should have the shape "
+                        "[n_features, n_components]."
+                    )
+                n_input = value.shape[0]
+            if n_input is not None and n_input != self.get_number_of_features():
+                raise ValueError(
+                    "The projection expects {} features, but the descriptor "
+                    "has {} features.".format(n_input, self.get_number_of_features())
+                )
+        self._projection = value
+
+    def get_number_of_projected_features(self):
+        """Used to inquire the number of features in the output of create()
+        after the projection.
+
+        Returns:
+            int: Number of features after the projection, or the number of
+            features of the descriptor if no projection has been set.
+        """
+        if self._projection is None:
+            return self.get_number_of_features()
+        if isinstance(self._projection, np.ndarray):
+            return self._projection.shape[1]
+        return self._projection.n_components_
+
+    def project(self, output):
+        """Used to apply the projection to the output of a single system.
+
+        Args:
+            output (np.ndarray | scipy.sparse.coo_matrix): The output of
+                create_single().
+
+        Returns:
+            np.ndarray | scipy.sparse.coo_matrix: The projected output as a
+            dense array, or the given output if no projection has been set.
+        """
+        projection = self._projection
+        if projection is None:
+            return output
+
+        # A matrix is multiplied directly with sparse output, while the
+        # transformers are given a two-dimensional dense array
+        if isinstance(projection, np.ndarray):
+            projected = output.dot(projection)
+        else:
+            if scipy.sparse.issparse(output):
+                output = output.toarray()
+            projected = projection.transform(np.atleast_2d(output))
+            if output.ndim == 1:
+                projected = projected[0]
+        if scipy.sparse.issparse(projected):
+            projected = projected.toarray()
+
+        return np.asarray(projected, dtype=np.float32)
+
+    def fit_projection(self, systems, projection, batch_size=100, n_jobs=1, **kwargs):
+        """Used to fit a transformer to the output of the given systems and
+        to set it as the projection of this descriptor. The output is created
+        in batches, so the systems can be a sample of a larger dataset given
+        as any iterable, such as a generator. A transformer with a
+        partial_fit()-method, such as IncrementalPCA, is fitted on every
+        batch, and other transformers are fitted on the first batch only.
+
+        Args:
+            systems (iterable): The systems used for fitting.
+            projection (object): A transformer with fit()- and
+                transform()-methods, such as PCA, IncrementalPCA or
+                SparseRandomProjection from scikit-learn.
+            batch_size (int): The number of systems in each batch.
+            n_jobs (int): Number of parallel jobs used to create the output
+                of each batch.
+            kwargs: Additional arguments to create(). If positions are
+                given, they are iterated together with the systems.
+
+        Returns:
+            object: The fitted transformer.
+        """
+        if batch_size < 1:
+            raise ValueError("The batch size should be a positive integer.")
+        incremental = hasattr(projection, "partial_fit")
+        positions = kwargs.pop("positions", None)
+        positions = None if positions is None else iter(positions)
+
+        # The transformer is fitted with the full output. The previous
+        # projection is kept if the fitting fails.
+        previous = self._projection
+        self._projection = None
+
+        def fit_batch(batch, batch_positions):
+            if positions is not None:
+                kwargs["positions"] = batch_positions
+            output = self.create(batch, n_jobs=n_jobs, **kwargs)
+            if scipy.sparse.issparse(output):
+                output = output.toarray()
+            if incremental:
+                projection.partial_fit(output)
+            else:
+                projection.fit(output)
+
+        try:
+            batch = []
+            batch_positions = []
+            for system in systems:
+                batch.append(system)
+                if positions is not None:
+                    batch_positions.append(next(positions))
+                if len(batch) == batch_size:
+                    fit_batch(batch, batch_positions)
+                    batch = []
+                    batch_positions = []
+                    if not incremental:
+                        break
+            else:
+                if len(batch) != 0:
+                    fit_batch(batch, batch_positions)
+        finally:
+            self._projection = previous
+
+        self.projection = projection
+        return projection
+
     def get_system(self, system):
         """Used to convert the given atomic system into a custom System-object
         that is used internally. The System class inherits from ase.Atoms, but
@@ -142,6 +304,45 @@ class Descriptor(with_metaclass(ABCMeta)):
                 .format(zs.difference(self._atomic_number_set))
             )
 
+    def get_column_indices(self, columns, n_features):
+        """Used to validate a subset of output columns and to convert it into
+        an array of column indices.
+
+        Args:
+            columns(iterable): The selected columns either as integer indices
+                or as a boolean mask with one value for each feature.
+            n_features(int): The number of features in the full output.
+
+        Returns:
+            np.ndarray: The selected column indices in the given order.
+
+        Raises:
+            ValueError: If the given columns are not valid for an output with
+            the given number of features.
+        """
+        columns = np.asarray(columns)
+        if columns.dtype == bool:
+            if columns.shape != (n_features,):
+                raise ValueError(
+                    "The boolean column mask should contain exactly one value "
+                    "for each of the {} features.".format(n_features)
+                )
+            columns = np.nonzero(columns)[0]
+        elif columns.ndim != 1 or not np.issubdtype(columns.dtype, np.integer):
+            raise ValueError(
+                "Please provide the columns either as a list of integer "
+                "indices or as a boolean mask."
+            )
+        if columns.size == 0:
+            raise ValueError("At least one column should be selected.")
+        if columns.min() < 0 or columns.max() >= n_features:
+            raise ValueError(
+                "The column indices should be in the range [0, {}]."
+                .format(n_features-1)
+            )
+
+        return columns.astype(np.int64)
+
     def create_parallel(self, inp, func, n_jobs, output_sizes=None, verbose=False, prefer="processes"):
         """Used to parallelize the descriptor creation across multiple systems.
 
@@ -182,8 +383,8 @@ class Descriptor(with_metaclass(ABCMeta)):
         """
         # Split data into n_jobs (almost) equal jobs
         n_samples = len(inp)
-        n_features = self.get_number_of_features()
-        is_sparse = self._sparse
+        n_features = self.get_number_of_projected_features()
+        is_sparse = self._sparse and self._projection is None
         k, m = divmod(n_samples, n_jobs)
         jobs = (inp[i * k + min(i, m):(i + 1) * k + min(i + 1, m)] for i in range(n_jobs))
 
@@ -194,9 +395,10 @@ class Descriptor(with_metaclass(ABCMeta)):
         else:
             static_size = True
 
-        def create_multiple(arguments, func, is_sparse, n_features, n_desc, index, verbose):
+        def create_multiple(arguments, func, project, is_sparse, n_features, n_desc, index, verbose):
             """This is the function that is called by each job but with
-            different parts of the data.
+            different parts of the data. The output of each system is
+            projected inside the job.
             """
             # Initialize output
             if n_desc is None:
@@ -215,7 +417,7 @@ class Descriptor(with_metaclass(ABCMeta)):
             n_samples = len(arguments)
 
             for i_sample, i_arg in enumerate(arguments):
-                i_out = func(*i_arg)
+                i_out = project(func(*i_arg))
 
                 if n_desc is None:
                     results.append(i_out)
@@ -242,7 +444,7 @@ class Descriptor(with_metaclass(ABCMeta)):
 
             return (results, index)
 
-        vec_lists = Parallel(n_jobs=n_jobs, prefer=prefer)(delayed(create_multiple)(i_args, func, is_sparse, n_features, n_desc, index, verbose) for index, (i_args, n_desc) in enumerate(zip(jobs, output_sizes)))
+        vec_lists = Parallel(n_jobs=n_jobs, prefer=prefer)(delayed(create_multiple)(i_args, func, self.project, is_sparse, n_features, n_desc, index, verbose) for index, (i_args, n_desc) in enumerate(zip(jobs, output_sizes)))
 
         # Restore the caluclation order. If using the threading backend, the
         # input order may have been lost.
@@ -252,7 +454,7 @@ class Descriptor(with_metaclass(ABCMeta)):
         vec_lists = [x[0] for x in vec_lists]
 
         if static_size is True:
-            if self._sparse:
+            if is_sparse:
                 row_offset = 0
                 data = []
                 cols = []
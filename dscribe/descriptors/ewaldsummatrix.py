@@ -92,7 +92,7 @@ class EwaldSumMatrix(MatrixDescriptor):
         """
         # If single system given, skip the parallelization
         if isinstance(system, (Atoms, System)):
-            return self.create_single(system, accuracy, w, rcut, gcut, a)
+            return self.project(self.create_single(system, accuracy, w, rcut, gcut, a))
 
         # Combine input arguments
         n_samples = len(system)
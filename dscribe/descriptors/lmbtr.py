@@ -28,8 +28,8 @@ class LMBTR(MBTR):
     and the following weighting functions:
 
         -k=1: unity(=no weighting)
-        -k=2: unity(=no weighting), exponential (:math:`e^-(sx)`)
-        -k=3: unity(=no weighting), exponential (:math:`e^-(sx)`)
+        -k=2: unity(=no weighting), exponential (:math:`e^-(sx)`), smooth cutoff
+        -k=3: unity(=no weighting), exponential (:math:`e^-(sx)`), smooth cutoff
 
     You can use this descriptor for finite and periodic systems. When dealing
     with periodic systems, it is advisable to use a primitive cell, or if
@@ -39,7 +39,9 @@ class LMBTR(MBTR):
     If flatten=False, a list of dense np.ndarrays for each k in ascending order
     is returned. These arrays are of dimension (n_elements x n_elements x
     n_grid_points), where the elements are sorted in ascending order by their
-    atomic number.
+    atomic number. If also sparse=True, each term is given as a
+    :class:`.BlockSparseTensor` that only stores the grid points of the element
+    combinations that are present around the position.
 
     If flatten=True, a scipy.sparse.coo_matrix is returned. This sparse matrix
     is of size (1, n_features), where n_features is given by
@@ -98,7 +100,11 @@ class LMBTR(MBTR):
                 Here 'min' is the minimum value of the axis, 'max' is the
                 maximum value of the axis, 'sigma' is the standard devation of
                 the gaussian broadening and 'n' is the number of points sampled
-                on the grid.
+                on the grid. The optional 'window' is the number of standard
+                deviations around the center of each gaussian within which it
+                is evaluated, and it defaults to 6. The optional 'broadening'
+                and 'resolution' select the summation of the gaussians as
+                described in MBTR.
             virtual_positions (bool): Determines whether the local positions
                 are virtual or not. A virtual position does not correspond to any
                 physical atom, and is thus not repeated in periodic systems. If set
@@ -130,12 +136,19 @@ class LMBTR(MBTR):
                     "unity": Constant weighting of 1 for all samples.
                     "exponential": Weighting of the form :math:`e^-(sx)`. The
                         parameter :math:`s` is given in the attribute 'scale'.
+                    "smooth_cutoff": Weighting of the form :math:`1 +
+                        y(x/r)^{y+1} - (y+1)(x/r)^y` that smoothly goes to
+                        zero at the cutoff radius :math:`r` given in the
+                        attribute 'r_cut'. The optional attribute 'sharpness'
+                        :math:`y` defaults to 2.
 
                 The meaning of x changes for different terms as follows:
 
                     k=1: x = 0
                     k=2: x = Distance between A->B
-                    k=3: x = Distance from A->B->C->A.
+                    k=3: x = Distance from A->B->C->A. For the smooth cutoff
+                        the weight is the product of the functions of the
+                        distances A->B and B->C.
 
             species (iterable): The chemical species as a list of atomic
                 numbers or as a list of chemical symbols. Notice that this is not
@@ -208,7 +221,7 @@ class LMBTR(MBTR):
         """
         # If single system given, skip the parallelization
         if isinstance(system, (Atoms, System)):
-            return self.create_single(system, positions, scaled_positions)
+            return self.project(self.create_single(system, positions, scaled_positions))
 
         # Combine input arguments
         n_samples = len(system)
@@ -4,15 +4,16 @@ from builtins import (bytes, str, open, super, range, zip, round, input, int, po
 import math
 import numpy as np
 
-from scipy.spatial.distance import cdist
-from scipy.sparse import lil_matrix, coo_matrix
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
+import scipy.sparse
 from scipy.special import erf
 
 from ase import Atoms
 
-from dscribe.core import System
+from dscribe.core import System, BlockSparseTensor
 from dscribe.descriptors import Descriptor
-from dscribe.libmbtr.mbtrwrapper import MBTRWrapper
+from dscribe.libmbtr.mbtrwrapper import MBTRWrapper, gaussian_sums
 
 
 class MBTR(Descriptor):
@@ -27,8 +28,8 @@ class MBTR(Descriptor):
     and the following weighting functions:
 
     * k=1: unity(=no weighting)
-    * k=2: unity(=no weighting), exponential (:math:`e^-(sx)`)
-    * k=3: unity(=no weighting), exponential (:math:`e^-(sx)`)
+    * k=2: unity(=no weighting), exponential (:math:`e^-(sx)`), smooth cutoff
+    * k=3: unity(=no weighting), exponential (:math:`e^-(sx)`), smooth cutoff
 
     You can use this descriptor for finite and periodic systems. When dealing
     with periodic systems, it is advisable to use a primitive cell, or if
@@ -38,7 +39,9 @@ class MBTR(Descriptor):
     If flatten=False, a list of dense np.ndarrays for each k in ascending order
     is returned. These arrays are of dimension (n_elements x n_elements x
     n_grid_points), where the elements are sorted in ascending order by their
-    atomic number.
+    atomic number. If also sparse=True, each term is given as a
+    :class:`.BlockSparseTensor` that only stores the grid points of the element
+    combinations that are present in the system.
 
     If flatten=True, a scipy.sparse.coo_matrix is returned. This sparse matrix
     is of size (1, n_features), where n_features is given by
@@ -51,6 +54,8 @@ class MBTR(Descriptor):
     matrix.
     """
     decay_factor = math.sqrt(2)*3
+    default_window = 6
+    default_fft_resolution = 10
 
     def __init__(
             self,
@@ -63,7 +68,8 @@ class MBTR(Descriptor):
             normalize_by_volume=False,
             normalize_gaussians=True,
             flatten=True,
-            sparse=True
+            sparse=True,
+            columns=None
             ):
         """
         Args:
@@ -97,7 +103,18 @@ class MBTR(Descriptor):
                 Here *min* is the minimum value of the axis, *max* is the
                 maximum value of the axis, *sigma* is the standard devation of
                 the gaussian broadening and *n* is the number of points sampled
-                on the grid.
+                on the grid. The optional *window* is the number of standard
+                deviations around the center of each gaussian within which it
+                is evaluated, and it defaults to 6. The optional *broadening*
+                selects how the gaussians are summed: "direct" (default)
+                evaluates each gaussian separately, while "fft" bins the
+                values onto a finer grid and convolves them with the gaussian
+                using the fast Fourier transform. The latter is faster when
+                there are many values per element combination. Its accuracy
+                is controlled by the optional *resolution*, the number of
+                bins per standard deviation, which defaults to 10 and gives a
+                relative error of the order of 1e-4. The error decreases
+                quadratically with the resolution.
             weighting (dictionary or string): A dictionary of weighting
                 function settings for each term. Example::
 
@@ -122,12 +139,20 @@ class MBTR(Descriptor):
                 * unity: Constant weighting of 1 for all samples.
                 * exponential: Weighting of the form :math:`e^{-sx}`. The
                   parameter :math:`s` is given in the attribute *scale*.
+                * smooth_cutoff: Weighting of the form :math:`1 +
+                  y(x/r)^{y+1} - (y+1)(x/r)^y` that smoothly goes to zero at
+                  the cutoff radius :math:`r` given in the attribute *r_cut*.
+                  The optional attribute *sharpness* :math:`y` defaults to 2.
+                  As only the atoms within the cutoff radius are considered,
+                  the cost grows linearly with the system size.
 
                 The meaning of x changes for different terms as follows:
 
                 * :math:`k=1`: :math:`x` = 0
                 * :math:`k=2`: :math:`x` = Distance between A->B
-                * :math:`k=3`: :math:`x` = Distance from A->B->C->A.
+                * :math:`k=3`: :math:`x` = Distance from A->B->C->A. For the
+                  smooth cutoff the weight is the product of the functions of
+                  the distances A->B and B->C.
 
             species (iterable): The chemical species as a list of atomic
                 numbers or as a list of chemical symbols. Notice that this is not
@@ -151,15 +176,18 @@ class MBTR(Descriptor):
                 is provided, containing the values under keys: "k1", "k2", and
                 "k3":
             sparse (bool): Whether the output should be a sparse matrix or a
-                dense numpy array.
+                dense numpy array. If the output is not flattened, the tensors
+                are given as BlockSparseTensors that only store the element
+                combinations present in the system. The full tensors can be
+                created from them with toarray().
+            columns (iterable): A subset of the output columns to create,
+                given either as integer indices or as a boolean mask over the
+                get_number_of_full_features() columns of the full flattened
+                output. If given, the output will only contain these columns in
+                the given order. Only the k-terms, element combinations and
+                grid ranges needed by these columns are calculated, and the
+                atoms whose species do not take part in them are left out.
         """
-        if sparse and not flatten:
-            raise ValueError(
-                "Cannot provide a non-flattened output in sparse output because"
-                " only 2D sparse matrices are supported. If you want a "
-                "non-flattened output, please specify sparse=False in the MBTR"
-                "constructor."
-            )
         super().__init__(flatten, sparse)
         self.system = None
         if isinstance(k, int):
@@ -182,16 +210,20 @@ class MBTR(Descriptor):
         # Initializing .create() level variables
         self._interaction_limit = None
         self._is_local = False
-        self._k1_geoms = None
-        self._k1_weights = None
-        self._k2_geoms = None
-        self._k2_weights = None
-        self._k3_geoms = None
-        self._k3_weights = None
+        self._k1_values = None
+        self._k2_values = None
+        self._k3_values = None
         self._axis_k1 = None
         self._axis_k2 = None
         self._axis_k3 = None
 
+        if columns is not None and not flatten:
+            raise ValueError(
+                "A subset of columns can only be selected for a flattened "
+                "output."
+            )
+        self.columns = columns
+
     def update(self):
         """Checks and updates variables in mbtr class.
         """
@@ -216,7 +248,7 @@ class MBTR(Descriptor):
                 if k > 1:
                     weight_info = self.weighting["k{}".format(k)]
                     function = weight_info.get("function")
-                    valid_functions = set(("exponential", "unity"))
+                    valid_functions = set(("exponential", "smooth_cutoff", "unity"))
                     needed = ()
                     if function not in valid_functions:
                         raise ValueError(
@@ -226,6 +258,8 @@ class MBTR(Descriptor):
                     else:
                         if function == "exponential":
                             needed = ("cutoff", "scale")
+                        elif function == "smooth_cutoff":
+                            needed = ("r_cut",)
                     for key in needed:
                         value = weight_info.get(key)
                         if value is None:
@@ -234,6 +268,14 @@ class MBTR(Descriptor):
                                 "specification given in the MBTR constructor."
                                 .format(key)
                             )
+                    if function == "smooth_cutoff":
+                        for key, value in (("r_cut", weight_info["r_cut"]), ("sharpness", weight_info.get("sharpness", 2))):
+                            if value <= 0:
+                                raise ValueError(
+                                    "The value of '{}' in the 'weighting' "
+                                    "specification should be positive."
+                                    .format(key)
+                                )
 
         # Check that a weighting function is specified for each term k>1
         if self.periodic:
@@ -278,6 +320,13 @@ class MBTR(Descriptor):
                     assert info["min"] < info["max"], \
                         "The min value should be smaller than the max values"
 
+                    broadening = info.get("broadening", "direct")
+                    if broadening not in ("direct", "fft"):
+                        raise ValueError(
+                            "Unknown broadening '{}'. Please use either "
+                            "'direct' or 'fft'.".format(broadening)
+                        )
+
     def create(self, system, n_jobs=1, verbose=False):
         """Return MBTR output for the given systems.
 
@@ -299,7 +348,7 @@ class MBTR(Descriptor):
         """
         # If single system given, skip the parallelization
         if isinstance(system, (Atoms, System)):
-            return self.create_single(system)
+            return self.project(self.create_single(system))
 
         # Combine input arguments
         inp = [(i_sys,) for i_sys in system]
@@ -328,9 +377,10 @@ class MBTR(Descriptor):
             dict | np.ndarray | scipy.sparse.coo_matrix: The return type is
             specified by the 'flatten' and 'sparse'-parameters. If the output
             is not flattened, a dictionary containing of MBTR outputs as numpy
-            arrays is created. Each output is under a "kX" key. If the output
-            is flattened, a single concatenated output vector is returned,
-            either as a sparse or a dense vector.
+            arrays, or as BlockSparseTensors for sparse output, is created.
+            Each output is under a "kX" key. If the output is flattened, a
+            single concatenated output vector is returned, either as a sparse
+            or a dense vector.
        """
         # Transform the input system into the internal System-object
         system = self.get_system(system)
@@ -367,6 +417,91 @@ class MBTR(Descriptor):
         self.max_atomic_number = max(self._atomic_numbers)
         self.min_atomic_number = min(self._atomic_numbers)
 
+        # The column selection depends on the number of species
+        if self._columns is not None:
+            self.columns = self._columns
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @columns.setter
+    def columns(self, value):
+        """Used to check the validity of the selected output columns and to
+        map each of them to a k-term, element combination and grid point.
+
+        The distributions needed by the selected columns are calculated only
+        within the range of grid points that contains the selected columns.
+        These ranges are stored one after another in a compact array, from
+        which the final output is gathered.
+
+        Args:
+            value(iterable): The selected columns as integer indices or as a
+                boolean mask. None selects the full output.
+        """
+        if value is None:
+            self._columns = None
+            return
+        self._columns = self.get_column_indices(value, self.get_number_of_full_features())
+
+        # Enumerate the element combinations of each term in the order in
+        # which they appear in the output.
+        n_elem = self.n_elements
+        pairs = list(zip(*np.triu_indices(n_elem)))
+        combinations = {
+            1: [(i,) for i in range(n_elem)],
+            2: pairs,
+            3: [(i, j, k) for j in range(n_elem) for i, k in pairs],
+        }
+
+        self._column_terms = {}
+        column_index = np.empty(len(self._columns), dtype=np.int64)
+        n_compact = 0
+        offset = 0
+        for term in sorted(self.k):
+            n = self.grid["k{}".format(term)]["n"]
+            term_combinations = combinations[term]
+            size = len(term_combinations)*n
+            in_term = (self._columns >= offset) & (self._columns < offset + size)
+            local = self._columns[in_term] - offset
+            offset += size
+            if local.size == 0:
+                continue
+
+            blocks = {}
+            block_indices = local // n
+            grid_indices = local % n
+            compact = np.empty(local.size, dtype=np.int64)
+            for block in np.unique(block_indices):
+                block_mask = block_indices == block
+                g_start = grid_indices[block_mask].min()
+                g_end = grid_indices[block_mask].max()
+                blocks[term_combinations[block]] = (n_compact, g_start, g_end)
+                compact[block_mask] = n_compact + grid_indices[block_mask] - g_start
+                n_compact += g_end - g_start + 1
+            column_index[in_term] = compact
+            self._column_terms[term] = blocks
+
+        self._column_index = column_index
+        self._column_n_compact = n_compact
+
+    def get_column_system(self, system, term_number):
+        """Used to leave out the atoms whose species do not take part in the
+        element combinations needed by the selected columns of a term.
+
+        Args:
+            system (System): The atomic system.
+            term_number (int): The term number of the tensor.
+
+        Returns:
+            System: The atoms of the given system that contribute to the
+            selected columns.
+        """
+        indices = np.unique(list(self._column_terms[term_number].keys()))
+        species = np.asarray(self._atomic_numbers)[indices]
+
+        return system[np.isin(system.get_atomic_numbers(), species)]
+
     def create_with_grid(self, grid=None):
         """Used to recalculate MBTR for an already seen system but with
         different grid setttings. This function can be used after the scalar
@@ -378,68 +513,245 @@ class MBTR(Descriptor):
             self.check_grid(grid)
             self.grid = grid
 
+            # The column selection depends on the grid size
+            if self._columns is not None:
+                self.columns = self._columns
+
+        if self._columns is not None:
+            return self.create_columns()
+
+        return self.create_full(grid)
+
+    def create_with_grids(self, system, grids, n_jobs=1, verbose=False):
+        """Return MBTR output for the given systems with several different
+        grid settings. The geometry values and weights of each system are
+        calculated only once and then broadened with each of the grids, which
+        makes e.g. sweeping over the grid settings cheap. The grid of the
+        descriptor is not modified.
+
+        Args:
+            system (single or multiple class:`ase.Atoms`): One or many atomic structures.
+            grids (list of dict): The grid settings for each output. Each
+                grid is given in the same format as the grid in the
+                constructor.
+            n_jobs (int): Number of parallel jobs to instantiate. Parallellizes
+                the calculation across samples. Defaults to serial calculation
+                with n_jobs=1.
+            verbose(bool): Controls whether to print the progress of each job
+                into to the console.
+
+        Returns:
+            list: The output for each grid, in the same order as the grids.
+            Each output is of the same type as the output of create() would be
+            with that grid.
+        """
+        if self._is_local:
+            raise ValueError(
+                "Creating the output with several grids is only supported for "
+                "the global MBTR."
+            )
+        if self._columns is not None or self._projection is not None:
+            raise ValueError(
+                "Creating the output with several grids is not supported when "
+                "a subset of columns or a projection has been set, as they "
+                "depend on the grid."
+            )
+        for grid in grids:
+            self.check_grid(grid)
+
+        # If single system given, skip the parallelization
+        if isinstance(system, (Atoms, System)):
+            return self.create_single_with_grids(system, grids)
+
+        # The outputs of each system are collected in a list and combined
+        # for each grid afterwards, as the grids have different sizes.
+        inp = [(i_sys, grids) for i_sys in system]
+        results = self.create_parallel(inp, self.create_single_with_grids, n_jobs, verbose=verbose)
+
+        outputs = []
+        for i_grid in range(len(grids)):
+            grid_results = [result[i_grid] for result in results]
+            if not self._flatten:
+                outputs.append(grid_results)
+            elif self._sparse:
+                outputs.append(scipy.sparse.vstack(grid_results, format="csr", dtype=np.float32))
+            else:
+                outputs.append(np.concatenate(grid_results, axis=0))
+
+        return outputs
+
+    def create_single_with_grids(self, system, grids):
+        """Return the many-body tensor representation for the given system
+        with each of the given grid settings.
+
+        Args:
+            system (:class:`ase.Atoms` | :class:`.System`): Input system.
+            grids (list of dict): The grid settings for each output.
+
+        Returns:
+            list: The output for each grid, in the same order as the grids.
+        """
+        system = self.get_system(system)
+        self.initialize_scalars(system)
+
+        return [self.create_full(grid) for grid in grids]
+
+    def create_full(self, grid):
+        """Used to create the full output for an already seen system with the
+        given grid settings.
+
+        Args:
+            grid (dict): The grid settings.
+
+        Returns:
+            dict | np.ndarray | scipy.sparse.coo_matrix: The output as
+            described in create_single().
+        """
+        if self._flatten:
+            if self._sparse:
+                return self.create_full_sparse(grid)
+
+            # The flattened terms are written directly into their blocks of a
+            # single preallocated row, one after another in the order of k.
+            term_functions = {1: self.K1, 2: self.K2, 3: self.K3}
+            terms = sorted(self.k)
+            sizes = self.get_term_sizes(grid)
+            mbtr = np.zeros((1, sum(sizes)), dtype=np.float32)
+            offset = 0
+            for term, size in zip(terms, sizes):
+                term_functions[term](grid["k{}".format(term)], mbtr[:, offset:offset+size])
+                offset += size
+
+            # Normalize with respect to cell volume if requested
+            if self.normalize_by_volume:
+                mbtr /= self.system.get_volume()
+
+            return mbtr
+
         mbtr = {}
         if 1 in self.k:
-            settings_k1 = self.get_k1_settings()
-            k1 = self.K1(settings_k1)
+            k1 = self.K1(grid["k1"])
             mbtr["k1"] = k1
 
         if 2 in self.k:
-            settings_k2 = self.get_k2_settings()
-            k2 = self.K2(settings_k2)
+            k2 = self.K2(grid["k2"])
             mbtr["k2"] = k2
 
         if 3 in self.k:
-            settings_k3 = self.get_k3_settings()
-            k3 = self.K3(settings_k3)
+            k3 = self.K3(grid["k3"])
             mbtr["k3"] = k3
 
         # Normalize with respect to cell volume if requested
         if self.normalize_by_volume:
             volume = self.system.get_volume()
             for key, value in mbtr.items():
-                norm_value = value/volume
-                mbtr[key] = norm_value
-
-        # Flatten output if requested
-        if self._flatten:
-            length = 0
-
-            datas = []
-            rows = []
-            cols = []
-            for key in sorted(mbtr.keys()):
-                tensor = mbtr[key]
-                size = tensor.shape[1]
-                coo = tensor.tocoo()
-                datas.append(coo.data)
-                rows.append(coo.row)
-                cols.append(coo.col + length)
-                length += size
-
-            datas = np.concatenate(datas)
-            rows = np.concatenate(rows)
-            cols = np.concatenate(cols)
-            mbtr = coo_matrix((datas, (rows, cols)), shape=[1, length], dtype=np.float32)
-
-            # Make into a dense array if requested
-            if not self._sparse:
-                mbtr = mbtr.toarray()
+                if self._sparse:
+                    value.data /= volume
+                else:
+                    norm_value = value/volume
+                    mbtr[key] = norm_value
 
         return mbtr
 
+    def create_full_sparse(self, grid):
+        """Used to create the full flattened output as a sparse matrix. Only
+        the blocks of the element combinations that are present in the system
+        are broadened, and the grid points that are zero are left out.
+
+        Args:
+            grid (dict): The grid settings.
+
+        Returns:
+            scipy.sparse.coo_matrix: The output for the system.
+        """
+        datas = []
+        cols = []
+        offset = 0
+        for term, size in zip(sorted(self.k), self.get_term_sizes(grid)):
+            settings = grid["k{}".format(term)]
+            n = settings["n"]
+            blocks = self.get_block_indices(term)
+            values = np.zeros(len(blocks)*n, dtype=np.float32)
+            self.broaden(term, settings, values, np.arange(len(blocks), dtype=np.int32)*n)
+            columns = offset + (blocks[:, np.newaxis]*n + np.arange(n)).reshape(-1)
+            nonzero = np.nonzero(values)[0]
+            datas.append(values[nonzero])
+            cols.append(columns[nonzero])
+            offset += size
+
+        datas = np.concatenate(datas)
+        cols = np.concatenate(cols)
+        order = np.argsort(cols, kind="stable")
+        datas = datas[order]
+        cols = cols[order]
+
+        # Normalize with respect to cell volume if requested
+        if self.normalize_by_volume:
+            datas /= self.system.get_volume()
+
+        rows = np.zeros(len(cols), dtype=cols.dtype)
+        return coo_matrix((datas, (rows, cols)), shape=[1, offset], dtype=np.float32)
+
+    def get_term_sizes(self, grid):
+        """Returns the number of features of each term in the flattened
+        output.
+
+        Args:
+            grid (dict): The grid settings.
+
+        Returns:
+            list: The number of features of each term in the order of k.
+        """
+        n_elem = self.n_elements
+        n_combinations = {
+            1: n_elem,
+            2: n_elem*(n_elem+1)//2,
+            3: n_elem*n_elem*(n_elem+1)//2,
+        }
+        return [n_combinations[term]*grid["k{}".format(term)]["n"] for term in sorted(self.k)]
+
+    def create_columns(self):
+        """Used to create the selected columns of the flattened output. The
+        gaussian broadening is only performed within the needed range of grid
+        points for each needed element combination.
+
+        Returns:
+            np.ndarray | scipy.sparse.coo_matrix: The selected columns of the
+            MBTR output.
+        """
+        values = np.zeros(self._column_n_compact, dtype=np.float32)
+        for term, blocks in self._column_terms.items():
+            settings = self.grid["k{}".format(term)]
+            species = getattr(self, "_k{}_values".format(term))[0]
+            n_combinations = len(species)
+            starts = np.full(n_combinations, -1, dtype=np.int32)
+            grid_starts = np.zeros(n_combinations, dtype=np.int32)
+            grid_ends = np.zeros(n_combinations, dtype=np.int32)
+            for c, key in enumerate(species.tolist()):
+                block = blocks.get(tuple(key))
+                if block is not None:
+                    starts[c], grid_starts[c], grid_ends[c] = block
+            self.broaden(term, settings, values, starts, grid_starts, grid_ends)
+
+        # Normalize with respect to cell volume if requested
+        if self.normalize_by_volume:
+            values /= self.system.get_volume()
+
+        output = values[self._column_index][np.newaxis, :]
+        if self._sparse:
+            output = coo_matrix(output)
+
+        return output
+
     def initialize_scalars(self, system):
         """Used to initialize the scalar values for each k-term.
         """
         # Ensuring variables are re-initialized when a new system is introduced
         self._interaction_limit = None
         self.system = system
-        self._k1_geoms = None
-        self._k1_weights = None
-        self._k2_geoms = None
-        self._k2_weights = None
-        self._k3_geoms = None
-        self._k3_weights = None
+        self._k1_values = None
+        self._k2_values = None
+        self._k3_values = None
         self._axis_k1 = None
         self._axis_k2 = None
         self._axis_k3 = None
@@ -455,27 +767,109 @@ class MBTR(Descriptor):
         # of atomic numbers
         self.check_atomic_numbers(system.get_atomic_numbers())
 
-        if 1 in self.k:
-            self.k1_geoms_and_weights(system)
-        if 2 in self.k:
-            # If needed, create the extended system
-            system_k2 = system
-            if self.periodic:
-                system_k2 = self.create_extended_system(system, 2)
-            self.k2_geoms_and_weights(system_k2)
+        # If only a subset of the columns is requested, the terms that are not
+        # needed are skipped and the atoms that do not contribute to the needed
+        # element combinations are left out.
+        if self._columns is None:
+            terms = self.k
+        else:
+            terms = self._column_terms.keys()
+        filter_atoms = self._columns is not None and not self._is_local
+        geoms_and_weights = {
+            1: self.k1_geoms_and_weights,
+            2: self.k2_geoms_and_weights,
+            3: self.k3_geoms_and_weights,
+        }
+
+        if filter_atoms:
+            # Each term is calculated for its own subset of the atoms
+            if 1 in terms:
+                cmbtr = self.create_wrapper(system.get_positions(), system.get_atomic_numbers())
+                self.k1_geoms_and_weights(cmbtr)
+            for term_number in (2, 3):
+                if term_number not in terms:
+                    continue
+                system_k = self.get_column_system(system, term_number)
+                self._interaction_limit = len(system_k)
+                if len(system_k) == 0:
+                    values = self.get_empty_geoms_and_weights(term_number)
+                    if term_number == 2:
+                        self._k2_values = values
+                    else:
+                        self._k3_values = values
+                    continue
 
-            # Free memory
-            system_k2 = None
+                cmbtr = self.create_system_wrapper(system_k, [term_number])
+                geoms_and_weights[term_number](cmbtr)
+        else:
+            # A single instance is shared by all the terms
+            cmbtr = self.create_system_wrapper(system, terms)
+            for term_number in (1, 2, 3):
+                if term_number in terms:
+                    geoms_and_weights[term_number](cmbtr)
+
+    def create_system_wrapper(self, system, term_numbers):
+        """Creates the C++ implementation for the given system that can be
+        used for all the given terms.
+
+        For the global MBTR of a periodic system the atoms in the cell are
+        given together with a neighbour list of the periodic images within
+        the reach of the terms. For the local MBTR, the extended system of the
+        term that reaches farthest is used, as it contains all the atoms
+        needed by the other terms. In both cases the pairs and triplets that
+        are out of reach for a term are not enumerated.
 
-        if 3 in self.k:
-            # If needed, create the extended system
-            system_k3 = system
-            if self.periodic:
-                system_k3 = self.create_extended_system(system, 3)
-            self.k3_geoms_and_weights(system_k3)
+        Args:
+            system (System): The atomic system.
+            term_numbers (iterable): The term numbers that are calculated.
 
-            # Free memory
-            system_k3 = None
+        Returns:
+            MBTRWrapper: The C++ implementation for the system.
+        """
+        extended_terms = [term_number for term_number in (2, 3) if term_number in term_numbers]
+        if not self.periodic or not extended_terms:
+            return self.create_wrapper(system.get_positions(), system.get_atomic_numbers())
+
+        if self._is_local:
+            term_number = max(extended_terms, key=self.get_extension_distance)
+            positions, numbers = self.create_extended_system(system, term_number)
+            return self.create_wrapper(positions, numbers)
+
+        # The neighbour list is searched with a slightly larger radius, so
+        # that rounding does not leave out neighbours at the cutoff
+        radius = max(self.get_neighbour_distance(term_number) for term_number in extended_terms)
+        neighbour_list = self.get_periodic_neighbours(system, radius*(1 + 1e-3))
+        return self.create_wrapper(
+            system.get_positions(),
+            system.get_atomic_numbers(),
+            system.get_cell(),
+            neighbour_list
+        )
+
+    def create_wrapper(self, positions, numbers, cell=None, neighbour_list=None):
+        """Creates the C++ implementation for the given atoms. The same
+        instance can be used for all the k-terms.
+
+        Args:
+            positions (np.ndarray): The cartesian positions of the atoms.
+            numbers (np.ndarray): The atomic numbers of the atoms.
+            cell (np.ndarray): The cell of a periodic system.
+            neighbour_list (tuple): The neighbour list of a periodic system
+                as returned by get_periodic_neighbours(). If given, all the
+                atoms are interacting.
+
+        Returns:
+            MBTRWrapper: The C++ implementation for the atoms.
+        """
+        return MBTRWrapper(
+            positions,
+            numbers,
+            self.atomic_number_to_index,
+            interaction_limit=self._interaction_limit,
+            is_local=self._is_local,
+            cell=cell,
+            neighbour_list=neighbour_list
+        )
 
     def get_k1_settings(self):
         """Returns the min, max, dx and sigma for K1.
@@ -499,6 +893,18 @@ class MBTR(Descriptor):
         Returns:
             int: Number of features for this descriptor.
         """
+        if self._columns is not None:
+            return len(self._columns)
+
+        return self.get_number_of_full_features()
+
+    def get_number_of_full_features(self):
+        """Used to inquire the number of features in the full output, before
+        a possible column selection.
+
+        Returns:
+            int: Number of features in the full output.
+        """
         n_features = 0
         n_elem = self.n_elements
 
@@ -521,6 +927,134 @@ class MBTR(Descriptor):
 
         return int(n_features)
 
+    def get_neighbour_distance(self, term_number):
+        """Returns the maximum distance between the middle atom and the other
+        atoms of the pairs and triplets that contribute to the given term.
+
+        Args:
+            term_number (int): The term number of the tensor.
+
+        Returns:
+            float: The cutoff radius of the smooth cutoff, or the distance at
+            which the exponential weight comes down to the given threshold.
+            For terms k>2 the latter distance is halved.
+        """
+        weight_info = self.weighting["k{}".format(term_number)]
+        if weight_info["function"] == "smooth_cutoff":
+            return weight_info["r_cut"]
+        max_distance = -np.log(weight_info["cutoff"])/weight_info["scale"]
+        if term_number > 2:
+            max_distance /= 2
+        return max_distance
+
+    def get_extension_distance(self, term_number):
+        """Returns the maximum distance from the interacting atoms at which
+        the atoms can still contribute to the given term in a periodic system.
+
+        Args:
+            term_number (int): The term number of the tensor.
+
+        Returns:
+            float: The neighbour distance, see get_neighbour_distance(). With
+            the smooth cutoff the atoms of a triplet are only limited by their
+            distance to the middle atom, so for terms k>2 the distance is
+            doubled.
+        """
+        max_distance = self.get_neighbour_distance(term_number)
+        weight_info = self.weighting["k{}".format(term_number)]
+        if term_number > 2 and weight_info["function"] == "smooth_cutoff":
+            max_distance *= 2
+        return max_distance
+
+    def get_translations(self, cell, relative_pos, interacting_pos, max_distance):
+        """Returns the translations of the cell within which the copies of
+        the given atoms can be closer than the given distance to the
+        interacting atoms.
+
+        The number of copies along each cell vector is determined from the
+        distance between the lattice planes spanned by the two other cell
+        vectors, so that the copies cover all atoms within the distance also
+        in anisotropic and skewed cells.
+
+        Args:
+            cell (np.ndarray): The cell vectors.
+            relative_pos (np.ndarray): The scaled positions of the copied
+                atoms.
+            interacting_pos (np.ndarray): The scaled positions of the
+                interacting atoms.
+            max_distance (float): The maximum distance.
+
+        Returns:
+            np.ndarray: The translations in units of the cell vectors,
+            including the zero translation, in descending order.
+        """
+        # A copy translated by n cells along a cell vector is at least |n + ds|
+        # plane spacings away from an interacting atom, where ds is the
+        # difference of their scaled positions along that vector. This gives
+        # the range of translations needed along each axis.
+        volume = np.abs(np.linalg.det(cell))
+        plane_spacings = volume/np.linalg.norm(np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]]), axis=1)
+        reach = max_distance/plane_spacings
+        diff_min = relative_pos.min(axis=0) - interacting_pos.max(axis=0)
+        diff_max = relative_pos.max(axis=0) - interacting_pos.min(axis=0)
+        lower = np.ceil(-reach - diff_max).astype(int)
+        upper = np.floor(reach - diff_min).astype(int)
+
+        # The translations are ordered in the same way as the cell copies have
+        # originally been created.
+        ranges = [np.arange(upper[i], lower[i] - 1, -1) for i in range(3)]
+        translations = np.stack(np.meshgrid(*ranges, indexing="ij"), axis=-1).reshape(-1, 3)
+
+        return translations
+
+    def get_periodic_neighbours(self, system, radius):
+        """Used to find the atoms and their periodic images within the given
+        distance of each atom in the cell.
+
+        Args:
+            system (System): The periodic system.
+            radius (float): The maximum distance.
+
+        Returns:
+            tuple: (offsets, neighbours, translations) The neighbours of atom
+            i are the entries offsets[i] to offsets[i+1]-1. For each entry,
+            neighbours contains the index of the atom in the cell and
+            translations the translation of its cell in units of the cell
+            vectors. The atom itself is not included in its neighbours, but
+            its periodic images are.
+        """
+        relative_pos = np.array(system.get_scaled_positions(wrap=False))
+        cartesian_pos = np.array(system.get_positions())
+        cell = np.array(system.get_cell())
+        n_atoms = len(relative_pos)
+
+        translations = self.get_translations(cell, relative_pos, relative_pos, radius)
+        images = np.dot(relative_pos[np.newaxis, :, :] + translations[:, np.newaxis, :], cell).reshape(-1, 3)
+        pairs = cKDTree(cartesian_pos).sparse_distance_matrix(
+            cKDTree(images),
+            radius,
+            output_type="ndarray"
+        )
+        centers = pairs["i"]
+        image_indices = pairs["j"]
+
+        # Leave out each atom from its own neighbours and order the entries
+        # by the atom in the cell
+        zero_translation = np.nonzero(np.all(translations == 0, axis=1))[0][0]
+        valid = image_indices != zero_translation*n_atoms + centers
+        centers = centers[valid]
+        image_indices = image_indices[valid]
+        order = np.lexsort((image_indices, centers))
+        centers = centers[order]
+        image_indices = image_indices[order]
+
+        offsets = np.zeros(n_atoms + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum(np.bincount(centers, minlength=n_atoms))
+        neighbours = image_indices % n_atoms
+        neighbour_translations = translations[image_indices // n_atoms]
+
+        return offsets, neighbours, neighbour_translations
+
     def create_extended_system(self, primitive_system, term_number):
         """Used to create a periodically extended system, that is as small as
         possible by rejecting atoms for which the given weighting will be below
@@ -529,6 +1063,10 @@ class MBTR(Descriptor):
         Modified for the local MBTR to only consider distances from the central
         atom and to enable taking the virtual sites into account.
 
+        The copies cover all atoms within the cutoff distance, see
+        get_translations(). All copies are created and filtered in a single
+        batch.
+
         Args:
             primitive_system (System): The original primitive system to
                 duplicate.
@@ -536,11 +1074,11 @@ class MBTR(Descriptor):
                 distance is x, for k>2, the distance is given by 2*x.
 
         Returns:
-            System: The new system that is extended so that each atom can at
-            most have a weight that is larger or equivalent to the given
-            threshold.
+            tuple: (positions, numbers) The cartesian positions and atomic
+            numbers of the extended system, where each atom can at most have a
+            weight that is larger or equivalent to the given threshold. The
+            atoms of the original system come first in their original order.
         """
-
         # We need to speciy that the relative positions should not be wrapped.
         # Otherwise the repeated systems may overlap with the positions taken
         # with get_positions()
@@ -549,108 +1087,46 @@ class MBTR(Descriptor):
         cartesian_pos = np.array(primitive_system.get_positions())
         cell = np.array(primitive_system.get_cell())
 
-        # Determine the upper limit of how many copies we need in each cell
-        # vector direction. We take as many copies as needed for the
-        # exponential weight to come down to the given threshold.
-        cell_vector_lengths = np.linalg.norm(cell, axis=1)
-        n_copies_axis = np.zeros(3, dtype=int)
-        weight_info = self.weighting["k{}".format(term_number)]
-        weighting_function = weight_info["function"]
-        cutoff = self.weighting["k{}".format(term_number)]["cutoff"]
-
-        if weighting_function == "exponential":
-            scale = weight_info["scale"]
-            function = lambda x: np.exp(-scale*x)
-
-        for i_axis, axis_length in enumerate(cell_vector_lengths):
-            limit_found = False
-            n_copies = -1
-            while (not limit_found):
-                n_copies += 1
-                distance = n_copies*cell_vector_lengths[0]
-
-                # For terms k>2 we double the distances to take into
-                # account the "loop" that is required.
-                if term_number > 2:
-                    distance = 2*distance
-
-                weight = function(distance)
-                if weight < cutoff:
-                    n_copies_axis[i_axis] = n_copies
-                    limit_found = True
-
-        # Create copies of the cell but keep track of the atoms in the
-        # original cell
-        num_extended = []
-        pos_extended = []
-        num_extended.append(numbers)
-        pos_extended.append(cartesian_pos)
-        a = np.array([1, 0, 0])
-        b = np.array([0, 1, 0])
-        c = np.array([0, 0, 1])
-        for i in range(-n_copies_axis[0], n_copies_axis[0]+1):
-            for j in range(-n_copies_axis[1], n_copies_axis[1]+1):
-                for k in range(-n_copies_axis[2], n_copies_axis[2]+1):
-                    if i == 0 and j == 0 and k == 0:
-                        continue
-
-                    # Calculate the positions of the copied atoms and filter
-                    # out the atoms that are farther away than the given
-                    # cutoff.
-
-                    # If the given position is virtual and does not correspond
-                    # to a physical atom, the position is not repeated in the
-                    # copies.
-                    if self.virtual_positions and self._interaction_limit == 1:
-                        num_copy = np.array(numbers)[1:]
-                        pos_copy = np.array(relative_pos)[1:]
-
-                    # If the given position is not virtual and corresponds to
-                    # an actual physical atom, the ghost atom is repeated in
-                    # the extended system.
-                    else:
-                        num_copy = np.array(numbers)
-                        pos_copy = np.array(relative_pos)
-
-                    pos_shifted = pos_copy-i*a-j*b-k*c
-                    pos_copy_cartesian = np.dot(pos_shifted, cell)
-
-                    # Only distances to the atoms within the interaction limit
-                    # are considered.
-                    positions_to_consider = cartesian_pos[0:self._interaction_limit]
-                    distances = cdist(pos_copy_cartesian, positions_to_consider)
-
-                    # For terms above k==2 we double the distances to take into
-                    # account the "loop" that is required.
-                    if term_number > 2:
-                        distances *= 2
-
-                    weights = function(distances)
-                    weight_mask = weights >= cutoff
-
-                    # Create a boolean mask that says if the atom is within the
-                    # range from at least one atom in the original cell
-                    valids_mask = np.any(weight_mask, axis=1)
-
-                    valid_pos = pos_copy_cartesian[valids_mask]
-                    valid_num = num_copy[valids_mask]
-
-                    pos_extended.append(valid_pos)
-                    num_extended.append(valid_num)
-
-        pos_extended = np.concatenate(pos_extended)
-        num_extended = np.concatenate(num_extended)
-
-        extended_system = System(
-            positions=pos_extended,
-            numbers=num_extended,
-            cell=cell,
-            pbc=False
-        )
-
-        return extended_system
-
-    def gaussian_sum(self, centers, weights, settings):
+        # The weight comes down to the given threshold, or to zero, at a
+        # maximum distance from the interacting atoms.
+        max_distance = self.get_extension_distance(term_number)
+
+        # If the given position is virtual and does not correspond to a
+        # physical atom, the position is not repeated in the copies. If the
+        # given position is not virtual and corresponds to an actual physical
+        # atom, the ghost atom is repeated in the extended system.
+        if self.virtual_positions and self._interaction_limit == 1:
+            num_copy = numbers[1:]
+            pos_copy = relative_pos[1:]
+        else:
+            num_copy = numbers
+            pos_copy = relative_pos
+
+        # Only distances to the atoms within the interaction limit are
+        # considered.
+        interacting_pos = relative_pos[0:self._interaction_limit]
+        if len(num_copy) == 0 or len(interacting_pos) == 0:
+            return cartesian_pos, numbers
+
+        translations = self.get_translations(cell, pos_copy, interacting_pos, max_distance)
+        translations = translations[np.any(translations != 0, axis=1)]
+
+        # Calculate the positions of all copied atoms and filter out the atoms
+        # that are farther away than the given cutoff from all interacting
+        # atoms.
+        pos_shifted = pos_copy[np.newaxis, :, :] + translations[:, np.newaxis, :]
+        pos_copy_cartesian = np.dot(pos_shifted, cell).reshape(-1, 3)
+        num_copy = np.tile(num_copy, len(translations))
+        tree = cKDTree(cartesian_pos[0:self._interaction_limit])
+        distances, _ = tree.query(pos_copy_cartesian, distance_upper_bound=max_distance*(1 + 1e-6))
+        valids_mask = np.isfinite(distances)
+
+        pos_extended = np.concatenate([cartesian_pos, pos_copy_cartesian[valids_mask]])
+        num_extended = np.concatenate([numbers, num_copy[valids_mask]])
+
+        return pos_extended, num_extended
+
+    def gaussian_sum(self, centers, weights, settings, grid_range=None):
         """Calculates a discrete version of a sum of Gaussian distributions.
 
         The calculation is done through the cumulative distribution function
@@ -664,77 +1140,222 @@ class MBTR(Descriptor):
             centers (1D np.ndarray): The means of the gaussians.
             weights (1D np.ndarray): The weights for the gaussians.
             settings (dict): The grid settings
+            grid_range (tuple): The indices of the first and last grid point
+                to evaluate. If not given, the whole grid is evaluated.
 
         Returns:
             Value of the gaussian sums on the given grid.
         """
+        if grid_range is None:
+            grid_range = (0, settings["n"] - 1)
+        g_start, g_end = grid_range
+        output = np.zeros(g_end - g_start + 1, dtype=np.float32)
+        self.gaussian_sums(
+            settings,
+            np.asarray(centers, dtype=np.float32),
+            np.asarray(weights, dtype=np.float32),
+            np.array([0, len(centers)], dtype=np.int32),
+            output,
+            np.zeros(1, dtype=np.int32),
+            np.array([g_start], dtype=np.int32),
+            np.array([g_end], dtype=np.int32),
+        )
+
+        return output
+
+    def broaden(self, k, settings, output, starts, grid_starts=None, grid_ends=None):
+        """Used to broaden the geometry function values of each element
+        combination in the given term and to add the distributions to the
+        output.
+
+        Args:
+            k (int): The term.
+            settings (dict): The grid settings.
+            output (np.ndarray): C-contiguous float32 array to which the
+                distributions are added.
+            starts (np.ndarray): The index in the flattened output of the first
+                evaluated grid point for each element combination. Negative
+                values skip the combination.
+            grid_starts (np.ndarray): The first evaluated grid point for each
+                element combination. Defaults to the first point of the grid.
+            grid_ends (np.ndarray): The last evaluated grid point for each
+                element combination. Defaults to the last point of the grid.
+        """
+        species, offsets, geoms, weights = getattr(self, "_k{}_values".format(k))
+        n_combinations = len(species)
+        if grid_starts is None:
+            grid_starts = np.zeros(n_combinations, dtype=np.int32)
+        if grid_ends is None:
+            grid_ends = np.full(n_combinations, settings["n"] - 1, dtype=np.int32)
+        self.gaussian_sums(
+            settings,
+            geoms,
+            weights,
+            offsets,
+            output,
+            starts,
+            grid_starts,
+            grid_ends,
+        )
+
+    def gaussian_sums(self, settings, centers, weights, offsets, output, starts, grid_starts, grid_ends):
+        """Used to call the C++ implementation of the gaussian broadening. Each
+        gaussian is only evaluated within a window of a given number of
+        standard deviations around its center, which can be set with the
+        optional "window" key of the grid settings. If the "broadening" key of
+        the grid settings is "fft", gaussian_sums_fft() is used instead.
+        """
+        if settings.get("broadening", "direct") == "fft":
+            self.gaussian_sums_fft(settings, centers, weights, offsets, output, starts, grid_starts, grid_ends)
+            return
+
+        gaussian_sums(
+            centers,
+            weights,
+            offsets,
+            np.ascontiguousarray(starts, dtype=np.int32),
+            np.ascontiguousarray(grid_starts, dtype=np.int32),
+            np.ascontiguousarray(grid_ends, dtype=np.int32),
+            settings["min"],
+            settings["max"],
+            settings["sigma"],
+            settings["n"],
+            settings.get("window", self.default_window),
+            self.normalize_gaussians,
+            output.reshape(-1),
+        )
+
+    def gaussian_sums_fft(self, settings, centers, weights, offsets, output, starts, grid_starts, grid_ends):
+        """Used to calculate the gaussian broadening with the fast Fourier
+        transform. The weights are distributed linearly to the two nearest
+        points of a fine grid (cloud-in-cell), and the result is convolved
+        with the same gaussian that is integrated over each grid spacing as
+        in the direct broadening. The cost grows with the number of values
+        plus n*log(n) instead of the number of values times n.
+
+        The fine grid has a spacing that divides the spacing of the output
+        grid and has at least the number of points given by the "resolution"
+        key of the grid settings per standard deviation.
+
+        Args:
+            settings (dict): The grid settings.
+            centers (np.ndarray): The geometry function values of all element
+                combinations.
+            weights (np.ndarray): The weights of the values.
+            offsets (np.ndarray): The values of combination c are in the
+                range offsets[c] to offsets[c+1]-1.
+            output (np.ndarray): The output to which the distributions are
+                added.
+            starts (np.ndarray): The position in the output for the first
+                evaluated grid point of each combination. Combinations with a
+                negative position are skipped.
+            grid_starts (np.ndarray): The first evaluated grid point of each
+                combination.
+            grid_ends (np.ndarray): The last evaluated grid point of each
+                combination.
+        """
         start = settings["min"]
         stop = settings["max"]
         sigma = settings["sigma"]
         n = settings["n"]
+        window = settings.get("window", self.default_window)
+        resolution = settings.get("resolution", self.default_fft_resolution)
+        dx = (stop - start)/(n - 1)
+
+        # The fine grid extends beyond the output grid by the reach of the
+        # gaussians, so that the values outside the grid are also included.
+        n_sub = max(1, int(math.ceil(resolution*dx/sigma)))
+        h = dx/n_sub
+        n_pad = int(math.ceil((window*sigma + dx/2)/h))
+        n_fine = (n - 1)*n_sub + 1 + 2*n_pad
+        fine_start = start - n_pad*h
+
+        # Each needed combination gets its own row in the fine grid
+        starts = np.asarray(starts)
+        present = np.nonzero(starts >= 0)[0]
+        n_present = len(present)
+        if n_present == 0:
+            return
+        rows = np.full(len(starts), -1, dtype=np.int64)
+        rows[present] = np.arange(n_present)
+        value_rows = np.repeat(rows, np.diff(offsets))
+        needed = value_rows >= 0
+        value_rows = value_rows[needed]
+        position = (centers[needed].astype(np.float64) - fine_start)/h
+        left = np.floor(position).astype(np.int64)
+        fraction = position - left
+        value_weights = weights[needed].astype(np.float64)
+
+        binned = np.zeros(n_present*n_fine)
+        for index, value in ((left, value_weights*(1 - fraction)), (left + 1, value_weights*fraction)):
+            valid = (index >= 0) & (index < n_fine)
+            binned += np.bincount(
+                value_rows[valid]*n_fine + index[valid],
+                weights=value[valid],
+                minlength=n_present*n_fine
+            )
+        binned = binned.reshape(n_present, n_fine)
 
-        dx = (stop - start)/(n-1)
-        x = np.linspace(start-dx/2, stop+dx/2, n+1)
-        pos = x[np.newaxis, :] - centers[:, np.newaxis]
-        y = weights[:, np.newaxis]*1/2*(1 + erf(pos/(sigma*np.sqrt(2))))
-        f = np.sum(y, axis=0)
-
+        # The gaussian integrated over one grid spacing, divided by the
+        # spacing, at each offset of the fine grid within the reach.
+        offsets_fine = np.arange(-n_pad, n_pad + 1)*h
+        scale = 1/(sigma*math.sqrt(2))
+        factor = 1/(2*dx)
         if not self.normalize_gaussians:
-            max_val = 1/(sigma*math.sqrt(2*math.pi))
-            f /= max_val
-
-        f_rolled = np.roll(f, -1)
-        pdf = (f_rolled - f)[0:-1]/dx  # PDF is the derivative of CDF
-
-        return pdf
-
-    def k1_geoms_and_weights(self, system):
+            factor *= sigma*math.sqrt(2*math.pi)
+        kernel = factor*(erf((offsets_fine + dx/2)*scale) - erf((offsets_fine - dx/2)*scale))
+
+        # Linear convolution through a zero-padded transform
+        n_fft = 2**int(math.ceil(math.log(n_fine + 2*n_pad, 2)))
+        convolved = np.fft.irfft(
+            np.fft.rfft(binned, n_fft, axis=1)*np.fft.rfft(kernel, n_fft),
+            n_fft,
+            axis=1
+        )
+        values = convolved[:, 2*n_pad + np.arange(n)*n_sub]
+
+        # Add the evaluated range of grid points of each combination to the
+        # output
+        grid_starts = np.asarray(grid_starts)[present]
+        lengths = np.asarray(grid_ends)[present] - grid_starts + 1
+        value_rows = np.repeat(np.arange(n_present), lengths)
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        flat_output = output.reshape(-1)
+        flat_output[starts[present][value_rows] + within] += values[value_rows, grid_starts[value_rows] + within]
+
+    def k1_geoms_and_weights(self, cmbtr):
         """Calculate the atom count for each element.
 
         Args:
-            system (System): The atomic system.
+            cmbtr (MBTRWrapper): The C++ implementation created for the atoms.
 
         Returns:
-            1D ndarray: The counts for each element in a list where the index
-            of atomic number x is self.atomic_number_to_index[x]
+            tuple: (species, offsets, geoms, weights) The atomic numbers of the
+            atoms and unit weights for each element as described in
+            get_geoms_and_weights().
         """
-        if self._k1_geoms is None or self._k1_weights is None:
-
-            cmbtr = MBTRWrapper(
-                system.get_positions(),
-                system.get_atomic_numbers(),
-                self.atomic_number_to_index,
-                interaction_limit=self._interaction_limit,
-                is_local=self._is_local
-            )
+        if self._k1_values is None:
 
             # For k=1, the geometry function is given by the atomic number, and
             # the weighting function is unity by default.
             parameters = {}
-            self._k1_geoms, self._k1_weights = cmbtr.get_k1_geoms_and_weights(geom_func=b"atomic_number", weight_func=b"unity", parameters=parameters)
-        return self._k1_geoms, self._k1_weights
+            self._k1_values = cmbtr.get_k1_geoms_and_weights(geom_func=b"atomic_number", weight_func=b"unity", parameters=parameters)
+        return self._k1_values
 
-    def k2_geoms_and_weights(self, system):
+    def k2_geoms_and_weights(self, cmbtr):
         """Calculates the value of the geometry function and corresponding
         weights for unique two-body combinations.
 
         Args:
-            system (System): The atomic system.
+            cmbtr (MBTRWrapper): The C++ implementation created for the atoms.
 
         Returns:
-            dict: Inverse distances in the form: {(i, j): [list of angles] }.
-            The dictionaries are filled so that the entry for pair i and j is
-            in the entry where j>=i.
-        """
-        if self._k2_geoms is None or self._k2_weights is None:
-
-            cmbtr = MBTRWrapper(
-                system.get_positions(),
-                system.get_atomic_numbers(),
-                self.atomic_number_to_index,
-                interaction_limit=self._interaction_limit,
-                is_local=self._is_local
-            )
+            tuple: (species, offsets, geoms, weights) Inverse distances and
+            their weights for each pair of elements as described in
+            get_geoms_and_weights(). The values for pair i and j are stored in
+            the entry where j>=i.
+        """
+        if self._k2_values is None:
 
             # Determine the weighting function
             if self.weighting is not None:
@@ -748,37 +1369,34 @@ class MBTR(Descriptor):
                     b"scale": weight_info["scale"],
                     b"cutoff": weight_info["cutoff"]
                 }
+            elif weighting_function == "smooth_cutoff":
+                parameters = {
+                    b"r_cut": weight_info["r_cut"],
+                    b"sharpness": weight_info.get("sharpness", 2)
+                }
 
-            self._k2_geoms, self._k2_weights = cmbtr.get_k2_geoms_and_weights(
+            self._k2_values = cmbtr.get_k2_geoms_and_weights(
                 geom_func=b"inverse_distance",
                 weight_func=weighting_function.encode(),
                 parameters=parameters
             )
-        return self._k2_geoms, self._k2_weights
+        return self._k2_values
 
-    def k3_geoms_and_weights(self, system):
+    def k3_geoms_and_weights(self, cmbtr):
         """Calculates the value of the geometry function and corresponding
         weights for unique three-body combinations.
 
         Args:
-            system (System): The atomic system.
+            cmbtr (MBTRWrapper): The C++ implementation created for the atoms.
 
         Returns:
-            tuple: (geoms, weights) Cosines of the angles (values between -1
-            and 1) in the form {(i,j,k): [list of angles] }. The weights
-            corresponding to the angles are stored in a similar dictionary.
+            tuple: (species, offsets, geoms, weights) Cosines of the angles
+            (values between -1 and 1) and their weights for each triplet of
+            elements as described in get_geoms_and_weights().
         """
-        if self._k3_geoms is None or self._k2_weights is None:
+        if self._k3_values is None:
 
             # Calculate the angles with the C++ implementation
-            cmbtr = MBTRWrapper(
-                system.get_positions(),
-                system.get_atomic_numbers(),
-                self.atomic_number_to_index,
-                interaction_limit=self._interaction_limit,
-                is_local=self._is_local
-            )
-
             # Determine the weighting function
             if self.weighting is not None:
                 weight_info = self.weighting["k3"]
@@ -791,151 +1409,223 @@ class MBTR(Descriptor):
                     b"scale": weight_info["scale"],
                     b"cutoff": weight_info["cutoff"]
                 }
+            elif weighting_function == "smooth_cutoff":
+                parameters = {
+                    b"r_cut": weight_info["r_cut"],
+                    b"sharpness": weight_info.get("sharpness", 2)
+                }
 
-            self._k3_geoms, self._k3_weights = cmbtr.get_k3_geoms_and_weights(geom_func=b"cosine", weight_func=weighting_function.encode(), parameters=parameters)
+            self._k3_values = cmbtr.get_k3_geoms_and_weights(geom_func=b"cosine", weight_func=weighting_function.encode(), parameters=parameters)
 
-        return self._k3_geoms, self._k3_weights
+        return self._k3_values
 
-    def K1(self, settings):
+    def get_geoms_and_weights(self, k):
+        """Used to iterate over the geometry and weighting function values of
+        the element combinations in the given term.
+
+        The values are stored as flat arrays (species, offsets, geoms,
+        weights), where species contains the element indices of each
+        combination as an array of shape [n_combinations, k], and the values
+        of combination c are in the range offsets[c] to offsets[c+1]-1 of
+        geoms and weights.
+
+        Args:
+            k (int): The term for which the values are iterated.
+
+        Yields:
+            tuple: (key, geoms, weights) The element indices of a combination
+            as a tuple and views to its geometry and weighting function values.
+        """
+        species, offsets, geoms, weights = getattr(self, "_k{}_values".format(k))
+        for c, key in enumerate(species.tolist()):
+            start = offsets[c]
+            end = offsets[c+1]
+            yield tuple(key), geoms[start:end], weights[start:end]
+
+    def get_empty_geoms_and_weights(self, k):
+        """Returns the geometry and weighting function values for a term that
+        has no element combinations.
+
+        Args:
+            k (int): The term.
+
+        Returns:
+            tuple: (species, offsets, geoms, weights) in the format described
+            in get_geoms_and_weights().
+        """
+        return (
+            np.empty((0, k), dtype=np.int32),
+            np.zeros(1, dtype=np.int32),
+            np.empty(0, dtype=np.float32),
+            np.empty(0, dtype=np.float32),
+        )
+
+    def get_block_indices(self, k):
+        """Returns the index of the block of each element combination of a
+        term in the flattened output. Each block contains the grid points of
+        one element combination.
+
+        Args:
+            k (int): The term number.
+
+        Returns:
+            np.ndarray: The block index for each element combination in the
+            order of get_geoms_and_weights().
+        """
+        n_elem = self.n_elements
+        species = getattr(self, "_k{}_values".format(k))[0]
+        if k == 1:
+            return species[:, 0]
+        elif k == 2:
+            # This is the index of the spectrum. It is given by enumerating the
+            # elements of an upper triangular matrix from left to right and top
+            # to bottom.
+            i = species[:, 0]
+            j = species[:, 1]
+            return j + i*n_elem - i*(i+1)//2
+        else:
+            # This is the index of the spectrum. It is given by enumerating the
+            # elements of a three-dimensional array where for valid elements
+            # k>=i. The enumeration begins from [0, 0, 0], and ends at [n_elem,
+            # n_elem, n_elem], looping the elements in the order j, i, k.
+            i = species[:, 0]
+            j = species[:, 1]
+            k = species[:, 2]
+            return j*n_elem*(n_elem+1)//2 + k + i*n_elem - i*(i+1)//2
+
+    def create_blocks(self, k, settings):
+        """Used to broaden the geometry function values of a term into a
+        block-sparse tensor. Only the element combinations that are present in
+        the system are stored.
+
+        Args:
+            k (int): The term number.
+            settings (dict): The grid settings.
+
+        Returns:
+            BlockSparseTensor: The tensor of shape [n_elements]*k + [n].
+        """
+        n = settings["n"]
+        species = getattr(self, "_k{}_values".format(k))[0]
+        n_blocks = len(species)
+        data = np.zeros((n_blocks, n), dtype=np.float32)
+        self.broaden(k, settings, data, np.arange(n_blocks, dtype=np.int32)*n)
+
+        return BlockSparseTensor((self.n_elements,)*k + (n,), species, data)
+
+    def K1(self, settings, output=None):
         """Calculates the first order terms where the scalar mapping is the
         number of atoms of a certain type.
 
         Args:
-            system (System): Atomic system.
             settings (dict): Grid settings.
+            output (np.ndarray): A preallocated array of shape [1, n_features]
+                to which the flattened values are added. If not given, a new
+                array is created.
 
         Returns:
-            ndarray | scipy.sparse.lil_matrix: K1 values.
+            ndarray | BlockSparseTensor: K1 values. If flattened, the values
+            are given as an array of shape [1, n_features].
         """
         start = settings["min"]
         stop = settings["max"]
         n = settings["n"]
         self._axis_k1 = np.linspace(start, stop, n)
 
-        n_elem = self.n_elements
-        k1_geoms, k1_weights = self._k1_geoms, self._k1_weights
+        if not self._flatten and self._sparse:
+            return self.create_blocks(1, settings)
 
-        # Depending of flattening, use either a sparse matrix or a dense one.
+        n_elem = self.n_elements
         if self._flatten:
-            k1 = lil_matrix((1, n_elem*n), dtype=np.float32)
+            if output is not None:
+                k1 = output
+            else:
+                k1 = np.zeros((1, n_elem*n), dtype=np.float32)
         else:
             k1 = np.zeros((n_elem, n), dtype=np.float32)
 
-        for key in k1_geoms.keys():
-            i = key[0]
-
-            geoms = np.array(k1_geoms[key])
-            weights = np.array(k1_weights[key])
-
-            # Broaden with a gaussian
-            gaussian_sum = self.gaussian_sum(geoms, weights, settings)
-
-            if self._flatten:
-                start = i*n
-                end = (i+1)*n
-                k1[0, start:end] = gaussian_sum
-            else:
-                k1[i, :] = gaussian_sum
+        m = self.get_block_indices(1)
+        self.broaden(1, settings, k1, m*n)
 
         return k1
 
-    def K2(self, settings):
+    def K2(self, settings, output=None):
         """Calculates the second order terms where the scalar mapping is the
         inverse distance between atoms.
 
         Args:
             settings (dict): The grid settings
+            output (np.ndarray): A preallocated array of shape [1, n_features]
+                to which the flattened values are added. If not given, a new
+                array is created.
 
         Returns:
-            1D ndarray: flattened K2 values.
+            ndarray | BlockSparseTensor: K2 values. If flattened, the values
+            are given as an array of shape [1, n_features].
         """
         start = settings["min"]
         stop = settings["max"]
         n = settings["n"]
         self._axis_k2 = np.linspace(start, stop, n)
 
-        k2_geoms, k2_weights = self._k2_geoms, self._k2_weights
-        n_elem = self.n_elements
+        if not self._flatten and self._sparse:
+            return self.create_blocks(2, settings)
 
-        # Depending of flattening, use either a sparse matrix or a dense one.
+        n_elem = self.n_elements
         if self._flatten:
-            k2 = lil_matrix(
-                (1, int(n_elem*(n_elem+1)/2*n)), dtype=np.float32)
+            if output is not None:
+                k2 = output
+            else:
+                k2 = np.zeros((1, int(n_elem*(n_elem+1)/2*n)), dtype=np.float32)
+            m = self.get_block_indices(2)
         else:
-            k2 = np.zeros((self.n_elements, self.n_elements, n), dtype=np.float32)
-
-        for key in k2_geoms.keys():
-            i = key[0]
-            j = key[1]
-
-            # This is the index of the spectrum. It is given by enumerating the
-            # elements of an upper triangular matrix from left to right and top
-            # to bottom.
-            m = int(j + i*n_elem - i*(i+1)/2)
+            k2 = np.zeros((n_elem, n_elem, n), dtype=np.float32)
+            species = self._k2_values[0]
+            i = species[:, 0]
+            j = species[:, 1]
+            m = i*n_elem + j
 
-            geoms = np.array(k2_geoms[key])
-            weights = np.array(k2_weights[key])
-
-            # Broaden with a gaussian
-            gaussian_sum = self.gaussian_sum(geoms, weights, settings)
-
-            if self._flatten:
-                start = m*n
-                end = (m + 1)*n
-                k2[0, start:end] = gaussian_sum
-            else:
-                k2[i, j, :] = gaussian_sum
+        self.broaden(2, settings, k2, m*n)
 
         return k2
 
-    def K3(self, settings):
+    def K3(self, settings, output=None):
         """Calculates the third order terms where the scalar mapping is the
         angle between 3 atoms.
 
         Args:
             settings (dict): The grid settings
+            output (np.ndarray): A preallocated array of shape [1, n_features]
+                to which the flattened values are added. If not given, a new
+                array is created.
 
         Returns:
-            1D ndarray: flattened K3 values.
+            ndarray | BlockSparseTensor: K3 values. If flattened, the values
+            are given as an array of shape [1, n_features].
         """
         start = settings["min"]
         stop = settings["max"]
         n = settings["n"]
         self._axis_k3 = np.linspace(start, stop, n)
 
-        k3_geoms, k3_weights = self._k3_geoms, self._k3_weights
-        n_elem = self.n_elements
+        if not self._flatten and self._sparse:
+            return self.create_blocks(3, settings)
 
-        # Depending of flattening, use either a sparse matrix or a dense one.
+        n_elem = self.n_elements
         if self._flatten:
-            k3 = lil_matrix(
-                (1, int(n_elem*n_elem*(n_elem+1)/2*n)), dtype=np.float32
-            )
+            if output is not None:
+                k3 = output
+            else:
+                k3 = np.zeros((1, int(n_elem*n_elem*(n_elem+1)/2*n)), dtype=np.float32)
+            m = self.get_block_indices(3)
         else:
             k3 = np.zeros((n_elem, n_elem, n_elem, n), dtype=np.float32)
+            species = self._k3_values[0]
+            i = species[:, 0]
+            j = species[:, 1]
+            k = species[:, 2]
+            m = (i*n_elem + j)*n_elem + k
 
-        for key in k3_geoms.keys():
-            i = key[0]
-            j = key[1]
-            k = key[2]
-
-            # This is the index of the spectrum. It is given by enumerating the
-            # elements of a three-dimensional array where for valid elements
-            # k>=i. The enumeration begins from [0, 0, 0], and ends at [n_elem,
-            # n_elem, n_elem], looping the elements in the order j, i, k.
-            m = int(j*n_elem*(n_elem+1)/2 + k + i*n_elem - i*(i+1)/2)
-
-            geoms = np.array(k3_geoms[key])
-            weights = np.array(k3_weights[key])
-
-            # Broaden with a gaussian
-            gaussian_sum = self.gaussian_sum(geoms, weights, settings)
-
-            if self._flatten:
-                start = m*n
-                end = (m+1)*n
-                k3[0, start:end] = gaussian_sum
-            else:
-                k3[i, j, k, :] = gaussian_sum
+        self.broaden(3, settings, k3, m*n)
 
         return k3
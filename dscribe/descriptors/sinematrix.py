@@ -54,7 +54,7 @@ class SineMatrix(MatrixDescriptor):
         """
         # If single system given, skip the parallelization
         if isinstance(system, (Atoms, System)):
-            return self.create_single(system)
+            return self.project(self.create_single(system))
 
         # Combine input arguments
         inp = [(i_sys,) for i_sys in system]
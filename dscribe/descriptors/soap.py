@@ -5,12 +5,17 @@ import numpy as np
 
 from joblib import Parallel, delayed, parallel_backend
 
-from scipy.sparse import coo_matrix
+from scipy.sparse import coo_matrix, csr_matrix
+import scipy.sparse
+from scipy.spatial import cKDTree
 
 from ase import Atoms
 
 from dscribe.descriptors import Descriptor
 from dscribe.core import System
+from dscribe.libsoap.soapwrapper import SOAPTabulatedWrapper
+from dscribe.utils.radialbasis import get_radial_table
+from dscribe.utils.species import symbols_to_numbers
 
 import soaplite
 
@@ -42,7 +47,11 @@ class SOAP(Descriptor):
             periodic=False,
             crossover=True,
             average=False,
-            sparse=True
+            sparse=True,
+            columns=None,
+            backend="soaplite",
+            compression=None,
+            chunk_size=None
             ):
         """
         Args:
@@ -69,15 +78,76 @@ class SOAP(Descriptor):
                 * "polynomial": Polynomial basis defined as :math:`g_{n}(r) = \sum_{n'=1}^{n_\mathrm{max}}\,\\beta_{nn'} (r-r_\mathrm{cut})^{n'+2}`
 
             periodic (bool): Determines whether the system is considered to be
-                periodic.
+                periodic. With the "native" backend the periodic images of
+                the atoms are found with a cell list, so no supercell is
+                created.
             crossover (bool): Default True, if crossover of atomic types should
                 be included in the power spectrum.
-            average (bool): Whether to build an average output for all selected
-                positions.
+            average (bool or str): Whether to build an average output for all
+                selected positions. The available options are:
+
+                * False: No averaging.
+                * "outer" or True: The power spectra of the positions are
+                  averaged.
+                * "inner": The expansion coefficients of the positions are
+                  averaged before calculating the power spectrum. Only
+                  available with the "native" backend.
+
+                With the "native" backend the average is accumulated while
+                the output is calculated, so the memory usage does not depend
+                on the number of positions.
             sparse (bool): Whether the output should be a sparse matrix or a
                 dense numpy array.
+            columns (iterable): A subset of the output columns to create,
+                given either as integer indices or as a boolean mask over the
+                get_number_of_full_features() columns of the full output. If
+                given, the output will only contain these columns in the given
+                order and only the atoms whose species take part in the
+                selected element pairs are included in the calculation.
+            backend (str): The implementation used for the calculation. The
+                available options are:
+
+                * "soaplite": The implementation in the SOAPLite package, the
+                  default.
+                * "native": The built-in C++ implementation that writes the
+                  output directly for all species pairs. The radial integrals
+                  are interpolated from tables that are created once for each
+                  combination of rcut, nmax, lmax, sigma and rbf and stored in
+                  an on-disk cache, see :func:`dscribe.utils.radialbasis.get_radial_table`.
+                  The output agrees with the "soaplite" backend up to the
+                  accuracy of the interpolation.
+
+            compression (dict): Compresses the chemical species so that the
+                number of features grows linearly with the number of species
+                instead of quadratically. Given as a dictionary with the key
+                "mode" and the following options:
+
+                * "off": No compression, the default.
+                * "mu1nu1": The expansion coefficients of each species are
+                  combined with the coefficients of the total density of all
+                  species. The output contains all pairs of radial basis
+                  functions n, n' for each species and l, and the crossover
+                  option has no effect.
+                * "embedding": The expansion coefficients are projected onto a
+                  fixed number of channels, which are then used in place of
+                  the species. The projection weights are given with the key
+                  "embedding" as a dictionary that maps each species to a list
+                  of weights, one for each channel. Random or learned weights
+                  can be used.
+
+                Compression is only available with the "native" backend and
+                cannot be combined with a column selection.
+            chunk_size (int): The number of centers that are calculated at
+                once. When specified, the neighbour search structure is built
+                once for each system and the centers are processed in chunks of
+                this size. With sparse output each chunk is converted to a
+                sparse matrix before the next one is calculated, so the peak
+                memory usage does not grow with the number of centers. Only
+                available with the "native" backend. By default all centers are calculated at
+                once.
         """
         super().__init__(flatten=True, sparse=sparse)
+        self._compression = {"mode": "off"}
 
         # Setup the involved chemical species
         species = self.get_species_definition(species, atomic_numbers)
@@ -104,6 +174,35 @@ class SOAP(Descriptor):
                 "one of the following: {}".format(rbf, supported_rbf)
             )
 
+        supported_backends = set(("native", "soaplite"))
+        if backend not in supported_backends:
+            raise ValueError(
+                "Invalid backend '{}' given. Please use one of the following: "
+                "{}".format(backend, supported_backends)
+            )
+
+        # Check that the averaging mode is valid. True is the same as the
+        # outer average.
+        if average is True:
+            average = "outer"
+        supported_average = set((False, "outer", "inner"))
+        if average not in supported_average:
+            raise ValueError(
+                "Invalid average mode '{}' given. Please use one of the "
+                "following: {}".format(average, supported_average)
+            )
+        if average == "inner" and backend != "native":
+            raise ValueError(
+                "The inner average is only available with the native backend."
+            )
+
+        # The GTO basis is defined up to l=9
+        if rbf == "gto" and lmax > 9:
+            raise ValueError(
+                "When using the gaussian radial basis set (gto), the maximum "
+                "degree of spherical harmonics 'lmax' cannot exceed 9."
+            )
+
         # Crossover cannot be disabled on poly rbf
         if not crossover and rbf == "polynomial":
             raise ValueError(
@@ -118,10 +217,35 @@ class SOAP(Descriptor):
         self._periodic = periodic
         self._crossover = crossover
         self._average = average
+        self._backend = backend
 
-        if self._rbf == "gto":
+        # The radial basis is tabulated once for each set of parameters for
+        # the native backend. SOAPLite only needs the GTO basis parameters.
+        if backend == "native":
+            table = get_radial_table(rcut, nmax, lmax, sigma, rbf)
+            self._radial_table = table["coefficients"]
+            self._radial_spacing = float(table["spacing"])
+            if self._rbf == "gto":
+                self._alphas = table["alphas"]
+                self._betas = table["betas"]
+        elif self._rbf == "gto":
             self._alphas, self._betas = soaplite.genBasis.getBasisFunc(self._rcut, self._nmax)
 
+        # Check that the chunk size is valid
+        if chunk_size is not None:
+            if backend != "native":
+                raise ValueError(
+                    "The chunk size is only available with the native backend."
+                )
+            if not np.issubdtype(type(chunk_size), np.integer) or chunk_size < 1:
+                raise ValueError(
+                    "The chunk size should be a positive integer."
+                )
+        self._chunk_size = chunk_size
+
+        self.compression = compression
+        self.columns = columns
+
     def create(self, system, positions=None, n_jobs=1, verbose=False):
         """Return the SOAP output for the given systems and given positions.
 
@@ -149,7 +273,7 @@ class SOAP(Descriptor):
         """
         # If single system given, skip the parallelization
         if isinstance(system, (Atoms, System)):
-            return self.create_single(system, positions)
+            return self.project(self.create_single(system, positions))
 
         # Combine input arguments
         n_samples = len(system)
@@ -218,41 +342,39 @@ class SOAP(Descriptor):
         sub_elements = np.array(list(set(system.get_atomic_numbers())))
 
         # Check if periodic is valid
-        if self._periodic:
-            cell = system.get_cell()
-            if np.cross(cell[0], cell[1]).dot(cell[2]) == 0:
-                raise ValueError(
-                    "System doesn't have cell to justify periodicity."
-                )
+        self.check_cell(system)
 
         # Positions specified, use them
+        list_positions = None
         if positions is not None:
+            list_positions, _ = self.get_centers(system, positions)
 
-            # Check validity of position definitions and create final cartesian
-            # position list
-            list_positions = []
-            if len(positions) == 0:
-                raise ValueError(
-                    "The argument 'positions' should contain a non-empty set of"
-                    " atomic indices or cartesian coordinates with x, y and z "
-                    "components."
-                )
-            for i in positions:
-                if np.issubdtype(type(i), np.integer):
-                    list_positions.append(system.get_positions()[i])
-                elif isinstance(i, list) or isinstance(i, tuple):
-                    if len(i) != 3:
-                        raise ValueError(
-                            "The argument 'positions' should contain a "
-                            "non-empty set of atomic indices or cartesian "
-                            "coordinates with x, y and z components."
-                        )
-                    list_positions.append(i)
-                else:
-                    raise ValueError(
-                        "Create method requires the argument 'positions', a "
-                        "list of atom indices and/or positions"
-                    )
+        # If only a subset of the columns is requested, the atoms whose
+        # species do not take part in any of the selected element pairs are
+        # left out. The centers are then given explicitly, as they may include
+        # atoms that were left out.
+        if self._columns is not None:
+            if list_positions is None:
+                list_positions = system.get_positions()
+            system = system[np.isin(system.get_atomic_numbers(), self._column_species)]
+            sub_elements = np.array(list(set(system.get_atomic_numbers())))
+
+            # None of the selected element pairs are present in the system
+            if len(system) == 0:
+                n_points = 1 if self._average else len(list_positions)
+                soap_mat = np.zeros((n_points, len(self._columns)), dtype=np.float32)
+                if self._sparse:
+                    soap_mat = coo_matrix(soap_mat)
+                return soap_mat
+
+        # Use the built-in implementation if requested
+        native = self._backend == "native"
+        if native:
+            if list_positions is None:
+                list_positions = system.get_positions()
+            soap_mat = self.create_native(system, list_positions)
+
+        elif list_positions is not None:
 
             # Determine the SOAPLite function to call based on periodicity and
             # rbf
@@ -322,25 +444,238 @@ class SOAP(Descriptor):
                     eta=self._eta
                 )
 
-        # Map the output from subspace of elements to the full space of
-        # elements
-        soap_mat = self.get_full_space_output(
-            soap_mat,
-            sub_elements,
-            self._atomic_numbers
-        )
-
-        # Create the averaged SOAP output if requested.
-        if self._average:
-            soap_mat = soap_mat.mean(axis=0)
+        # Create the averaged SOAP output if requested. The averaging is done
+        # before mapping the output to the full space of elements, as the
+        # mapping only moves columns. The average is taken in single precision
+        # like the mapped output. The built-in implementation already provides
+        # the averaged output.
+        if self._average and not native:
+            soap_mat = soap_mat.astype(np.float32).mean(axis=0)
             soap_mat = np.expand_dims(soap_mat, 0)
 
+        # Map the output from subspace of elements to the full space of
+        # elements or to the selected columns. The built-in implementation
+        # already provides the output in this form. The sparse output is
+        # created directly from the subspace output.
+        if not native:
+            if self._columns is not None:
+                soap_mat = self.get_column_output(soap_mat, sub_elements)
+            elif self._sparse:
+                return self.get_full_space_sparse_output(
+                    soap_mat,
+                    sub_elements,
+                    self._atomic_numbers
+                )
+            else:
+                soap_mat = self.get_full_space_output(
+                    soap_mat,
+                    sub_elements,
+                    self._atomic_numbers
+                )
+
         # Make into a sparse array if requested
         if self._sparse:
             soap_mat = coo_matrix(soap_mat)
 
         return soap_mat
 
+    def derivatives(self, system, positions=None, return_descriptor=True):
+        """Calculates the analytic derivatives of the SOAP output of each
+        center with respect to the positions of the atoms. The derivatives
+        are calculated together with the output by the built-in
+        implementation.
+
+        Only the atoms within the hard cutoff radius rcut+5 of a center
+        contribute to its output, so the derivatives are returned only for
+        these center-atom pairs. For periodic systems the contributions of
+        all periodic images of an atom are summed together. When a center is
+        given as an atomic index, the center moves together with the atom.
+
+        Args:
+            system (:class:`ase.Atoms` | :class:`.System`): Input system.
+            positions (list): Cartesian positions or atomic indices. If
+                specified, the derivatives will be created for these points.
+                If no positions are defined, the derivatives will be created
+                for all atoms in the system.
+            return_descriptor (bool): Whether to also return the SOAP output.
+
+        Returns:
+            tuple: (pairs, derivatives) or (pairs, derivatives, descriptor).
+            The pairs are given as an integer array of shape [n_pairs, 2]
+            containing the index of the center and the index of the atom,
+            sorted by center and atom. The derivatives are given as an array
+            of shape [n_pairs, 3, n_features], where the entry [k, d] is the
+            derivative of the output of center pairs[k, 0] with respect to
+            the d:th cartesian coordinate of atom pairs[k, 1]. The derivatives
+            of all other pairs are zero. The descriptor is the output of
+            create_single() for the same centers.
+        """
+        if self._backend != "native":
+            raise ValueError(
+                "Derivatives are only available with the built-in backend."
+            )
+        if self._average:
+            raise ValueError("Derivatives are not available for averaged output.")
+        if self._compression["mode"] != "off":
+            raise ValueError("Derivatives are not available with species compression.")
+        if self._columns is not None:
+            raise ValueError("Derivatives are not available for a subset of the columns.")
+
+        system = self.get_system(system)
+        self.check_atomic_numbers(system.get_atomic_numbers())
+        self.check_cell(system)
+
+        # The atom that each center is bound to, or -1 for cartesian positions
+        n_atoms = len(system)
+        if positions is None:
+            centers = system.get_positions()
+            center_atoms = np.arange(n_atoms)
+        else:
+            centers, center_atoms = self.get_centers(system, positions)
+
+        # Each neighbour is assigned to the slot of its center-atom pair
+        offsets, species, displacements, indices = self.get_neighbour_list(system, centers)
+        neighbour_centers = np.repeat(np.arange(len(centers)), np.diff(offsets))
+        keys, slots = np.unique(neighbour_centers*n_atoms + indices, return_inverse=True)
+        pairs = np.column_stack((keys // n_atoms, keys % n_atoms))
+
+        n_features = self.get_number_of_features()
+        output = np.empty((len(centers), n_features), dtype=np.float32)
+        derivatives = np.zeros((len(pairs), 3, n_features), dtype=np.float32)
+        self.get_native_wrapper().create_derivatives(
+            output,
+            derivatives,
+            slots.astype(np.int32),
+            displacements,
+            species,
+            offsets,
+        )
+
+        # Moving a center moves it with respect to all of its neighbours. The
+        # pair of a center with its own atom always exists, as the atom is at
+        # zero distance.
+        own = np.flatnonzero(center_atoms[pairs[:, 0]] == pairs[:, 1])
+        if len(own) != 0:
+            pair_centers, starts = np.unique(pairs[:, 0], return_index=True)
+            totals = np.add.reduceat(derivatives, starts, axis=0)
+            derivatives[own] -= totals[np.searchsorted(pair_centers, pairs[own, 0])]
+
+        if not return_descriptor:
+            return pairs, derivatives
+        if self._sparse:
+            output = coo_matrix(output)
+        return pairs, derivatives, output
+
+    def create_multiscale(self, system, scales, positions=None, lmax=None, concatenate=False):
+        """Creates the SOAP output for several radial cutoffs and gaussian
+        widths with a single neighbour search. The neighbours are searched
+        once with the largest cutoff, and the neighbours of each scale are
+        picked from the same list.
+
+        Lower angular resolutions are sliced from the output of each scale,
+        as the power spectrum of each l does not depend on lmax. The radial
+        basis is orthonormalized for a given nmax, so lower radial
+        resolutions cannot be sliced and all the scales use the nmax of this
+        descriptor. The other settings, such as the species, periodicity,
+        averaging and compression, are shared by all the scales. Only
+        available with the "native" backend and without a column selection.
+
+        Args:
+            system (:class:`ase.Atoms` | :class:`.System`): Input system.
+            scales (iterable): The scales as (rcut, sigma)-pairs.
+            positions (list): Cartesian positions or atomic indices. If
+                specified, the SOAP spectrum will be created for these points.
+                If no positions are defined, the SOAP output will be created
+                for all atoms in the system.
+            lmax (iterable): The maximum degrees of spherical harmonics to
+                create for each scale, each at most the lmax of this
+                descriptor. Defaults to the lmax of this descriptor.
+            concatenate (bool): Whether to return the outputs concatenated
+                along the features in the order of the scales and lmax values.
+
+        Returns:
+            dict | np.ndarray | scipy.sparse.coo_matrix: A dictionary that maps
+            each (rcut, sigma, lmax)-tuple to the output with that resolution,
+            or the concatenated output. The type of the outputs depends on the
+            'sparse'-attribute.
+        """
+        if self._backend != "native":
+            raise ValueError(
+                "The multiscale output is only available with the built-in backend."
+            )
+        if self._columns is not None:
+            raise ValueError(
+                "The multiscale output is not available for a subset of the columns."
+            )
+        scales = [(float(rcut), float(sigma)) for rcut, sigma in scales]
+        if len(scales) == 0:
+            raise ValueError("Please provide at least one scale.")
+        if self._rbf == "gto" and min(rcut for rcut, _ in scales) <= 1:
+            raise ValueError(
+                "When using the gaussian radial basis set (gto), the radial "
+                "cutoff should be bigger than 1 angstrom."
+            )
+        lmax = [self._lmax] if lmax is None else [int(l) for l in lmax]
+        if len(lmax) == 0 or min(lmax) < 0 or max(lmax) > self._lmax:
+            raise ValueError(
+                "The lmax values should be in the range [0, {}].".format(self._lmax)
+            )
+
+        system = self.get_system(system)
+        self.check_atomic_numbers(system.get_atomic_numbers())
+        self.check_cell(system)
+        if positions is None:
+            centers = system.get_positions()
+        else:
+            centers, _ = self.get_centers(system, positions)
+
+        offsets, species, displacements, _ = self.get_neighbour_list(
+            system,
+            centers,
+            rcut=max(rcut for rcut, _ in scales)
+        )
+        distances = np.linalg.norm(displacements, axis=1)
+        neighbour_centers = np.repeat(np.arange(len(centers)), np.diff(offsets))
+
+        # The features of each species block are ordered by l, so the lower
+        # angular resolutions are prefixes of each block
+        average = {False: 0, True: 1, "outer": 1, "inner": 2}[self._average]
+        n_rows = 1 if average else len(centers)
+        if self._compression["mode"] == "mu1nu1":
+            n_l_features = self._nmax**2
+        else:
+            n_l_features = self._nmax*(self._nmax+1)//2
+
+        outputs = {}
+        for rcut, sigma in scales:
+            mask = distances < rcut + 5
+            scale_offsets = np.zeros(len(centers)+1, dtype=np.int32)
+            scale_offsets[1:] = np.cumsum(np.bincount(neighbour_centers[mask], minlength=len(centers)))
+            table = get_radial_table(rcut, self._nmax, self._lmax, sigma, self._rbf)
+            wrapper = self.get_native_wrapper(table["coefficients"], float(table["spacing"]))
+            output = np.zeros((n_rows, self.get_number_of_features()), dtype=np.float32)
+            wrapper.create(
+                output,
+                np.ascontiguousarray(displacements[mask]),
+                species[mask],
+                scale_offsets,
+                average
+            )
+
+            blocks = output.reshape(n_rows, -1, self._lmax+1, n_l_features)
+            for l in lmax:
+                scale_output = np.ascontiguousarray(blocks[:, :, :l+1, :].reshape(n_rows, -1))
+                if self._sparse:
+                    scale_output = coo_matrix(scale_output)
+                outputs[(rcut, sigma, l)] = scale_output
+
+        if not concatenate:
+            return outputs
+        parts = [outputs[(rcut, sigma, l)] for rcut, sigma in scales for l in lmax]
+        if self._sparse:
+            return scipy.sparse.hstack(parts, format="coo")
+        return np.hstack(parts)
+
     @property
     def species(self):
         return self._species
@@ -357,6 +692,466 @@ class SOAP(Descriptor):
         # The species are stored as atomic numbers for internal use.
         self._set_species(value)
 
+        # The cached mappings to the full space of elements depend on the
+        # species
+        self._full_space_columns = {}
+
+        # The column selection and the species embedding depend on the species
+        if self._columns is not None:
+            self.columns = self._columns
+        if self._compression["mode"] == "embedding":
+            self.compression = self._compression
+
+    @property
+    def compression(self):
+        return self._compression
+
+    @compression.setter
+    def compression(self, value):
+        """Used to check the validity of the species compression and to
+        create the embedding matrix in the order of the species.
+
+        Args:
+            value(dict): The compression settings. None disables the
+                compression.
+        """
+        if value is None:
+            value = {"mode": "off"}
+        mode = value.get("mode", "off")
+        supported_modes = set(("off", "mu1nu1", "embedding"))
+        if mode not in supported_modes:
+            raise ValueError(
+                "Invalid compression mode '{}' given. Please use one of the "
+                "following: {}".format(mode, supported_modes)
+            )
+        if mode != "off":
+            if self._backend != "native":
+                raise ValueError(
+                    "Compression is only available with the native backend."
+                )
+            if self._columns is not None:
+                raise ValueError(
+                    "Compression cannot be combined with a column selection."
+                )
+
+        self._embedding = None
+        if mode == "embedding":
+            weights = value.get("embedding")
+            if not weights:
+                raise ValueError(
+                    "The embedding weights for each species have to be given "
+                    "for the embedding compression."
+                )
+            weights = {
+                int(key) if isinstance(key, (int, np.integer)) else symbols_to_numbers([key])[0]: val
+                for key, val in weights.items()
+            }
+            missing = [number for number in self._atomic_numbers if number not in weights]
+            if missing:
+                raise ValueError(
+                    "No embedding weights given for the atomic numbers {}."
+                    .format(missing)
+                )
+            embedding = np.array(
+                [np.ravel(weights[number]) for number in self._atomic_numbers],
+                dtype=np.float64
+            )
+            if embedding.ndim != 2 or embedding.shape[1] == 0:
+                raise ValueError(
+                    "The embedding weights should have the same nonzero length "
+                    "for all species."
+                )
+            self._embedding = np.ascontiguousarray(embedding)
+
+        self._compression = dict(value, mode=mode)
+
+    @property
+    def columns(self):
+        return self._columns
+
+    @columns.setter
+    def columns(self, value):
+        """Used to check the validity of the selected output columns and to
+        map each of them to an element pair and to a location within the
+        features of that pair.
+
+        Args:
+            value(iterable): The selected columns as integer indices or as a
+                boolean mask. None selects the full output.
+        """
+        if value is None:
+            self._columns = None
+            return
+        if self._compression["mode"] != "off":
+            raise ValueError(
+                "Compression cannot be combined with a column selection."
+            )
+        self._columns = self.get_column_indices(value, self.get_number_of_full_features())
+
+        # The element pairs in the order in which they appear in the output
+        n_elem = len(self._atomic_numbers)
+        if self._crossover:
+            pairs = np.array(np.triu_indices(n_elem)).T
+        else:
+            pairs = np.repeat(np.arange(n_elem)[:, None], 2, axis=1)
+
+        n_elem_features = self.get_number_of_element_features()
+        self._column_pairs = pairs[self._columns // n_elem_features]
+        self._column_offsets = self._columns % n_elem_features
+        self._column_species = np.asarray(self._atomic_numbers)[np.unique(self._column_pairs)]
+
+        # Each column as (species i, species j, l, n, n') for the built-in
+        # implementation
+        n_radial = self._nmax*(self._nmax+1)//2
+        radial_pairs = np.array(np.triu_indices(self._nmax)).T
+        self._column_features = np.ascontiguousarray(np.column_stack((
+            self._column_pairs,
+            self._column_offsets // n_radial,
+            radial_pairs[self._column_offsets % n_radial],
+        )), dtype=np.int32)
+
+    def get_centers(self, system, positions):
+        """Used to convert the given positions into the cartesian positions of
+        the centers. The positions can be given as a list that mixes atomic
+        indices and cartesian positions, as an integer array of atomic
+        indices or as an array of cartesian positions with shape
+        [n_positions, 3]. The arrays are converted without iterating over
+        the positions.
+
+        Args:
+            system (:class:`.System`): Input system.
+            positions (iterable): Atomic indices and/or cartesian positions.
+
+        Returns:
+            tuple: (centers, atoms). The cartesian positions of the centers as
+            an array of shape [n_positions, 3] and the index of the atom of
+            each center, or -1 for centers given as cartesian positions.
+        """
+        error = ValueError(
+            "The argument 'positions' should contain a non-empty set of atomic"
+            " indices or cartesian coordinates with x, y and z components."
+        )
+        if len(positions) == 0:
+            raise error
+        atom_positions = system.get_positions()
+        n_atoms = len(atom_positions)
+
+        # Arrays of indices or of cartesian positions
+        if isinstance(positions, np.ndarray):
+            if positions.ndim == 1 and np.issubdtype(positions.dtype, np.integer):
+                return atom_positions[positions], positions % n_atoms
+            if positions.ndim == 2 and positions.shape[1] == 3 and np.issubdtype(positions.dtype, np.number):
+                return positions.astype(np.float64), np.full(len(positions), -1)
+            raise error
+
+        # Lists where the indices and cartesian positions may be mixed. The
+        # list is only iterated to separate the indices from the positions.
+        is_index = np.fromiter(
+            (isinstance(i, (int, np.integer)) and not isinstance(i, bool) for i in positions),
+            dtype=bool,
+            count=len(positions)
+        )
+        atoms = np.full(len(positions), -1)
+        centers = np.empty((len(positions), 3))
+        if is_index.any():
+            indices = np.array([i for i, index in zip(positions, is_index) if index])
+            centers[is_index] = atom_positions[indices]
+            atoms[is_index] = indices % n_atoms
+        if not is_index.all():
+            try:
+                cartesian = np.array([i for i, index in zip(positions, is_index) if not index], dtype=np.float64)
+            except (ValueError, TypeError):
+                raise error
+            if cartesian.ndim != 2 or cartesian.shape[1] != 3:
+                raise error
+            centers[~is_index] = cartesian
+
+        return centers, atoms
+
+    def create_native(self, system, centers):
+        """Used to calculate the output with the built-in implementation.
+
+        Args:
+            system (:class:`.System`): Input system.
+            centers (np.ndarray): Cartesian positions of the centers.
+
+        Returns:
+            np.ndarray: The output for all species pairs, or only for the
+            selected columns if a subset of the columns has been requested.
+            When averaging, the output contains a single row.
+        """
+        wrapper = self.get_native_wrapper()
+        average = {False: 0, True: 1, "outer": 1, "inner": 2}[self._average]
+        n_features = self.get_number_of_features()
+
+        # The centers are processed in chunks that share the same neighbour
+        # search structure. For the inner average the expansion coefficients
+        # of the chunks are summed into a single buffer.
+        chunk_size = self._chunk_size
+        if chunk_size is None:
+            chunk_size = max(len(centers), 1)
+        chunk_starts = range(0, len(centers), chunk_size)
+        images = self.get_neighbour_images(system, centers)
+        if not average and not self._sparse:
+            output = np.empty((len(centers), n_features), dtype=np.float32)
+        if average == 2:
+            coefficients = np.zeros(wrapper.n_coefficients)
+            present = np.zeros(wrapper.n_species, dtype=np.uint8)
+        blocks = []
+        total = np.zeros((1, n_features))
+        for start in chunk_starts:
+            chunk = centers[start:start+chunk_size]
+            offsets, species, displacements, _ = self.get_neighbour_list(system, chunk, images)
+            if average == 2:
+                wrapper.add_coefficients(coefficients, present, displacements, species, offsets)
+                continue
+            if average:
+                block = np.zeros((1, n_features), dtype=np.float32)
+            elif self._sparse:
+                block = np.empty((len(chunk), n_features), dtype=np.float32)
+            else:
+                block = output[start:start+chunk_size]
+            if self._columns is None:
+                wrapper.create(block, displacements, species, offsets, average)
+            else:
+                wrapper.create_columns(block, self._column_features, displacements, species, offsets, average)
+
+            # The outer averages of the chunks are weighted by the number of
+            # centers in them. Sparse output is collected one chunk at a
+            # time so that only a single dense chunk exists at once.
+            if average:
+                total += len(chunk)*block
+            elif self._sparse:
+                blocks.append(csr_matrix(block))
+
+        if average == 2:
+            block = np.zeros((1, n_features), dtype=np.float32)
+            if self._columns is None:
+                wrapper.create_inner_average(block, coefficients, present, len(centers))
+            else:
+                wrapper.create_inner_average(block, coefficients, present, len(centers), self._column_features)
+            return block
+        if average:
+            if len(chunk_starts) == 1:
+                return block
+            return (total/len(centers)).astype(np.float32)
+        if self._sparse:
+            return scipy.sparse.vstack(blocks, format="csr")
+        return output
+
+    def check_cell(self, system):
+        """Used to check that a periodic system has a cell with a nonzero
+        volume.
+
+        Args:
+            system (:class:`.System`): Input system.
+
+        Raises:
+            ValueError: If the system is periodic and the cell has no volume.
+        """
+        if self._periodic:
+            cell = system.get_cell()
+            if np.cross(cell[0], cell[1]).dot(cell[2]) == 0:
+                raise ValueError(
+                    "System doesn't have cell to justify periodicity."
+                )
+
+    def get_native_wrapper(self, radial_table=None, radial_spacing=None):
+        """Used to create the built-in implementation with the current
+        settings.
+
+        Args:
+            radial_table (np.ndarray): The radial spline table to use in place
+                of the table of this descriptor, see
+                :func:`dscribe.utils.radialbasis.get_radial_table`.
+            radial_spacing (float): The spacing of the given table.
+
+        Returns:
+            SOAPTabulatedWrapper: The built-in implementation.
+        """
+        if radial_table is None:
+            radial_table = self._radial_table
+            radial_spacing = self._radial_spacing
+        return SOAPTabulatedWrapper(
+            self._nmax,
+            self._lmax,
+            radial_table,
+            radial_spacing,
+            len(self._atomic_numbers),
+            self._crossover,
+            {"off": 0, "mu1nu1": 1, "embedding": 2}[self._compression["mode"]],
+            self._embedding,
+        )
+
+    def get_neighbour_images(self, system, centers, rcut=None):
+        """Used to create the search structure for the atoms that may be
+        neighbours of the given centers. For periodic systems the periodic
+        images of the atoms are also included.
+
+        Args:
+            system (:class:`.System`): Input system.
+            centers (np.ndarray): Cartesian positions of the centers.
+            rcut (float): The radial cutoff. Defaults to the cutoff of this
+                descriptor.
+
+        Returns:
+            tuple: (tree, species, indices). The KD-tree of the atom
+            positions, and the species indices and the indices in the system
+            of the atoms in the tree.
+        """
+        positions = system.get_positions()
+        species = np.searchsorted(self._atomic_numbers, system.get_atomic_numbers())
+        indices = np.arange(len(positions))
+
+        if rcut is None:
+            rcut = self._rcut
+        if self._periodic:
+            indices, translations = self.get_periodic_images(system, centers, rcut + 5)
+            positions = positions[indices] + translations
+            species = species[indices]
+
+        return cKDTree(positions), species, indices
+
+    def get_neighbour_list(self, system, centers, images=None, rcut=None):
+        """Used to find the atoms that are closer than the hard cutoff radius
+        rcut+5 to each center. For periodic systems the periodic images of the
+        atoms are also taken into account.
+
+        Args:
+            system (:class:`.System`): Input system.
+            centers (np.ndarray): Cartesian positions of the centers.
+            images (tuple): The search structure from
+                get_neighbour_images(), which must include the images for
+                these centers. Created for the given centers if not
+                specified.
+            rcut (float): The radial cutoff. Defaults to the cutoff of this
+                descriptor.
+
+        Returns:
+            tuple: (offsets, species, displacements, indices). The neighbours
+            of center i are given by the entries from offsets[i] to
+            offsets[i+1] in the species indices, in the displacements from the
+            center to the neighbour and in the indices of the neighbouring
+            atoms in the system.
+        """
+        if rcut is None:
+            rcut = self._rcut
+        if images is None:
+            images = self.get_neighbour_images(system, centers, rcut)
+        tree, species, indices = images
+        positions = tree.data
+        r_cut_hard = rcut + 5
+
+        pairs = cKDTree(centers).sparse_distance_matrix(tree, r_cut_hard, output_type="ndarray")
+        pairs = pairs[pairs["v"] < r_cut_hard]
+        pairs = pairs[np.argsort(pairs["i"], kind="stable")]
+
+        offsets = np.zeros(len(centers)+1, dtype=np.int32)
+        offsets[1:] = np.cumsum(np.bincount(pairs["i"], minlength=len(centers)))
+        displacements = np.ascontiguousarray(positions[pairs["j"]] - centers[pairs["i"]])
+
+        return offsets, species[pairs["j"]].astype(np.int32), displacements, indices[pairs["j"]]
+
+    def get_periodic_images(self, system, centers, r_cut):
+        """Used to find the periodic images of the atoms that may be within
+        the given cutoff radius from any of the centers.
+
+        The atoms are wrapped into the cell and sorted into bins that divide
+        the cell into smaller parallelepipeds with a width of at least the
+        cutoff. The periodic images of the bins are then enumerated within
+        the range of the centers, and only the images whose bounding sphere
+        is within the cutoff from a center are kept. This works for any
+        triclinic cell and the number of images does not depend on the
+        number of atoms in the cell.
+
+        Args:
+            system (:class:`.System`): Input system.
+            centers (np.ndarray): Cartesian positions of the centers.
+            r_cut (float): The cutoff radius.
+
+        Returns:
+            tuple: (indices, translations). The atom indices and the cartesian
+            translations that give the positions of the periodic images when
+            added to the original atomic positions.
+        """
+        cell = np.array(system.get_cell())
+        inverse = np.linalg.inv(cell)
+        volume = abs(np.linalg.det(cell))
+        heights = volume/np.linalg.norm(np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]]), axis=1)
+
+        # The cell offset of each atom is stored so that the translations
+        # can be given with respect to the original positions
+        fractional = system.get_positions().dot(inverse)
+        shifts = np.floor(fractional)
+        fractional -= shifts
+        n_bins = np.maximum(heights // r_cut, 1).astype(int)
+        bins = np.minimum((fractional*n_bins).astype(int), n_bins-1)
+        bin_indices = np.ravel_multi_index(bins.T, n_bins)
+        order = np.argsort(bin_indices, kind="stable")
+        counts = np.bincount(bin_indices, minlength=np.prod(n_bins))
+        starts = np.cumsum(counts) - counts
+
+        # The bins of all the images that overlap the range of the centers
+        # extended by the cutoff in each direction, given in units of bins
+        center_fractional = centers.dot(inverse)
+        reach = r_cut/heights
+        lower = np.floor((center_fractional.min(axis=0) - reach)*n_bins).astype(int)
+        upper = np.floor((center_fractional.max(axis=0) + reach)*n_bins).astype(int)
+        ranges = [np.arange(lower[i], upper[i]+1) for i in range(3)]
+        image_bins = np.array(np.meshgrid(*ranges, indexing="ij")).reshape(3, -1).T
+
+        # Only the bins whose bounding sphere reaches a center are kept
+        bin_cell = cell/n_bins[:, np.newaxis]
+        diagonals = np.array([[1, 1, 1], [-1, 1, 1], [1, -1, 1], [1, 1, -1]]).dot(bin_cell)
+        radius = 0.5*np.linalg.norm(diagonals, axis=1).max()
+        distances, _ = cKDTree(centers).query((image_bins + 0.5).dot(bin_cell), distance_upper_bound=r_cut+radius)
+        image_bins = image_bins[np.isfinite(distances)]
+        images, local_bins = np.divmod(image_bins, n_bins)
+        local_bins = np.ravel_multi_index(local_bins.T, n_bins)
+
+        # Each kept bin image contributes all the atoms in the bin
+        n_atoms = counts[local_bins]
+        image_of_atom = np.repeat(np.arange(len(images)), n_atoms)
+        position_in_bin = np.arange(len(image_of_atom)) - np.repeat(np.cumsum(n_atoms) - n_atoms, n_atoms)
+        indices = order[starts[local_bins][image_of_atom] + position_in_bin]
+        translations = (images[image_of_atom] - shifts[indices]).dot(cell)
+
+        return indices, translations
+
+    def get_column_output(self, sub_output, sub_elements):
+        """Used to pick the selected columns from the SOAPLite output that is
+        partitioned by the elements present in the given system. Columns
+        belonging to element pairs that are not present are set to zero.
+
+        Args:
+            sub_output(np.ndarray): The output fron SOAPLite
+            sub_elements(list): The atomic numbers present in the subspace
+
+        Returns:
+            np.ndarray: The selected columns of the SOAP output.
+        """
+        n_elem_features = self.get_number_of_element_features()
+        n_sub = len(sub_elements)
+        sub_elements_sorted = np.sort(sub_elements)
+
+        # Index of each element in the subspace, -1 if not present
+        full_to_sub = np.full(len(self._atomic_numbers), -1, dtype=int)
+        full_to_sub[np.searchsorted(self._atomic_numbers, sub_elements_sorted)] = np.arange(n_sub)
+        i_sub = full_to_sub[self._column_pairs[:, 0]]
+        j_sub = full_to_sub[self._column_pairs[:, 1]]
+        valid = (i_sub >= 0) & (j_sub >= 0)
+
+        if self._crossover:
+            m_sub = j_sub + i_sub*n_sub - i_sub*(i_sub+1)//2
+        else:
+            m_sub = i_sub
+        source = m_sub*n_elem_features + self._column_offsets
+
+        output = np.zeros((sub_output.shape[0], len(self._columns)), dtype=np.float32)
+        output[:, valid] = sub_output[:, source[valid]]
+
+        return output
+
     def get_full_space_output(self, sub_output, sub_elements, full_elements_sorted):
         """Used to partition the SOAP output to different locations depending
         on the interacting elements. SOAPLite return the output partitioned by
@@ -372,44 +1167,87 @@ class SOAP(Descriptor):
         Returns:
             np.ndarray: The given SOAP output mapped to the full chemical space.
         """
-        # Get mapping between elements in the subspace and alements in the full
-        # space
-        space_map = self.get_sub_to_full_map(sub_elements, full_elements_sorted)
-
-        # Reserve space for a sparse matric containing the full output space
+        columns = self.get_full_space_columns(sub_elements, full_elements_sorted)
         n_features = self.get_number_of_features()
-        n_elem_features = self.get_number_of_element_features()
         n_points = sub_output.shape[0]
 
-        # Define the final output space as an array.
         output = np.zeros((n_points, n_features), dtype=np.float32)
+        output[:, columns] = sub_output
+
+        return output
 
-        n_elem_sub = len(sub_elements)
-        n_elem_full = len(full_elements_sorted)
-        for i_sub in range(n_elem_sub):
-            for j_sub in range(n_elem_sub):
-                if j_sub >= i_sub:
-
-                    # This is the index of the spectrum. It is given by enumerating the
-                    # elements of an upper triangular matrix from left to right and top
-                    # to bottom.
-                    m = self.get_flattened_index(i_sub, j_sub, n_elem_sub)
-                    start_sub = m*n_elem_features
-                    end_sub = (m+1)*n_elem_features
-                    sub_out = sub_output[:, start_sub:end_sub]
-
-                    # Figure out position in the full element space
-                    i_full = space_map[i_sub]
-                    j_full = space_map[j_sub]
-                    m_full = self.get_flattened_index(i_full, j_full, n_elem_full)
-
-                    # Place output to full output vector
-                    start_full = m_full*n_elem_features
-                    end_full = (m_full+1)*n_elem_features
-                    output[:, start_full:end_full] = sub_out
+    def get_full_space_sparse_output(self, sub_output, sub_elements, full_elements_sorted):
+        """Used to create a sparse matrix of the SOAP output in the full
+        chemical space directly from the nonzero values of the SOAPLite output,
+        without creating the dense output for the full chemical space.
+
+        Args:
+            sub_output(np.ndarray): The output fron SOAPLite
+            sub_elements(list): The atomic numbers present in the subspace
+            full_elements_sorted(list): The atomic numbers present in the full
+                space, sorted.
+
+        Returns:
+            scipy.sparse.coo_matrix: The given SOAP output mapped to the full
+            chemical space.
+        """
+        columns = self.get_full_space_columns(sub_elements, full_elements_sorted)
+        n_features = self.get_number_of_features()
+        n_points = sub_output.shape[0]
+
+        rows, cols = np.nonzero(sub_output)
+        output = coo_matrix(
+            (sub_output[rows, cols], (rows, columns[cols])),
+            shape=(n_points, n_features),
+            dtype=np.float32
+        )
 
         return output
 
+    def get_full_space_columns(self, sub_elements, full_elements_sorted):
+        """Used to map the columns of the SOAPLite output for the given
+        elements to the columns of the output in the full chemical space. The
+        mapping is cached for each set of elements.
+
+        Args:
+            sub_elements(list): The atomic numbers present in the subspace
+            full_elements_sorted(list): The atomic numbers present in the full
+                space, sorted.
+
+        Returns:
+            np.ndarray: The column in the full space for each column in the
+            SOAPLite output.
+        """
+        key = (tuple(np.sort(sub_elements)), tuple(full_elements_sorted))
+        columns = self._full_space_columns.get(key)
+        if columns is not None:
+            return columns
+
+        # The element pairs in the subspace are ordered as the elements of an
+        # upper triangular matrix from left to right and top to bottom. Without
+        # crossover only the diagonal is included.
+        n_elem_sub = len(key[0])
+        n_elem_full = len(key[1])
+        if self._crossover:
+            i_sub, j_sub = np.triu_indices(n_elem_sub)
+        else:
+            i_sub = j_sub = np.arange(n_elem_sub)
+
+        # Figure out the position of each pair in the full element space
+        space_map = np.searchsorted(key[1], key[0])
+        i_full = space_map[i_sub]
+        j_full = space_map[j_sub]
+        if self._crossover:
+            m_full = j_full + i_full*n_elem_full - i_full*(i_full+1)//2
+        else:
+            m_full = i_full
+
+        n_elem_features = self.get_number_of_element_features()
+        columns = (m_full[:, np.newaxis]*n_elem_features + np.arange(n_elem_features)).ravel()
+        self._full_space_columns[key] = columns
+
+        return columns
+
     def get_sub_to_full_map(self, sub_elements, full_elements):
         """Used to map an index in the sub-space of elements to the full
         element-space.
@@ -448,7 +1286,24 @@ class SOAP(Descriptor):
         Returns:
             int: Number of features for this descriptor.
         """
+        if self._columns is not None:
+            return len(self._columns)
+
+        return self.get_number_of_full_features()
+
+    def get_number_of_full_features(self):
+        """Used to inquire the number of features in the full output, before
+        a possible column selection.
+
+        Returns:
+            int: Number of features in the full output.
+        """
         n_elems = len(self._atomic_numbers)
+        if self._compression["mode"] == "mu1nu1":
+            return int(n_elems * (self._lmax + 1) * self._nmax**2)
+        if self._compression["mode"] == "embedding":
+            n_elems = self._embedding.shape[1]
+
         if self._crossover:
             n_blocks = n_elems * (n_elems + 1)/2
         else:
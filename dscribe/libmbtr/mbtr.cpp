@@ -8,96 +8,114 @@
 #include <utility>
 #include <cmath>
 #include <algorithm>
-#include <sstream>
 #include <stdexcept>
+#include <unordered_map>
 using namespace std;
 
-MBTR::MBTR(vector<vector<float> > positions, vector<int> atomicNumbers, map<int,int> atomicNumberToIndexMap, int interactionLimit, bool isLocal)
+MBTR::MBTR(const float* positions, const int* atomicNumbers, int nAtoms, map<int,int> atomicNumberToIndexMap, int interactionLimit, bool isLocal)
     : positions(positions)
     , atomicNumbers(atomicNumbers)
+    , nAtoms(nAtoms)
     , atomicNumberToIndexMap(atomicNumberToIndexMap)
     , interactionLimit(interactionLimit)
     , isLocal(isLocal)
+    , periodic(false)
     , displacementTensorInitialized(false)
+    , distanceMatrixInitialized(false)
     , k1IndicesInitialized(false)
     , k2IndicesInitialized(false)
     , k3IndicesInitialized(false)
-    , k1MapInitialized(false)
-    , k2MapInitialized(false)
-    , k3MapInitialized(false)
+    , nElements(0)
+    , k1ValuesInitialized(false)
+    , k2ValuesInitialized(false)
+    , k3ValuesInitialized(false)
 {
+    for (auto const& x : atomicNumberToIndexMap) {
+        this->nElements = std::max(this->nElements, x.second + 1);
+    }
+}
+
+MBTR::MBTR(const float* positions, const int* atomicNumbers, int nAtoms, map<int,int> atomicNumberToIndexMap, const double* cell, const int* neighbourOffsets, const int* neighbours, const int* translations)
+    : MBTR(positions, atomicNumbers, nAtoms, atomicNumberToIndexMap, nAtoms, false)
+{
+    this->periodic = true;
+    this->neighbourOffsets = neighbourOffsets;
+    this->translations = translations;
+
+    // The atoms in the cell are followed by the periodic images that appear
+    // in the neighbour list. The neighbours in the cell itself refer directly
+    // to the atoms in the cell, so that the atom indices below
+    // interactionLimit are exactly the atoms in the cell.
+    int nEntries = nAtoms == 0 ? 0 : neighbourOffsets[nAtoms];
+    this->imagePositions.assign(positions, positions + 3*nAtoms);
+    this->imageAtomicNumbers.assign(atomicNumbers, atomicNumbers + nAtoms);
+    this->neighbourIndices.resize(nEntries);
+    for (int n=0; n < nEntries; ++n) {
+        int atom = neighbours[n];
+        const int* translation = &translations[3*n];
+        if (translation[0] == 0 && translation[1] == 0 && translation[2] == 0) {
+            this->neighbourIndices[n] = atom;
+            continue;
+        }
+        this->neighbourIndices[n] = this->imageAtomicNumbers.size();
+        for (int c=0; c < 3; ++c) {
+            double shift = 0;
+            for (int d=0; d < 3; ++d) {
+                shift += translation[d]*cell[3*d+c];
+            }
+            this->imagePositions.push_back(positions[3*atom+c] + shift);
+        }
+        this->imageAtomicNumbers.push_back(atomicNumbers[atom]);
+    }
+    this->positions = this->imagePositions.data();
+    this->atomicNumbers = this->imageAtomicNumbers.data();
+    this->nAtoms = this->imageAtomicNumbers.size();
 }
 
-vector<vector<vector<float> > > MBTR::getDisplacementTensor()
+const vector<float>& MBTR::getDisplacementTensor()
 {
     // Use cached value if possible
     if (!this->displacementTensorInitialized) {
-        int nAtoms = this->atomicNumbers.size();
+        int nAtoms = this->nAtoms;
+        this->displacementTensor.assign(3*nAtoms*nAtoms, 0);
 
-        // Initialize tensor
-        vector<vector<vector<float> > > tensor(nAtoms, vector<vector<float> >(nAtoms, vector<float>(3)));
-
-        // Calculate the distance between all pairs and store in the tensor
+        // Due to symmetry only the lower triangular part is calculated.
         for (int i=0; i < nAtoms; ++i) {
-            for (int j=0; j < nAtoms; ++j) {
-
-                // Due to symmetry only upper triangular part is processed.
-                if (i <= j) {
-                    continue;
-                }
-
-                // Calculate distance between the two atoms, store in tensor
-                vector<float>& iPos = this->positions[i];
-                vector<float>& jPos = this->positions[j];
-                vector<float> diff(3);
-                vector<float> negDiff(3);
-
+            for (int j=0; j < i; ++j) {
+                const float* iPos = &this->positions[3*i];
+                const float* jPos = &this->positions[3*j];
+                float* diff = &this->displacementTensor[3*(i*nAtoms+j)];
+                float* negDiff = &this->displacementTensor[3*(j*nAtoms+i)];
                 for (int k=0; k < 3; ++k) {
                     float iDiff = jPos[k] - iPos[k];
                     diff[k] = iDiff;
                     negDiff[k] = -iDiff;
                 }
-
-                tensor[i][j] = diff;
-                tensor[j][i] = negDiff;
             }
         }
-        this->displacementTensor = tensor;
         this->displacementTensorInitialized = true;
     }
     return this->displacementTensor;
 }
-vector<vector<float> > MBTR::getDistanceMatrix()
-{
-    int nAtoms = this->atomicNumbers.size();
-
-    // Initialize matrix
-    vector<vector<float> > distanceMatrix(nAtoms, vector<float>(nAtoms));
-
-    // Displacement tensor
-    vector<vector<vector<float> > > tensor = this->getDisplacementTensor();
-
-    // Calculate distances
-    for (int i=0; i < nAtoms; ++i) {
-        for (int j=0; j < nAtoms; ++j) {
 
-            // Due to symmetry only upper triangular part is processed.
-            if (i <= j) {
-                continue;
-            }
+const vector<float>& MBTR::getDistanceMatrix()
+{
+    // Use cached value if possible
+    if (!this->distanceMatrixInitialized) {
+        int nAtoms = this->nAtoms;
+        this->distanceMatrix.assign(nAtoms*nAtoms, 0);
 
-            float norm = 0;
-            vector<float>& iPos = tensor[i][j];
-            for (int k=0; k < 3; ++k) {
-                norm += pow(iPos[k], 2.0);
+        // Due to symmetry only the lower triangular part is calculated.
+        for (int i=0; i < nAtoms; ++i) {
+            for (int j=0; j < i; ++j) {
+                float norm = this->getDistance(i, j);
+                this->distanceMatrix[i*nAtoms+j] = norm;
+                this->distanceMatrix[j*nAtoms+i] = norm;
             }
-            norm = sqrt(norm);
-            distanceMatrix[i][j] = norm;
-            distanceMatrix[j][i] = norm;
         }
+        this->distanceMatrixInitialized = true;
     }
-
-    return distanceMatrix;
+    return this->distanceMatrix;
 }
 
 vector<index1d> MBTR::getk1Indices()
@@ -105,7 +123,7 @@ vector<index1d> MBTR::getk1Indices()
     // Use cached value if possible
     if (!this->k1IndicesInitialized) {
 
-        int nAtoms = this->atomicNumbers.size();
+        int nAtoms = this->nAtoms;
 
         // Initialize the map containing the mappings
         vector<index1d> indexList;
@@ -129,7 +147,7 @@ vector<index2d> MBTR::getk2Indices()
     // Use cached value if possible
     if (!this->k2IndicesInitialized) {
 
-        int nAtoms = this->atomicNumbers.size();
+        int nAtoms = this->nAtoms;
 
         // Initialize the map containing the mappings
         vector<index2d> indexList;
@@ -155,12 +173,47 @@ vector<index2d> MBTR::getk2Indices()
     return this->k2Indices;
 }
 
+vector<index2d> MBTR::getk2Indices(float maxDistance)
+{
+    // Use cached value if possible
+    if (!this->k2IndicesInitialized) {
+
+        // The bound is slightly loosened so that all pairs that pass the
+        // final weighting are enumerated despite rounding.
+        float radius = maxDistance*(1 + 1e-4);
+        int nInteracting = min(this->interactionLimit, this->nAtoms);
+        vector<bool> interacting(this->nAtoms, false);
+        fill(interacting.begin(), interacting.begin() + nInteracting, true);
+        vector<bool> all(this->nAtoms, true);
+        vector<vector<int> > neighbours = this->getNeighbours(radius, interacting, all);
+
+        // Only consider pairs that have one atom in the original cell. Due
+        // to symmetry only the pairs where j > i are stored.
+        vector<index2d> indexList;
+        for (int i=0; i < nInteracting; ++i) {
+            for (int j : neighbours[i]) {
+                if (j > i) {
+                    index2d key = {i, j};
+                    indexList.push_back(key);
+                }
+            }
+        }
+
+        // The pairs are ordered in the same way as in the full enumeration
+        sort(indexList.begin(), indexList.end());
+
+        this->k2Indices = indexList;
+        this->k2IndicesInitialized = true;
+    }
+    return this->k2Indices;
+}
+
 vector<index3d> MBTR::getk3Indices()
 {
     // Use cached value if possible
     if (!this->k3IndicesInitialized) {
 
-        int nAtoms = this->atomicNumbers.size();
+        int nAtoms = this->nAtoms;
 
         // Initialize the map containing the mappings
         vector<index3d> indexList;
@@ -193,419 +246,736 @@ vector<index3d> MBTR::getk3Indices()
     return this->k3Indices;
 }
 
-map<index1d, float> MBTR::k1GeomAtomicNumber(const vector<index1d> &indexList)
+vector<index3d> MBTR::getk3Indices(float radius, float maxPerimeter)
 {
-    map<index1d,float> valueMap;
-    for (const index1d& index : indexList) {
-        int i = index.i;
-        int atomicNumber = this->atomicNumbers[i];
-        valueMap[index] = atomicNumber;
-    }
+    // Use cached value if possible
+    if (!this->k3IndicesInitialized) {
+
+        // The perimeter of a triangle is at least twice the length of each
+        // side, so only pairs of atoms within half of the maximum perimeter
+        // can take part in the triplets. The bounds are slightly loosened so
+        // that all triplets that pass the final weighting are enumerated
+        // despite rounding.
+        float tolerance = 1 + 1e-4;
+        float maxPerimeterLoose = maxPerimeter*tolerance;
+        float radiusLoose = min(radius*tolerance, maxPerimeterLoose/2);
+        int nAtoms = this->nAtoms;
+        int nInteracting = min(this->interactionLimit, nAtoms);
+
+        // Every atom of a triplet is within twice the radius, and within
+        // half of the perimeter, from the atoms of the triplet that are in
+        // the original cell. Only these atoms are considered.
+        float reach = min(2*radiusLoose, maxPerimeterLoose/2);
+        vector<bool> candidates(nAtoms, false);
+        fill(candidates.begin(), candidates.begin() + nInteracting, true);
+        vector<bool> all(nAtoms, true);
+        vector<vector<int> > interactingNeighbours = this->getNeighbours(reach, candidates, all);
+        for (int i=0; i < nInteracting; ++i) {
+            for (int j : interactingNeighbours[i]) {
+                candidates[j] = true;
+            }
+        }
+        interactingNeighbours.clear();
+        vector<vector<int> > neighbours = this->getNeighbours(radiusLoose, candidates, candidates);
+
+        vector<index3d> indexList;
 
-    return valueMap;
+        // The middle atom j is looped over and the triplets are formed from
+        // the pairs of its neighbours.
+        for (int j=0; j < nAtoms; ++j) {
+            const vector<int>& jNeighbours = neighbours[j];
+            int nNeighbours = jNeighbours.size();
+
+            // Only consider triplets that have one atom in the original cell
+            bool jInteracting = j < this->interactionLimit;
+            if (!jInteracting) {
+                bool hasInteracting = false;
+                for (int i : jNeighbours) {
+                    if (i < this->interactionLimit) {
+                        hasInteracting = true;
+                        break;
+                    }
+                }
+                if (!hasInteracting) {
+                    continue;
+                }
+            }
+
+            for (int a=0; a < nNeighbours; ++a) {
+                int i = jNeighbours[a];
+                float ijDist = this->getDistance(i, j);
+                for (int b=0; b < nNeighbours; ++b) {
+                    int k = jNeighbours[b];
+
+                    // The angles are symmetric: ijk = kji. The value is
+                    // calculated only for the triplet where k > i.
+                    if (k <= i) {
+                        continue;
+                    }
+                    if (!(jInteracting || i < this->interactionLimit || k < this->interactionLimit)) {
+                        continue;
+                    }
+                    float perimeter = ijDist + this->getDistance(j, k) + this->getDistance(k, i);
+                    if (perimeter <= maxPerimeterLoose) {
+                        index3d key = {i, j, k};
+                        indexList.push_back(key);
+                    }
+                }
+            }
+        }
+
+        // The triplets are ordered in the same way as in the full enumeration
+        sort(indexList.begin(), indexList.end());
+
+        this->k3Indices = indexList;
+        this->k3IndicesInitialized = true;
+    }
+    return this->k3Indices;
 }
 
-map<index2d, float> MBTR::k2GeomInverseDistance(const vector<index2d> &indexList)
+vector<index2d> MBTR::getk2IndicesPeriodic(float maxDistance)
 {
-    vector<vector<float> > distMatrix = this->getDistanceMatrix();
+    // Use cached value if possible
+    if (!this->k2IndicesInitialized) {
+        float radius = maxDistance*(1 + 1e-4);
+        int nInteracting = this->interactionLimit;
+        vector<index2d> indexList;
 
-    map<index2d,float> valueMap;
-    for (const index2d& index : indexList) {
-        int i = index.i;
-        int j = index.j;
+        // Each pair between an atom in the cell and a periodic image is found
+        // once in the neighbour list of the atom in the cell. The pairs
+        // within the cell are stored only where j > i.
+        for (int i=0; i < nInteracting; ++i) {
+            for (int n=this->neighbourOffsets[i]; n < this->neighbourOffsets[i+1]; ++n) {
+                int j = this->neighbourIndices[n];
+                if (j < nInteracting && j <= i) {
+                    continue;
+                }
+                if (this->getDistance(i, j) <= radius) {
+                    index2d key = {i, j};
+                    indexList.push_back(key);
+                }
+            }
+        }
 
-        float invDist = 1/distMatrix[i][j];
-        valueMap[index] = invDist;
+        this->k2Indices = indexList;
+        this->k2IndicesInitialized = true;
     }
-
-    return valueMap;
+    return this->k2Indices;
 }
 
-map<index3d, float> MBTR::k3GeomCosine(const vector<index3d> &indexList)
+vector<index3d> MBTR::getk3IndicesPeriodic(float radius, float maxPerimeter)
 {
-    vector<vector<float> > distMatrix = this->getDistanceMatrix();
-    vector<vector<vector<float> > > dispTensor = this->getDisplacementTensor();
+    // Use cached value if possible
+    if (!this->k3IndicesInitialized) {
+        float tolerance = 1 + 1e-4;
+        float maxPerimeterLoose = maxPerimeter*tolerance;
+        float radiusLoose = min(radius*tolerance, maxPerimeterLoose/2);
+        int nInteracting = this->interactionLimit;
+        vector<index3d> indexList;
+        vector<int> jNeighbours;
+        vector<const int*> jTranslations;
+
+        // Every triplet that has at least one atom in the cell is a
+        // translation of a triplet whose middle atom j is in the cell. The
+        // triplets are enumerated only for the middle atoms in the cell, and
+        // each triplet is repeated for every distinct translation that
+        // brings one of its atoms into the cell.
+        for (int j=0; j < nInteracting; ++j) {
+            jNeighbours.clear();
+            jTranslations.clear();
+            for (int n=this->neighbourOffsets[j]; n < this->neighbourOffsets[j+1]; ++n) {
+                int i = this->neighbourIndices[n];
+                if (this->getDistance(i, j) <= radiusLoose) {
+                    jNeighbours.push_back(i);
+                    jTranslations.push_back(&this->translations[3*n]);
+                }
+            }
 
-    map<index3d,float> valueMap;
-    for (const index3d& index : indexList) {
-        int i = index.i;
-        int j = index.j;
-        int k = index.k;
+            int nNeighbours = jNeighbours.size();
+            for (int a=0; a < nNeighbours; ++a) {
+                int i = jNeighbours[a];
+                const int* iTranslation = jTranslations[a];
+                bool iInCell = i < nInteracting;
+                float ijDist = this->getDistance(i, j);
+                for (int b=a+1; b < nNeighbours; ++b) {
+                    int k = jNeighbours[b];
+                    float perimeter = ijDist + this->getDistance(j, k) + this->getDistance(k, i);
+                    if (perimeter > maxPerimeterLoose) {
+                        continue;
+                    }
+                    const int* kTranslation = jTranslations[b];
+                    bool kInCell = k < nInteracting;
+                    bool sameCell = equal(iTranslation, iTranslation + 3, kTranslation);
+                    int nCopies = 1 + !iInCell + (!kInCell && !sameCell);
+                    index3d key = {i, j, k};
+                    indexList.insert(indexList.end(), nCopies, key);
+                }
+            }
+        }
 
-        vector<float> a = dispTensor[i][j];
-        vector<float> b = dispTensor[k][j];
-        float dotProd = inner_product(a.begin(), a.end(), b.begin(), 0.0);
-        float cosine = dotProd / (distMatrix[i][j]*distMatrix[k][j]);
-        valueMap[index] = cosine;
+        this->k3Indices = indexList;
+        this->k3IndicesInitialized = true;
     }
-
-    return valueMap;
+    return this->k3Indices;
 }
 
-map<index1d, float> MBTR::k1WeightUnity(const vector<index1d> &indexList)
+vector<vector<int> > MBTR::getNeighbours(float radius, const vector<bool>& centers, const vector<bool>& members)
 {
-    map<index1d, float> valueMap;
+    int nAtoms = this->nAtoms;
+    vector<vector<int> > neighbours(nAtoms);
+    if (nAtoms == 0) {
+        return neighbours;
+    }
 
-    for (const index1d& index : indexList) {
-        valueMap[index] = 1;
+    // The atoms are sorted into cubic bins with the width of the radius, so
+    // that the neighbours of an atom are found in the adjacent bins. The bins
+    // are not made narrower than what their index can represent.
+    vector<float> lower(this->positions, this->positions + 3);
+    vector<float> upper(this->positions, this->positions + 3);
+    for (int i=0; i < nAtoms; ++i) {
+        for (int c=0; c < 3; ++c) {
+            lower[c] = min(lower[c], this->positions[3*i+c]);
+            upper[c] = max(upper[c], this->positions[3*i+c]);
+        }
+    }
+    const long long maxBins = 1 << 20;
+    double width = radius;
+    for (int c=0; c < 3; ++c) {
+        width = std::max(width, (double)(upper[c] - lower[c])/(maxBins - 1));
+    }
+
+    vector<vector<long long> > atomBins(nAtoms, vector<long long>(3));
+    unordered_map<long long, vector<int> > bins;
+    for (int i=0; i < nAtoms; ++i) {
+        for (int c=0; c < 3; ++c) {
+            atomBins[i][c] = (long long)((this->positions[3*i+c] - lower[c])/width);
+        }
+        if (members[i]) {
+            long long key = (atomBins[i][0]*maxBins + atomBins[i][1])*maxBins + atomBins[i][2];
+            bins[key].push_back(i);
+        }
     }
 
-    return valueMap;
+    for (int i=0; i < nAtoms; ++i) {
+        if (!centers[i]) {
+            continue;
+        }
+        for (long long x = atomBins[i][0]-1; x <= atomBins[i][0]+1; ++x) {
+            for (long long y = atomBins[i][1]-1; y <= atomBins[i][1]+1; ++y) {
+                for (long long z = atomBins[i][2]-1; z <= atomBins[i][2]+1; ++z) {
+                    auto bin = bins.find((x*maxBins + y)*maxBins + z);
+                    if (bin == bins.end()) {
+                        continue;
+                    }
+                    for (int j : bin->second) {
+                        if (j != i && this->getDistance(i, j) <= radius) {
+                            neighbours[i].push_back(j);
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    return neighbours;
 }
 
-map<index2d, float> MBTR::k2WeightUnity(const vector<index2d> &indexList)
+float MBTR::getDistance(int i, int j)
 {
-    map<index2d, float> valueMap;
-
-    for (const index2d& index : indexList) {
-        valueMap[index] = 1;
+    // The displacement is always taken from the atom with the larger index
+    // so that the result does not depend on the order of the atoms.
+    if (i < j) {
+        swap(i, j);
+    }
+    const float* iPos = &this->positions[3*i];
+    const float* jPos = &this->positions[3*j];
+    float norm = 0;
+    for (int c=0; c < 3; ++c) {
+        float diff = jPos[c] - iPos[c];
+        norm += pow(diff, 2.0);
     }
+    return sqrt(norm);
+}
 
-    return valueMap;
+float MBTR::k1GeomAtomicNumber(const index1d &index)
+{
+    return this->atomicNumbers[index.i];
 }
 
-map<index3d, float> MBTR::k3WeightUnity(const vector<index3d> &indexList)
+float MBTR::k2GeomInverseDistance(const index2d &index)
 {
-    map<index3d, float> valueMap;
+    return 1/this->getDistance(index.i, index.j);
+}
 
-    for (const index3d& index : indexList) {
-        valueMap[index] = 1;
+float MBTR::k3GeomCosine(const index3d &index)
+{
+    int i = index.i;
+    int j = index.j;
+    int k = index.k;
+
+    // The displacements are calculated directly from the positions
+    float a[3];
+    float b[3];
+    for (int c=0; c < 3; ++c) {
+        a[c] = this->positions[3*j+c] - this->positions[3*i+c];
+        b[c] = this->positions[3*j+c] - this->positions[3*k+c];
     }
+    float dotProd = inner_product(a, a + 3, b, 0.0);
+    return dotProd / (this->getDistance(i, j)*this->getDistance(k, j));
+}
 
-    return valueMap;
+vector<float> MBTR::k1WeightUnity(const vector<index1d> &indexList)
+{
+    return vector<float>(indexList.size(), 1);
 }
 
-map<index2d, float> MBTR::k2WeightExponential(const vector<index2d> &indexList, float scale, float cutoff)
+vector<float> MBTR::k2WeightUnity(const vector<index2d> &indexList)
 {
-    vector<vector<float> > distMatrix = this->getDistanceMatrix();
-    map<index2d, float> valueMap;
+    return vector<float>(indexList.size(), 1);
+}
 
-    for (const index2d& index : indexList) {
-        int i = index.i;
-        int j = index.j;
+vector<float> MBTR::k3WeightUnity(const vector<index3d> &indexList)
+{
+    return vector<float>(indexList.size(), 1);
+}
 
-        float dist = distMatrix[i][j];
+vector<float> MBTR::k2WeightExponential(vector<index2d> &indexList, float scale, float cutoff)
+{
+    vector<float> values;
+
+    // The pairs that pass the cutoff are moved to the beginning of the list
+    size_t nValid = 0;
+    for (size_t n=0; n < indexList.size(); ++n) {
+        int i = indexList[n].i;
+        int j = indexList[n].j;
+
+        float dist = this->getDistance(i, j);
         float expValue = exp(-scale*dist);
         if (expValue >= cutoff) {
-            valueMap[index] = expValue;
+            indexList[nValid++] = indexList[n];
+            values.push_back(expValue);
         }
     }
+    indexList.resize(nValid);
 
-    return valueMap;
+    return values;
 }
 
-map<index3d, float> MBTR::k3WeightExponential(const vector<index3d> &indexList, float scale, float cutoff)
+vector<float> MBTR::k3WeightExponential(vector<index3d> &indexList, float scale, float cutoff)
 {
-    vector<vector<float> > distMatrix = this->getDistanceMatrix();
-    map<index3d, float> valueMap;
-
-    for (const index3d& index : indexList) {
-        int i = index.i;
-        int j = index.j;
-        int k = index.k;
-
-        float dist1 = distMatrix[i][j];
-        float dist2 = distMatrix[j][k];
-        float dist3 = distMatrix[k][i];
+    vector<float> values;
+
+    // The triplets that pass the cutoff are moved to the beginning of the
+    // list
+    size_t nValid = 0;
+    for (size_t n=0; n < indexList.size(); ++n) {
+        int i = indexList[n].i;
+        int j = indexList[n].j;
+        int k = indexList[n].k;
+
+        float dist1 = this->getDistance(i, j);
+        float dist2 = this->getDistance(j, k);
+        float dist3 = this->getDistance(k, i);
         float distTotal = dist1 + dist2 + dist3;
         float expValue = exp(-scale*distTotal);
         if (expValue >= cutoff) {
-            valueMap[index] = expValue;
+            indexList[nValid++] = indexList[n];
+            values.push_back(expValue);
         }
     }
+    indexList.resize(nValid);
 
-    return valueMap;
+    return values;
 }
 
-pair<map<index1d, vector<float> >, map<index1d,vector<float> > > MBTR::getK1GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters)
+/**
+ * The smooth cutoff function 1 + y(x/r)^(y+1) - (y+1)(x/r)^y for distances
+ * below the cutoff radius r.
+ */
+static float smoothCutoff(float distance, float rCut, float sharpness)
 {
-    // Use cached value if possible
-    if (!this->k1IndicesInitialized) {
-
-        vector<index1d> indexList = this->getk1Indices();
-
-        // Initialize the maps
-        map<index1d, vector<float> > geomMap;
-        map<index1d, vector<float> > weightMap;
+    float ratio = distance/rCut;
+    float power = pow(ratio, sharpness);
+    return 1 + sharpness*power*ratio - (sharpness + 1)*power;
+}
 
-        // Calculate all geometry values
-        map<index1d, float> geomValues;
-        if (geomFunc == "atomic_number") {
-            geomValues = this->k1GeomAtomicNumber(indexList);
-        } else {
-            throw invalid_argument("Invalid geometry function.");
+vector<float> MBTR::k2WeightSmoothCutoff(vector<index2d> &indexList, float rCut, float sharpness)
+{
+    vector<float> values;
+
+    // The pairs within the cutoff radius are moved to the beginning of the
+    // list
+    size_t nValid = 0;
+    for (size_t n=0; n < indexList.size(); ++n) {
+        float dist = this->getDistance(indexList[n].i, indexList[n].j);
+        if (dist < rCut) {
+            indexList[nValid++] = indexList[n];
+            values.push_back(smoothCutoff(dist, rCut, sharpness));
         }
+    }
+    indexList.resize(nValid);
 
-        // Calculate all weighting values
-        map<index1d, float> weightValues;
-        if (weightFunc == "unity") {
-            weightValues = this->k1WeightUnity(indexList);
-        } else {
-            throw invalid_argument("Invalid weighting function.");
-        }
+    return values;
+}
 
-        // Save the geometry and distances to the maps
-        for (index1d& index : indexList) {
-            int i = index.i;
+vector<float> MBTR::k3WeightSmoothCutoff(vector<index3d> &indexList, float rCut, float sharpness)
+{
+    vector<float> values;
+
+    // The triplets within the cutoff radius from the middle atom are moved
+    // to the beginning of the list
+    size_t nValid = 0;
+    for (size_t n=0; n < indexList.size(); ++n) {
+        int i = indexList[n].i;
+        int j = indexList[n].j;
+        int k = indexList[n].k;
+
+        float dist1 = this->getDistance(i, j);
+        float dist2 = this->getDistance(j, k);
+        if (dist1 < rCut && dist2 < rCut) {
+            indexList[nValid++] = indexList[n];
+            values.push_back(smoothCutoff(dist1, rCut, sharpness)*smoothCutoff(dist2, rCut, sharpness));
+        }
+    }
+    indexList.resize(nValid);
 
-            // By default C++ map will return a default constructed float when
-            // if the key is not found with the []-operator. Instead we
-            // explicitly ask if the key is present.
-            if ( weightValues.find(index) == weightValues.end() ) {
-                continue;
-            }
+    return values;
+}
 
-            float geomValue = geomValues[index];
-            float weightValue = weightValues[index];
+vector<int> MBTR::getElementIndices()
+{
+    vector<int> elements(this->nAtoms);
+    for (int i=0; i < this->nAtoms; ++i) {
+        elements[i] = this->atomicNumberToIndexMap.at(this->atomicNumbers[i]);
+    }
+    return elements;
+}
 
-            // Get the index of the present elements in the final vector
-            int i_elem = this->atomicNumbers[i];
-            int i_index = this->atomicNumberToIndexMap[i_elem];
+/**
+ * Stores the geometry and weighting function values of the given atom
+ * combinations contiguously for each element combination, see
+ * GeomsAndWeights. The atom combinations are grouped with a counting sort
+ * over the element combinations, so that each geometry function value is
+ * calculated directly into its final position and the enumeration order is
+ * kept within each element combination.
+ *
+ * @param indexList The atom combinations.
+ * @param weightValues The weight of each atom combination.
+ * @param k The number of atoms in a combination.
+ * @param nElements The number of elements.
+ * @param elementKey Returns the index of the element combination of an atom
+ * combination. The element indices e_1, ..., e_k are combined into the index
+ * (e_1*nElements + e_2)*nElements + ... + e_k.
+ * @param geomValue Returns the geometry function value of an atom
+ * combination.
+ * @param values The output.
+ */
+template <typename T, typename KeyFunc, typename GeomFunc>
+static void groupGeomsAndWeights(const vector<T> &indexList, const vector<float> &weightValues, int k, int nElements, KeyFunc elementKey, GeomFunc geomValue, GeomsAndWeights &values)
+{
+    size_t nKeys = 1;
+    for (int d=0; d < k; ++d) {
+        nKeys *= nElements;
+    }
 
-            // Save information in the part where j_index >= i_index
-            index1d indexKey = {i_index};
+    // The number of values in each element combination
+    size_t nValues = indexList.size();
+    vector<int> keys(nValues);
+    vector<int> starts(nKeys, 0);
+    for (size_t n=0; n < nValues; ++n) {
+        keys[n] = elementKey(indexList[n]);
+        ++starts[keys[n]];
+    }
 
-            // Save the values
-            geomMap[indexKey].push_back(geomValue);
-            weightMap[indexKey].push_back(weightValue);
+    // The present element combinations and the position of their first
+    // value
+    values.species.clear();
+    values.offsets.assign(1, 0);
+    int offset = 0;
+    vector<int> key(k);
+    for (size_t c=0; c < nKeys; ++c) {
+        int count = starts[c];
+        if (count == 0) {
+            continue;
+        }
+        size_t rest = c;
+        for (int d=k-1; d >= 0; --d) {
+            key[d] = rest % nElements;
+            rest /= nElements;
         }
+        values.species.insert(values.species.end(), key.begin(), key.end());
+        starts[c] = offset;
+        offset += count;
+        values.offsets.push_back(offset);
+    }
 
-        this->k1Map = make_pair(geomMap, weightMap);
-        this->k1MapInitialized = true;
+    values.geoms.resize(nValues);
+    values.weights.resize(nValues);
+    for (size_t n=0; n < nValues; ++n) {
+        int position = starts[keys[n]]++;
+        values.geoms[position] = geomValue(indexList[n]);
+        values.weights[position] = weightValues[n];
     }
-    return this->k1Map;
 }
 
-pair<map<index2d, vector<float> >, map<index2d,vector<float> > > MBTR::getK2GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters)
+const GeomsAndWeights& MBTR::getK1GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters)
 {
     // Use cached value if possible
-    if (!this->k2IndicesInitialized) {
+    if (!this->k1ValuesInitialized) {
 
-        vector<index2d> indexList = this->getk2Indices();
-
-        // Initialize the maps
-        map<index2d, vector<float> > geomMap;
-        map<index2d, vector<float> > weightMap;
+        vector<index1d> indexList = this->getk1Indices();
 
-        // Calculate all geometry values
-        map<index2d, float> geomValues;
-        if (geomFunc == "inverse_distance") {
-            geomValues = this->k2GeomInverseDistance(indexList);
+        // Calculate all weighting values
+        vector<float> weightValues;
+        if (weightFunc == "unity") {
+            weightValues = this->k1WeightUnity(indexList);
         } else {
+            throw invalid_argument("Invalid weighting function.");
+        }
+        if (geomFunc != "atomic_number") {
             throw invalid_argument("Invalid geometry function.");
         }
 
-        // Calculate all weighting values
-        map<index2d, float> weightValues;
+        // Save the geometry and weighting function values for each element
+        vector<int> elements = this->getElementIndices();
+        groupGeomsAndWeights(
+            indexList,
+            weightValues,
+            1,
+            this->nElements,
+            [&elements](const index1d &index) {
+                return elements[index.i];
+            },
+            [this](const index1d &index) {
+                return this->k1GeomAtomicNumber(index);
+            },
+            this->k1Values
+        );
+        this->k1ValuesInitialized = true;
+    }
+    return this->k1Values;
+}
+
+const GeomsAndWeights& MBTR::getK2GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters)
+{
+    // Use cached value if possible
+    if (!this->k2ValuesInitialized) {
+
+        // With the exponential weighting only the pairs within the distance
+        // where the weight exp(-s*x) comes down to the cutoff c, -ln(c)/s,
+        // are enumerated. With the smooth cutoff only the pairs within the
+        // cutoff radius are enumerated.
+        vector<index2d> indexList;
+        float maxDistance = INFINITY;
+        if (weightFunc == "exponential") {
+            maxDistance = -log(parameters["cutoff"])/parameters["scale"];
+        } else if (weightFunc == "smooth_cutoff") {
+            maxDistance = parameters["r_cut"];
+        }
+        if (this->periodic) {
+            indexList = this->getk2IndicesPeriodic(maxDistance);
+        } else if (isfinite(maxDistance) && maxDistance >= 0) {
+            indexList = this->getk2Indices(maxDistance);
+        } else {
+            indexList = this->getk2Indices();
+        }
+
+        // Calculate all weighting values. The pairs whose weight is below
+        // the cutoff are left out before calculating the geometry values.
+        vector<float> weightValues;
         if (weightFunc == "exponential") {
             float scale = parameters["scale"];
             float cutoff = parameters["cutoff"];
             weightValues = this->k2WeightExponential(indexList, scale, cutoff);
+        } else if (weightFunc == "smooth_cutoff") {
+            weightValues = this->k2WeightSmoothCutoff(indexList, parameters["r_cut"], parameters["sharpness"]);
         } else if (weightFunc == "unity") {
             weightValues = this->k2WeightUnity(indexList);
         } else {
             throw invalid_argument("Invalid weighting function.");
         }
+        if (geomFunc != "inverse_distance") {
+            throw invalid_argument("Invalid geometry function.");
+        }
 
-        // Save the geometry and distances to the maps
-        for (index2d& index : indexList) {
-            int i = index.i;
-            int j = index.j;
-
-            // By default C++ map will return a default constructed float when
-            // if the key is not found with the []-operator. Instead we
-            // explicitly ask if the key is present.
-            if ( weightValues.find(index) == weightValues.end() ) {
-                continue;
-            }
-
-            float geomValue = geomValues[index];
-            float weightValue = weightValues[index];
-
-            // When the pair of atoms are in different copies of the cell, the
-            // weight is halved. This is done in order to avoid double counting
-            // the same distance in the opposite direction. This correction
-            // makes periodic cells with different translations equal and also
-            // supercells equal to the primitive cell within a constant that is
-            // given by the number of repetitions of the primitive cell in the
-            // supercell.
-            if (!this->isLocal) {
-                if (!((i < this->interactionLimit) && (j < this->interactionLimit))) {
-                    weightValue /= 2;
+        // When the pair of atoms are in different copies of the cell, the
+        // weight is halved. This is done in order to avoid double counting
+        // the same distance in the opposite direction. This correction
+        // makes periodic cells with different translations equal and also
+        // supercells equal to the primitive cell within a constant that is
+        // given by the number of repetitions of the primitive cell in the
+        // supercell.
+        if (!this->isLocal) {
+            for (size_t n=0; n < indexList.size(); ++n) {
+                if (!((indexList[n].i < this->interactionLimit) && (indexList[n].j < this->interactionLimit))) {
+                    weightValues[n] /= 2;
                 }
             }
-
-            // Get the index of the present elements in the final vector
-            int i_elem = this->atomicNumbers[i];
-            int j_elem = this->atomicNumbers[j];
-            int i_index = this->atomicNumberToIndexMap[i_elem];
-            int j_index = this->atomicNumberToIndexMap[j_elem];
-
-            // Save information in the part where j_index >= i_index
-            index2d indexKey;
-            if (j_index < i_index) {
-                indexKey = {j_index, i_index};
-            } else {
-                indexKey = {i_index, j_index};
-            }
-
-            // Save the values
-            geomMap[indexKey].push_back(geomValue);
-            weightMap[indexKey].push_back(weightValue);
         }
 
-        this->k2Map = make_pair(geomMap, weightMap);
-        this->k2MapInitialized = true;
+        // Save the geometry and weighting function values in the part where
+        // the second element index is not smaller than the first
+        vector<int> elements = this->getElementIndices();
+        int nElements = this->nElements;
+        groupGeomsAndWeights(
+            indexList,
+            weightValues,
+            2,
+            nElements,
+            [&elements, nElements](const index2d &index) {
+                int i_index = elements[index.i];
+                int j_index = elements[index.j];
+                if (j_index < i_index) {
+                    swap(i_index, j_index);
+                }
+                return i_index*nElements + j_index;
+            },
+            [this](const index2d &index) {
+                return this->k2GeomInverseDistance(index);
+            },
+            this->k2Values
+        );
+        this->k2ValuesInitialized = true;
     }
-    return this->k2Map;
+    return this->k2Values;
 }
 
-pair<map<index3d, vector<float> >, map<index3d,vector<float> > > MBTR::getK3GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters)
+const GeomsAndWeights& MBTR::getK3GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters)
 {
     // Use cached value if possible
-    if (!this->k3IndicesInitialized) {
+    if (!this->k3ValuesInitialized) {
 
-        vector<index3d> indexList = this->getk3Indices();
-
-        // Initialize the maps
-        map<index3d, vector<float> > geomMap;
-        map<index3d, vector<float> > weightMap;
-
-        // Calculate all geometry values
-        map<index3d, float> geomValues;
-        if (geomFunc == "cosine") {
-            geomValues = this->k3GeomCosine(indexList);
+        // With the exponential weighting the triplets whose weight is below
+        // the cutoff are not enumerated at all: the weight exp(-s*x) is above
+        // the cutoff c only when the perimeter x is below -ln(c)/s. With the
+        // smooth cutoff only the triplets whose both distances from the
+        // middle atom are within the cutoff radius are enumerated.
+        vector<index3d> indexList;
+        float radius = INFINITY;
+        float maxPerimeter = INFINITY;
+        if (weightFunc == "exponential") {
+            maxPerimeter = -log(parameters["cutoff"])/parameters["scale"];
+            radius = maxPerimeter/2;
+        } else if (weightFunc == "smooth_cutoff") {
+            radius = parameters["r_cut"];
+        }
+        if (this->periodic) {
+            indexList = this->getk3IndicesPeriodic(radius, maxPerimeter);
+        } else if (isfinite(radius) && radius >= 0) {
+            indexList = this->getk3Indices(radius, maxPerimeter);
         } else {
-            throw invalid_argument("Invalid geometry function.");
+            indexList = this->getk3Indices();
         }
 
-        // Calculate all weighting values
-        map<index3d, float> weightValues;
+        // Calculate all weighting values. The triplets whose weight is below
+        // the cutoff are left out before calculating the geometry values.
+        vector<float> weightValues;
         if (weightFunc == "exponential") {
             float scale = parameters["scale"];
             float cutoff = parameters["cutoff"];
             weightValues = this->k3WeightExponential(indexList, scale, cutoff);
+        } else if (weightFunc == "smooth_cutoff") {
+            weightValues = this->k3WeightSmoothCutoff(indexList, parameters["r_cut"], parameters["sharpness"]);
         } else if (weightFunc == "unity") {
             weightValues = this->k3WeightUnity(indexList);
         } else {
             throw invalid_argument("Invalid weighting function.");
         }
+        if (geomFunc != "cosine") {
+            throw invalid_argument("Invalid geometry function.");
+        }
 
-        // Save the geometry and distances to the maps
-        for (index3d& index : indexList) {
-            int i = index.i;
-            int j = index.j;
-            int k = index.k;
-
-            // By default C++ map will return a default constructed float when
-            // if the key is not found with the []-operator. Instead we
-            // explicitly ask if the key is present.
-            if ( weightValues.find(index) == weightValues.end() ) {
-                continue;
-            }
-
-            float geomValue = geomValues[index];
-            float weightValue = weightValues[index];
-
-            // When at least one of the atoms is in a different copy of the cell, the
-            // weight is halved. This is done in order to avoid double counting
-            // the same distance in the opposite direction. This correction
-            // makes periodic cells with different translations equal and also
-            // supercells equal to the primitive cell within a constant that is
-            // given by the number of repetitions of the primitive cell in the
-            // supercell.
-            if (!this->isLocal) {
-                if (!((i < this->interactionLimit) && (j < this->interactionLimit) && (k < this->interactionLimit))) {
-                    weightValue /= 2;
+        // When at least one of the atoms is in a different copy of the cell, the
+        // weight is halved. This is done in order to avoid double counting
+        // the same distance in the opposite direction. This correction
+        // makes periodic cells with different translations equal and also
+        // supercells equal to the primitive cell within a constant that is
+        // given by the number of repetitions of the primitive cell in the
+        // supercell.
+        if (!this->isLocal) {
+            for (size_t n=0; n < indexList.size(); ++n) {
+                const index3d &index = indexList[n];
+                if (!((index.i < this->interactionLimit) && (index.j < this->interactionLimit) && (index.k < this->interactionLimit))) {
+                    weightValues[n] /= 2;
                 }
             }
-
-            // Get the index of the present elements in the final vector
-            int i_elem = this->atomicNumbers[i];
-            int j_elem = this->atomicNumbers[j];
-            int k_elem = this->atomicNumbers[k];
-            int i_index = this->atomicNumberToIndexMap[i_elem];
-            int j_index = this->atomicNumberToIndexMap[j_elem];
-            int k_index = this->atomicNumberToIndexMap[k_elem];
-
-            // Save information in the part where k_index >= i_index
-            index3d indexKey;
-            if (k_index < i_index) {
-                indexKey = {k_index, j_index, i_index};
-            } else {
-                indexKey = {i_index, j_index, k_index};
-            }
-
-            // Save the values
-            geomMap[indexKey].push_back(geomValue);
-            weightMap[indexKey].push_back(weightValue);
         }
 
-        this->k3Map = make_pair(geomMap, weightMap);
-        this->k3MapInitialized = true;
+        // Save the geometry and weighting function values in the part where
+        // the last element index is not smaller than the first
+        vector<int> elements = this->getElementIndices();
+        int nElements = this->nElements;
+        groupGeomsAndWeights(
+            indexList,
+            weightValues,
+            3,
+            nElements,
+            [&elements, nElements](const index3d &index) {
+                int i_index = elements[index.i];
+                int j_index = elements[index.j];
+                int k_index = elements[index.k];
+                if (k_index < i_index) {
+                    swap(i_index, k_index);
+                }
+                return (i_index*nElements + j_index)*nElements + k_index;
+            },
+            [this](const index3d &index) {
+                return this->k3GeomCosine(index);
+            },
+            this->k3Values
+        );
+        this->k3ValuesInitialized = true;
     }
-    return this->k3Map;
+    return this->k3Values;
 }
 
-pair<map<string,vector<float> >, map<string,vector<float> > > MBTR::getK1GeomsAndWeightsCython(string geomFunc, string weightFunc, map<string, float> parameters)
+void gaussianSums(const float* geoms, const float* weights, const int* offsets, const int* outputStarts, const int* gridStarts, const int* gridEnds, int nCombinations, double min, double max, double sigma, int n, double window, bool normalize, float* output)
 {
-    pair<map<index1d,vector<float> >, map<index1d,vector<float> > > cMap = this->getK1GeomsAndWeights(geomFunc, weightFunc, parameters);
-    map<index1d, vector<float> > geomValues = cMap.first;
-    map<index1d, vector<float> > weightValues = cMap.second;
-
-    map<string, vector<float> > cythonGeom;
-    map<string, vector<float> > cythonWeight;
-
-    for (auto const& x : geomValues) {
-        stringstream ss;
-        ss << x.first.i;
-        string stringKey = ss.str();
-        cythonGeom[stringKey] = x.second;
-        cythonWeight[stringKey] = weightValues[x.first];
+    // The grid point g covers the range from edge g to edge g+1, where the
+    // first edge is half a grid spacing below the first grid point.
+    double dx = (max - min)/(n - 1);
+    double first = min - dx/2;
+    double scale = 1/(sigma*sqrt(2.0));
+    double factor = 1/(2*dx);
+    if (!normalize) {
+        factor *= sigma*sqrt(2*PI);
     }
-    return make_pair(cythonGeom, cythonWeight);
-}
 
-pair<map<string,vector<float> >, map<string,vector<float> > > MBTR::getK2GeomsAndWeightsCython(string geomFunc, string weightFunc, map<string, float> parameters)
-{
-    pair<map<index2d,vector<float> >, map<index2d,vector<float> > > cMap = this->getK2GeomsAndWeights(geomFunc, weightFunc, parameters);
-    map<index2d, vector<float> > geomValues = cMap.first;
-    map<index2d, vector<float> > weightValues = cMap.second;
-
-    map<string, vector<float> > cythonGeom;
-    map<string, vector<float> > cythonWeight;
-
-    for (auto const& x : geomValues) {
-        stringstream ss;
-        ss << x.first.i;
-        ss << ",";
-        ss << x.first.j;
-        string stringKey = ss.str();
-        cythonGeom[stringKey] = x.second;
-        cythonWeight[stringKey] = weightValues[x.first];
-    }
-    return make_pair(cythonGeom, cythonWeight);
-}
+    vector<double> values;
+    vector<double> cdf;
+    for (int c = 0; c < nCombinations; ++c) {
+        int outputStart = outputStarts[c];
+        if (outputStart < 0) {
+            continue;
+        }
+        int gStart = gridStarts[c];
+        int gEnd = gridEnds[c];
+        values.assign(gEnd - gStart + 1, 0);
+
+        for (int i = offsets[c]; i < offsets[c+1]; ++i) {
+            double center = geoms[i];
+
+            // The edges that are within the window, limited to the evaluated
+            // grid points. Outside the window the cumulative distribution
+            // function is taken to be constant.
+            int eStart = std::max(gStart, (int)floor((center - window*sigma - first)/dx));
+            int eEnd = std::min(gEnd + 1, (int)ceil((center + window*sigma - first)/dx));
+            if (eEnd <= eStart) {
+                continue;
+            }
+            cdf.resize(eEnd - eStart + 1);
+            for (int e = eStart; e <= eEnd; ++e) {
+                cdf[e - eStart] = erf((first + e*dx - center)*scale);
+            }
+            double weight = weights[i]*factor;
+            for (int e = eStart; e < eEnd; ++e) {
+                values[e - gStart] += weight*(cdf[e - eStart + 1] - cdf[e - eStart]);
+            }
+        }
 
-pair<map<string,vector<float> >, map<string,vector<float> > > MBTR::getK3GeomsAndWeightsCython(string geomFunc, string weightFunc, map<string, float> parameters)
-{
-    pair<map<index3d,vector<float> >, map<index3d,vector<float> > > cMap = this->getK3GeomsAndWeights(geomFunc, weightFunc, parameters);
-    map<index3d, vector<float> > geomValues = cMap.first;
-    map<index3d, vector<float> > weightValues = cMap.second;
-
-    map<string, vector<float> > cythonGeom;
-    map<string, vector<float> > cythonWeight;
-
-    for (auto const& x : geomValues) {
-        stringstream ss;
-        ss << x.first.i;
-        ss << ",";
-        ss << x.first.j;
-        ss << ",";
-        ss << x.first.k;
-        string stringKey = ss.str();
-        cythonGeom[stringKey] = x.second;
-        cythonWeight[stringKey] = weightValues[x.first];
-    }
-    return make_pair(cythonGeom, cythonWeight);
+        float* row = output + outputStart;
+        for (int g = 0; g <= gEnd - gStart; ++g) {
+            row[g] += values[g];
+        }
+    }
 }
@@ -1,6 +1,8 @@
 #ifndef MBTR_H
 #define MBTR_H
 
+#define PI 3.1415926535897932384626433832795028841971693993751058209749445923078164062
+
 using namespace std;
 
 /**
@@ -54,8 +56,42 @@ struct index3d {
     }
 };
 
+/**
+ * The geometry and weighting function values of a term, stored contiguously
+ * for each element combination. The element indices of combination c are
+ * species[k*c] to species[k*c+k-1], where k is the number of atoms in the
+ * term, and its values are in the range offsets[c] to offsets[c+1]-1 of geoms
+ * and weights. The combinations are in increasing order of their element
+ * indices, and the values of a combination are in the order in which the
+ * atoms were enumerated.
+ */
+struct GeomsAndWeights {
+    vector<int> species;
+    vector<int> offsets;
+    vector<float> geoms;
+    vector<float> weights;
+};
+
 /**
  * Implementation for the performance-critical parts of MBTR.
+ *
+ * The positions and atomic numbers are given as contiguous arrays that are
+ * not copied and must outlive the instance. The same instance can serve all
+ * the k-terms. With the exponential weighting only the pairs and triplets
+ * within the distance given by the weight cutoff of each term are
+ * enumerated with a neighbour list, and their distances are calculated
+ * directly from the positions. The full distance matrix and displacement
+ * tensor are calculated once when requested and stored in flat arrays, where
+ * the value for the pair i and j is at index i*nAtoms+j.
+ *
+ * Periodic systems are given as the atoms in the cell together with a
+ * neighbour list that contains the periodic images around each atom. Only
+ * the pairs and triplets that have at least one atom in the cell are
+ * calculated, so no extended copy of the system is needed.
+ *
+ * The geometry and weighting function values of each term are written
+ * directly into the flat arrays of GeomsAndWeights, which are calculated once
+ * and cached.
  */
 class MBTR {
 
@@ -68,8 +104,10 @@ class MBTR {
         /**
          * Constructor
          *
-         * @param positions Atomic positions in cartesian coordinates.
+         * @param positions Atomic positions in cartesian coordinates as
+         * contiguous (x, y, z) triplets.
          * @param atomicNumbers Atomic numbers.
+         * @param nAtoms The number of atoms.
          * @param atomicNumberToIndexMap Mapping between atomic numbers and
          * their position in the final MBTR vector.
          * @param interactionLimit The number of atoms that are interacting.
@@ -77,7 +115,30 @@ class MBTR {
          * interacting with other atoms.
          * @param local Whether a local or a global MBTR is calculated.
          */
-        MBTR(vector<vector<float> > positions, vector<int> atomicNumbers, map<int,int> atomicNumberToIndexMap, int interactionLimit, bool local=false);
+        MBTR(const float* positions, const int* atomicNumbers, int nAtoms, map<int,int> atomicNumberToIndexMap, int interactionLimit, bool local=false);
+
+        /**
+         * Constructor for a periodic system. All the atoms in the cell are
+         * interacting. The neighbour list must contain every atom and
+         * periodic image within the distance used by the k-terms, and it is
+         * not copied.
+         *
+         * @param positions Atomic positions of the atoms in the cell in
+         * cartesian coordinates as contiguous (x, y, z) triplets.
+         * @param atomicNumbers Atomic numbers of the atoms in the cell.
+         * @param nAtoms The number of atoms in the cell.
+         * @param atomicNumberToIndexMap Mapping between atomic numbers and
+         * their position in the final MBTR vector.
+         * @param cell The cell vectors as contiguous (x, y, z) triplets.
+         * @param neighbourOffsets The neighbours of atom i are the entries
+         * neighbourOffsets[i] to neighbourOffsets[i+1]-1 of the neighbour
+         * list.
+         * @param neighbours The index of the atom in the cell for each
+         * neighbour.
+         * @param translations The translation of each neighbour in units of
+         * the cell vectors as contiguous triplets.
+         */
+        MBTR(const float* positions, const int* atomicNumbers, int nAtoms, map<int,int> atomicNumberToIndexMap, const double* cell, const int* neighbourOffsets, const int* neighbours, const int* translations);
 
         /**
          * Returns a list of 1D indices for the atom combinations that need to
@@ -95,6 +156,16 @@ class MBTR {
          */
         vector<index2d> getk2Indices();
 
+        /**
+         * Returns a list of 2D indices for the atom combinations of the k=2
+         * term whose distance can be below the given value. The pairs are
+         * formed from a neighbour list of the interacting atoms.
+         *
+         * @param maxDistance The maximum distance of the pairs.
+         * @return A list of 2D indices.
+         */
+        vector<index2d> getk2Indices(float maxDistance);
+
         /**
          * Returns a list of 3D indices for the atom combinations that need to
          * be calculated for the k=3 term.
@@ -103,165 +174,280 @@ class MBTR {
          */
         vector<index3d> getk3Indices();
 
+        /**
+         * Returns a list of 3D indices for the atom combinations of the k=3
+         * term whose distances from the middle atom B are within the given
+         * radius and whose perimeter A->B->C->A can be below the given value.
+         * The triplets are formed from a neighbour list, so the cost grows
+         * with the number of atoms times the squared number of neighbours
+         * instead of the cubed number of atoms.
+         *
+         * @param radius The maximum distance from the middle atom.
+         * @param maxPerimeter The maximum perimeter of the triplets, can be
+         * infinite.
+         * @return A list of 3D indices for k3.
+         */
+        vector<index3d> getk3Indices(float radius, float maxPerimeter);
+
+        /**
+         * Returns a list of 2D indices for the pairs of the k=2 term in a
+         * periodic system whose distance can be below the given value. The
+         * pairs are formed from the neighbour list of the atoms in the cell.
+         *
+         * @param maxDistance The maximum distance of the pairs.
+         * @return A list of 2D indices.
+         */
+        vector<index2d> getk2IndicesPeriodic(float maxDistance);
+
+        /**
+         * Returns a list of 3D indices for the triplets of the k=3 term in a
+         * periodic system whose distances from the middle atom B are within
+         * the given radius and whose perimeter A->B->C->A can be below the
+         * given value. The triplets are formed from the neighbour list of the
+         * atoms in the cell, and a triplet is repeated once for each of its
+         * translations that has an atom in the cell.
+         *
+         * @param radius The maximum distance from the middle atom.
+         * @param maxPerimeter The maximum perimeter of the triplets, can be
+         * infinite.
+         * @return A list of 3D indices for k3.
+         */
+        vector<index3d> getk3IndicesPeriodic(float radius, float maxPerimeter);
+
+        /**
+         * Returns the indices of the atoms within the given distance of each
+         * atom. The neighbours are found by sorting the atoms into bins.
+         *
+         * @param radius The maximum distance.
+         * @param centers Whether the neighbours of each atom are searched.
+         * The list of neighbours is left empty for the other atoms.
+         * @param members Whether each atom can be a neighbour.
+         * @return The list of neighbours for each atom.
+         */
+        vector<vector<int> > getNeighbours(float radius, const vector<bool>& centers, const vector<bool>& members);
+
+        /**
+         * Calculates the distance between two atoms directly from the
+         * positions. Also used for the values of getDistanceMatrix().
+         *
+         * @return The distance between atoms i and j.
+         */
+        float getDistance(int i, int j);
+
         /**
          * Weighting of 1 for all indices. Usually used for finite small
          * systems.
          *
-         * @return
+         * @return The weights in the order of the indices.
          */
-        map<index1d, float> k1WeightUnity(const vector<index1d> &indexList);
+        vector<float> k1WeightUnity(const vector<index1d> &indexList);
 
         /**
          * Weighting of 1 for all indices. Usually used for finite small
          * systems.
          *
-         * @return
+         * @return The weights in the order of the indices.
          */
-        map<index2d, float> k2WeightUnity(const vector<index2d> &indexList);
+        vector<float> k2WeightUnity(const vector<index2d> &indexList);
 
         /**
          * Weighting of 1 for all indices. Usually used for finite small
          * systems.
          *
-         * @return
+         * @return The weights in the order of the indices.
          */
-        map<index3d, float> k3WeightUnity(const vector<index3d> &indexList);
+        vector<float> k3WeightUnity(const vector<index3d> &indexList);
 
         /**
          * Weighting defined as e^(-sx), where x is the distance from
-         * A->B and s is the scaling factor.
+         * A->B and s is the scaling factor. The pairs whose weight is below
+         * the cutoff are removed from the given list.
          *
          * @param indexList List of pairs of atomic indices.
          * @param scale The prefactor in the exponential weighting.
          * @param cutoff Minimum value of the weighting to consider.
-         * @return Map of distances for pairs of atomic indices.
+         * @return The weights in the order of the remaining indices.
          */
-        map<index2d, float> k2WeightExponential(const vector<index2d> &indexList, float scale, float cutoff);
+        vector<float> k2WeightExponential(vector<index2d> &indexList, float scale, float cutoff);
 
         /**
          * Weighting defined as e^(-sx), where x is the distance from
-         * A->B->C->A and s is the scaling factor.
+         * A->B->C->A and s is the scaling factor. The triplets whose weight
+         * is below the cutoff are removed from the given list.
          *
          * @param indexList List of triplets of atomic indices.
          * @param scale The prefactor in the exponential weighting.
          * @param cutoff Minimum value of the weighting to consider.
-         * @return Map of distances for triplets of atomic indices.
+         * @return The weights in the order of the remaining indices.
          */
-        map<index3d, float> k3WeightExponential(const vector<index3d> &indexList, float scale, float cutoff);
+        vector<float> k3WeightExponential(vector<index3d> &indexList, float scale, float cutoff);
 
         /**
-         * Calculates the geometry function based on atomic numbers defined for
-         * k=1.
+         * Weighting defined as the smooth cutoff function
+         * 1 + y(x/r)^(y+1) - (y+1)(x/r)^y, where x is the distance between A
+         * and B, r is the cutoff radius and y is the sharpness. The weight and
+         * its derivative go to zero at the cutoff radius. The pairs beyond
+         * the cutoff radius are removed from the given list.
          *
-         * @return A map of atomic numbers for the given indices.
+         * @param indexList List of pairs of atomic indices.
+         * @param rCut The cutoff radius.
+         * @param sharpness The sharpness of the cutoff.
+         * @return The weights in the order of the remaining indices.
          */
-        map<index1d, float> k1GeomAtomicNumber(const vector<index1d> &indexList);
+        vector<float> k2WeightSmoothCutoff(vector<index2d> &indexList, float rCut, float sharpness);
 
         /**
-         * Calculates the inverse distance geometry function defined for k=2.
+         * Weighting defined as the product of the smooth cutoff functions
+         * of the distances A->B and B->C from the middle atom, see
+         * k2WeightSmoothCutoff(). The triplets beyond the cutoff radius are
+         * removed from the given list.
          *
-         * @return A map of inverse distance values for the given atomic pairs.
+         * @param indexList List of triplets of atomic indices.
+         * @param rCut The cutoff radius.
+         * @param sharpness The sharpness of the cutoff.
+         * @return The weights in the order of the remaining indices.
          */
-        map<index2d, float> k2GeomInverseDistance(const vector<index2d> &indexList);
+        vector<float> k3WeightSmoothCutoff(vector<index3d> &indexList, float rCut, float sharpness);
 
         /**
-         * Calculates the cosine geometry function defined for k3.
+         * Calculates the geometry function based on atomic numbers defined for
+         * k=1.
          *
-         * @return The cosine value for the angle defined between the given
-         * three atomic indices.
+         * @return The atomic number of the atom.
          */
-        map<index3d, float> k3GeomCosine(const vector<index3d> &indexList);
+        float k1GeomAtomicNumber(const index1d &index);
 
         /**
-         * Calculates a 3D matrix of distance vectors between atomic positions.
+         * Calculates the inverse distance geometry function defined for k=2.
          *
-         * @return A 3D matrix of displacement vectors. First index is the
-         * index of ith atom, second index is the index of jth atom, third
-         * index is the cartesian component.
+         * @return The inverse distance between the atoms of the pair.
          */
-        vector<vector<vector<float> > > getDisplacementTensor();
+        float k2GeomInverseDistance(const index2d &index);
 
         /**
-         * Calculates a 2D matrix of distances between atomic positions.
+         * Calculates the cosine geometry function defined for k3.
          *
-         * @return A 2D matrix of distances. First index is the
-         * index of ith atom, second index is the index of jth atom.
+         * @return The cosine of the angle defined between the three atomic
+         * indices.
          */
-        vector<vector<float> > getDistanceMatrix();
+        float k3GeomCosine(const index3d &index);
 
         /**
-         * Calculates a list of values for the k=1 geometry functions and the
-         * corresponding weights for each pair of atomic numbers.
+         * Calculates the distance vectors between atomic positions. The
+         * result is calculated once and cached.
          *
-         * @return A pair of maps for the geometry- and weighting function
-         * values for each pair of atomic elements.
+         * @return A flat array of displacement vectors, where the vector from
+         * atom i to atom j starts at index 3*(i*nAtoms+j).
          */
-        pair<map<index1d,vector<float> >, map<index1d,vector<float> > > getK1GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters=map<string, float>());
+        const vector<float>& getDisplacementTensor();
 
         /**
-         * Calculates a list of values for the k=2 geometry functions and the
-         * corresponding weights for each pair of atomic numbers.
+         * Calculates the distances between atomic positions. The result is
+         * calculated once and cached.
          *
-         * @return A pair of maps for the geometry- and weighting function
-         * values for each pair of atomic elements.
+         * @return A flat array of distances, where the distance between atoms
+         * i and j is at index i*nAtoms+j.
          */
-        pair<map<index2d,vector<float> >, map<index2d,vector<float> > > getK2GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters=map<string, float>());
+        const vector<float>& getDistanceMatrix();
 
         /**
-         * Calculates a list of values for the k=3 geometry functions and the
-         * corresponding weights for each triplet of atomic numbers.
+         * Calculates the values of the k=1 geometry function and the
+         * corresponding weights for each element. The result is calculated
+         * once and cached.
          *
-         * @return A pair of maps for the geometry- and weighting function
-         * values for each triplet of atomic elements.
+         * @return The values for each element, see GeomsAndWeights.
          */
-        pair<map<index3d,vector<float> >, map<index3d,vector<float> > > getK3GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters=map<string, float>());
+        const GeomsAndWeights& getK1GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters=map<string, float>());
 
         /**
-         * A convenience function that provides a Cython-compatible interface
-         * to the getK1GeomsAndWeights-function. Cython cannot handle custom
-         * map keys, so a string key is provided by this function. The key is
-         * formed by casting the atomic index to a string.
+         * Calculates the values of the k=2 geometry function and the
+         * corresponding weights for each pair of elements. The values for the
+         * elements i and j are stored in the combination where j >= i. The
+         * result is calculated once and cached.
+         *
+         * @return The values for each pair of elements, see GeomsAndWeights.
          */
-        pair<map<string,vector<float> >, map<string,vector<float> > > getK1GeomsAndWeightsCython(string geomFunc, string weightFunc, map<string, float> parameters=map<string, float>());
+        const GeomsAndWeights& getK2GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters=map<string, float>());
 
         /**
-         * A convenience function that provides a Cython-compatible interface
-         * to the getK2GeomsAndWeights-function. Cython cannot handle custom
-         * map keys, so a string key is provided by this function. The key is
-         * formed by casting the atomic indices to strings and concatenating
-         * them with comma as a separator.
+         * Calculates the values of the k=3 geometry function and the
+         * corresponding weights for each triplet of elements. The values for
+         * the elements i, j and k are stored in the combination where k >= i.
+         * The result is calculated once and cached.
+         *
+         * @return The values for each triplet of elements, see
+         * GeomsAndWeights.
          */
-        pair<map<string,vector<float> >, map<string,vector<float> > > getK2GeomsAndWeightsCython(string geomFunc, string weightFunc, map<string, float> parameters=map<string, float>());
+        const GeomsAndWeights& getK3GeomsAndWeights(string geomFunc, string weightFunc, map<string, float> parameters=map<string, float>());
 
+    private:
         /**
-         * A convenience function that provides a Cython-compatible interface
-         * to the getK3GeomsAndWeights-function. Cython cannot handle custom
-         * map keys, so a string key is provided by this function. The key is
-         * formed by casting the atomic indices to strings and concatenating
-         * them with comma as a separator.
+         * Returns the index of the element of each atom in the final MBTR
+         * vector.
          */
-        pair<map<string,vector<float> >, map<string,vector<float> > > getK3GeomsAndWeightsCython(string geomFunc, string weightFunc, map<string, float> parameters=map<string, float>());
+        vector<int> getElementIndices();
 
-    private:
-        vector<vector<float> > positions;
-        vector<int> atomicNumbers;
+        const float* positions;
+        const int* atomicNumbers;
+        int nAtoms;
         map<int,int> atomicNumberToIndexMap;
         int interactionLimit;
         bool isLocal;
-        vector<vector<vector<float> > > displacementTensor;
+        bool periodic;
+        const int* neighbourOffsets;
+        const int* translations;
+        vector<int> neighbourIndices;
+        vector<float> imagePositions;
+        vector<int> imageAtomicNumbers;
+        vector<float> displacementTensor;
         bool displacementTensorInitialized;
+        vector<float> distanceMatrix;
+        bool distanceMatrixInitialized;
         vector<index1d> k1Indices;
         bool k1IndicesInitialized;
         vector<index2d> k2Indices;
         bool k2IndicesInitialized;
         vector<index3d> k3Indices;
         bool k3IndicesInitialized;
-        pair<map<index1d, vector<float> >, map<index1d, vector<float> > > k1Map;
-        bool k1MapInitialized;
-        pair<map<index2d, vector<float> >, map<index2d, vector<float> > > k2Map;
-        bool k2MapInitialized;
-        pair<map<index3d, vector<float> >, map<index3d, vector<float> > > k3Map;
-        bool k3MapInitialized;
+        int nElements;
+        GeomsAndWeights k1Values;
+        bool k1ValuesInitialized;
+        GeomsAndWeights k2Values;
+        bool k2ValuesInitialized;
+        GeomsAndWeights k3Values;
+        bool k3ValuesInitialized;
 };
 
+/**
+ * Broadens the geometry function values of several element combinations with
+ * gaussians and adds the resulting distributions to the output.
+ *
+ * The distributions are evaluated on a grid of n points between min and max
+ * through the difference of the gaussian cumulative distribution function at
+ * the edges of each grid point. Each gaussian is only evaluated on the grid
+ * points within window standard deviations of its center, so the cost grows
+ * with the number of values times the window size instead of the grid size.
+ *
+ * @param geoms The geometry function values of all combinations.
+ * @param weights The weighting function values of all combinations.
+ * @param offsets The values of combination c are in the range offsets[c] to
+ * offsets[c+1]-1 of geoms and weights.
+ * @param outputStarts The position in the output for the first evaluated
+ * grid point of each combination. Combinations with a negative position are
+ * skipped.
+ * @param gridStarts The first evaluated grid point of each combination.
+ * @param gridEnds The last evaluated grid point of each combination.
+ * @param nCombinations The number of element combinations.
+ * @param min The first grid point.
+ * @param max The last grid point.
+ * @param sigma The standard deviation of the gaussians.
+ * @param n The number of grid points.
+ * @param window The number of standard deviations around the center of each
+ * gaussian within which it is evaluated.
+ * @param normalize Whether the gaussians are normalized to an area of one or
+ * to a maximum value of one.
+ * @param output The output to which the distributions are added.
+ */
+void gaussianSums(const float* geoms, const float* weights, const int* offsets, const int* outputStarts, const int* gridStarts, const int* gridEnds, int nCombinations, double min, double max, double sigma, int n, double window, bool normalize, float* output);
+
 #endif
@@ -8,12 +8,17 @@ cdef extern from "mbtr.cpp":
     pass
 
 cdef extern from "mbtr.h":
+  cdef cppclass GeomsAndWeights:
+        vector[int] species
+        vector[int] offsets
+        vector[float] geoms
+        vector[float] weights
   cdef cppclass MBTR:
-        MBTR(vector[vector[float]], vector[int], map[int,int], int, bool) except +
-        vector[vector[vector[float]]] getDisplacementTensor()
-        vector[vector[float]] getDistanceMatrix()
-        vector[vector[float]] getInverseDistanceMatrix()
-        map[pair[int,int],vector[float]] getInverseDistanceMap()
-        pair[map[string,vector[float]], map[string,vector[float]]] getK1GeomsAndWeightsCython(string, string, map[string, float]) except +
-        pair[map[string,vector[float]], map[string,vector[float]]] getK2GeomsAndWeightsCython(string, string, map[string, float]) except +
-        pair[map[string,vector[float]], map[string,vector[float]]] getK3GeomsAndWeightsCython(string, string, map[string, float]) except +
+        MBTR(const float*, const int*, int, map[int,int], int, bool) except +
+        MBTR(const float*, const int*, int, map[int,int], const double*, const int*, const int*, const int*) except +
+        const vector[float]& getDisplacementTensor()
+        const vector[float]& getDistanceMatrix()
+        const GeomsAndWeights& getK1GeomsAndWeights(string, string, map[string, float]) except +
+        const GeomsAndWeights& getK2GeomsAndWeights(string, string, map[string, float]) except +
+        const GeomsAndWeights& getK3GeomsAndWeights(string, string, map[string, float]) except +
+  void gaussianSums(const float*, const float*, const int*, const int*, const int*, const int*, int, double, double, double, int, double, bool, float*)
@@ -4,64 +4,224 @@ import numpy as np
 from libcpp cimport bool
 from libcpp.vector cimport vector
 from libcpp.map cimport map
-from mbtr cimport MBTR
+from mbtr cimport MBTR, GeomsAndWeights, gaussianSums
+
+
+cdef class IntBuffer:
+    """Exposes a C++ vector of integers through the buffer protocol, so that
+    it can be used as a read-only numpy array without copying. The vector
+    belongs to the owner, which is kept alive by the buffer.
+    """
+    cdef const vector[int] *values
+    cdef object owner
+    cdef Py_ssize_t shape[1]
+    cdef Py_ssize_t strides[1]
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        self.shape[0] = self.values.size()
+        self.strides[0] = sizeof(int)
+        buffer.buf = <char *>self.values.data()
+        buffer.format = "i"
+        buffer.internal = NULL
+        buffer.itemsize = sizeof(int)
+        buffer.len = self.values.size()*sizeof(int)
+        buffer.ndim = 1
+        buffer.obj = self
+        buffer.readonly = 1
+        buffer.shape = self.shape
+        buffer.strides = self.strides
+        buffer.suboffsets = NULL
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+
+cdef class FloatBuffer:
+    """Exposes a C++ vector of floats through the buffer protocol, so that it
+    can be used as a read-only numpy array without copying. The vector
+    belongs to the owner, which is kept alive by the buffer.
+    """
+    cdef const vector[float] *values
+    cdef object owner
+    cdef Py_ssize_t shape[1]
+    cdef Py_ssize_t strides[1]
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        self.shape[0] = self.values.size()
+        self.strides[0] = sizeof(float)
+        buffer.buf = <char *>self.values.data()
+        buffer.format = "f"
+        buffer.internal = NULL
+        buffer.itemsize = sizeof(float)
+        buffer.len = self.values.size()*sizeof(float)
+        buffer.ndim = 1
+        buffer.obj = self
+        buffer.readonly = 1
+        buffer.shape = self.shape
+        buffer.strides = self.strides
+        buffer.suboffsets = NULL
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        pass
+
+
+cdef int_array(const vector[int] *values, owner):
+    """Returns a numpy array that shares the memory of the given vector."""
+    cdef IntBuffer buffer = IntBuffer()
+    buffer.values = values
+    buffer.owner = owner
+    return np.asarray(buffer)
+
+
+cdef float_array(const vector[float] *values, owner):
+    """Returns a numpy array that shares the memory of the given vector."""
+    cdef FloatBuffer buffer = FloatBuffer()
+    buffer.values = values
+    buffer.owner = owner
+    return np.asarray(buffer)
+
+
+def gaussian_sums(
+        const float[::1] geoms,
+        const float[::1] weights,
+        const int[::1] offsets,
+        const int[::1] output_starts,
+        const int[::1] grid_starts,
+        const int[::1] grid_ends,
+        double minimum,
+        double maximum,
+        double sigma,
+        int n,
+        double window,
+        bool normalize,
+        float[::1] output):
+    """Broadens the geometry function values of the element combinations with
+    gaussians and adds the distributions to the given output. See
+    gaussianSums() in mbtr.h for the arguments.
+    """
+    cdef int n_combinations = offsets.shape[0] - 1
+    if n_combinations == 0 or geoms.shape[0] == 0:
+        return
+    gaussianSums(
+        &geoms[0],
+        &weights[0],
+        &offsets[0],
+        &output_starts[0],
+        &grid_starts[0],
+        &grid_ends[0],
+        n_combinations,
+        minimum,
+        maximum,
+        sigma,
+        n,
+        window,
+        normalize,
+        &output[0]
+    )
+
 
 cdef class MBTRWrapper:
     cdef MBTR *thisptr      # hold a C++ instance which we're wrapping
+    cdef object positions         # the positions are referenced by the C++ instance
+    cdef object atomic_numbers    # the atomic numbers are referenced by the C++ instance
+    cdef object neighbour_list    # the neighbour list is referenced by the C++ instance
+
+    def __cinit__(self, positions, atomic_numbers, map[int,int] atomic_number_to_index_map, int interaction_limit, bool is_local, cell=None, neighbour_list=None):
+        """The positions and atomic numbers are converted into contiguous
+        arrays that are shared with the C++ instance.
+
+        For a periodic system the cell and a neighbour list are given. The
+        neighbour list is a tuple (offsets, neighbours, translations), where
+        the neighbours of atom i are the entries offsets[i] to
+        offsets[i+1]-1, neighbours contains the index of each neighbour in
+        the cell and translations the translation of each neighbour in units
+        of the cell vectors. All the atoms in the cell are then interacting.
+        """
+        positions = np.ascontiguousarray(positions, dtype=np.float32).reshape(-1, 3)
+        atomic_numbers = np.ascontiguousarray(atomic_numbers, dtype=np.int32)
+        if positions.shape[0] != atomic_numbers.shape[0]:
+            raise ValueError("The number of positions and atomic numbers do not match.")
+        cdef const float[:, ::1] positions_view = positions
+        cdef const int[::1] atomic_numbers_view = atomic_numbers
+        cdef const float *positions_ptr = NULL
+        cdef const int *atomic_numbers_ptr = NULL
+        cdef int n_atoms = atomic_numbers.shape[0]
+        if n_atoms != 0:
+            positions_ptr = &positions_view[0, 0]
+            atomic_numbers_ptr = &atomic_numbers_view[0]
+        self.positions = positions
+        self.atomic_numbers = atomic_numbers
+        if neighbour_list is None:
+            self.thisptr = new MBTR(positions_ptr, atomic_numbers_ptr, n_atoms, atomic_number_to_index_map, interaction_limit, is_local)
+            return
 
-    def __cinit__(self, vector[vector[float]] positions, vector[int] atomic_numbers, map[int,int] atomic_number_to_index_map, int interaction_limit, bool is_local):
-        self.thisptr = new MBTR(positions, atomic_numbers, atomic_number_to_index_map, interaction_limit, is_local)
+        offsets, neighbours, translations = neighbour_list
+        offsets = np.ascontiguousarray(offsets, dtype=np.int32)
+        neighbours = np.ascontiguousarray(neighbours, dtype=np.int32)
+        translations = np.ascontiguousarray(translations, dtype=np.int32).reshape(-1, 3)
+        if offsets.shape[0] != n_atoms + 1 or neighbours.shape[0] != translations.shape[0] or offsets[-1] != neighbours.shape[0]:
+            raise ValueError("The neighbour list does not match the atoms.")
+        cell = np.ascontiguousarray(cell, dtype=np.float64).reshape(3, 3)
+        cdef const double[:, ::1] cell_view = cell
+        cdef const int[::1] offsets_view = offsets
+        cdef const int *neighbours_ptr = NULL
+        cdef const int *translations_ptr = NULL
+        cdef const int[::1] neighbours_view
+        cdef const int[:, ::1] translations_view
+        if neighbours.shape[0] != 0:
+            neighbours_view = neighbours
+            translations_view = translations
+            neighbours_ptr = &neighbours_view[0]
+            translations_ptr = &translations_view[0, 0]
+        self.neighbour_list = (offsets, neighbours, translations)
+        self.thisptr = new MBTR(positions_ptr, atomic_numbers_ptr, n_atoms, atomic_number_to_index_map, &cell_view[0, 0], &offsets_view[0], neighbours_ptr, translations_ptr)
 
     def __dealloc__(self):
         del self.thisptr
 
     def get_displacement_tensor(self):
-        return np.array(self.thisptr.getDisplacementTensor(), dtype=np.float32)
+        n_atoms = self.atomic_numbers.shape[0]
+        return np.array(self.thisptr.getDisplacementTensor(), dtype=np.float32).reshape(n_atoms, n_atoms, 3)
 
     def get_distance_matrix(self):
-        return np.array(self.thisptr.getDistanceMatrix(), dtype=np.float32)
+        n_atoms = self.atomic_numbers.shape[0]
+        return np.array(self.thisptr.getDistanceMatrix(), dtype=np.float32).reshape(n_atoms, n_atoms)
 
     def get_k1_geoms_and_weights(self, geom_func, weight_func, parameters):
-        """Cython cannot directly provide the keys as tuples, so we have to do
-        the conversion here on the python side.
+        """Returns the k=1 geometry and weighting function values as flat
+        arrays. See get_geoms_and_weights() for the format.
         """
-        geom_map, weight_map = self.thisptr.getK1GeomsAndWeightsCython(geom_func, weight_func, parameters);
-        new_geom_map = {}
-        new_weight_map = {}
-
-        for key, value in geom_map.items():
-            new_key = tuple([int(key.decode("utf-8"))])
-            new_geom_map[new_key] = value
-            new_weight_map[new_key] = weight_map[key]
-
-        return new_geom_map, new_weight_map
+        cdef const GeomsAndWeights *values = &self.thisptr.getK1GeomsAndWeights(geom_func, weight_func, parameters)
+        return self.get_geoms_and_weights(values, 1)
 
     def get_k2_geoms_and_weights(self, geom_func, weight_func, parameters):
-        """Cython cannot directly provide the keys as tuples, so we have to do
-        the conversion here on the python side.
+        """Returns the k=2 geometry and weighting function values as flat
+        arrays. See get_geoms_and_weights() for the format.
         """
-        geom_map, weight_map = self.thisptr.getK2GeomsAndWeightsCython(geom_func, weight_func, parameters);
-        new_geom_map = {}
-        new_weight_map = {}
-
-        for key, value in geom_map.items():
-            new_key = tuple(int(x) for x in key.decode("utf-8").split(","))
-            new_geom_map[new_key] = value
-            new_weight_map[new_key] = weight_map[key]
-
-        return new_geom_map, new_weight_map
+        cdef const GeomsAndWeights *values = &self.thisptr.getK2GeomsAndWeights(geom_func, weight_func, parameters)
+        return self.get_geoms_and_weights(values, 2)
 
     def get_k3_geoms_and_weights(self, geom_func, weight_func, parameters):
-        """Cython cannot directly provide the keys as tuples, so we have to do
-        the conversion here on the python side.
+        """Returns the k=3 geometry and weighting function values as flat
+        arrays. See get_geoms_and_weights() for the format.
         """
-        geom_map, weight_map = self.thisptr.getK3GeomsAndWeightsCython(geom_func, weight_func, parameters);
-        new_geom_map = {}
-        new_weight_map = {}
+        cdef const GeomsAndWeights *values = &self.thisptr.getK3GeomsAndWeights(geom_func, weight_func, parameters)
+        return self.get_geoms_and_weights(values, 3)
 
-        for key, value in geom_map.items():
-            new_key = tuple(int(x) for x in key.decode("utf-8").split(","))
-            new_geom_map[new_key] = value
-            new_weight_map[new_key] = weight_map[key]
+    cdef get_geoms_and_weights(self, const GeomsAndWeights *values, int k):
+        """Wraps the flat results cached by the C++ instance into read-only
+        numpy arrays. The arrays share the memory of the C++ instance, which
+        is kept alive as long as the arrays exist, so no copies are made.
 
-        return new_geom_map, new_weight_map
+        Returns:
+            tuple: (species, offsets, geoms, weights) where species is an
+            array of shape [n_combinations, k] of the species indices in each
+            combination. The geometry and weighting function values of
+            combination c are geoms[offsets[c]:offsets[c+1]] and
+            weights[offsets[c]:offsets[c+1]].
+        """
+        species = int_array(&values.species, self).reshape(-1, k)
+        offsets = int_array(&values.offsets, self)
+        geoms = float_array(&values.geoms, self)
+        weights = float_array(&values.weights, self)
+        return species, offsets, geoms, weights
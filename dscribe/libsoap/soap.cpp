@@ -0,0 +1,599 @@
+#include "soap.h"
+#include <vector>
+#include <cmath>
+#include <algorithm>
+using namespace std;
+
+SOAPTabulated::SOAPTabulated(int nMax, int lMax, const double* radialTable, int nIntervals, double spacing, int nSpecies, bool crossover, int compression, const double* embedding, int nChannels)
+    : nMax(nMax)
+    , lMax(lMax)
+    , nSpecies(nSpecies)
+    , crossover(crossover)
+    , compression(compression)
+    , nChannels(nChannels)
+    , radialTable(radialTable)
+    , embedding(embedding)
+    , channelsPresent(nChannels, 1)
+    , nIntervals(nIntervals)
+    , spacing(spacing)
+{
+    nElementFeatures = (lMax+1)*nMax*(nMax+1)/2;
+    nCoefficients = nSpecies*(lMax+1)*nMax*(2*lMax+1);
+    if (compression == COMPRESSION_MU1NU1) {
+        nFeatures = nSpecies*(lMax+1)*nMax*nMax;
+    } else {
+        int n = compression == COMPRESSION_EMBEDDING ? nChannels : nSpecies;
+        int nBlocks = crossover ? n*(n+1)/2 : n;
+        nFeatures = nBlocks*nElementFeatures;
+    }
+
+    // Normalization of the real spherical harmonics
+    harmonicNorms.resize((lMax+1)*(lMax+1));
+    for (int l=0; l <= lMax; ++l) {
+        harmonicNorms[l*l+l] = sqrt((2*l+1)/(4*PI));
+        for (int m=1; m <= l; ++m) {
+            double ratio = 1;
+            for (int k=l-m+1; k <= l+m; ++k) {
+                ratio /= k;
+            }
+            double norm = sqrt(2*(2*l+1)/(4*PI)*ratio);
+            harmonicNorms[l*l+l+m] = norm;
+            harmonicNorms[l*l+l-m] = norm;
+        }
+    }
+
+    // Factors for the recursion of the associated Legendre polynomials
+    recursionFactors.resize(2*(lMax+1)*(lMax+1));
+    for (int m=0; m <= lMax; ++m) {
+        for (int l=m+2; l <= lMax; ++l) {
+            int index = 2*(m*(lMax+1)+l);
+            recursionFactors[index] = (2.0*l-1)/(l-m);
+            recursionFactors[index+1] = (l+m-1.0)/(l-m);
+        }
+    }
+
+    powerSpectrumFactors.resize(lMax+1);
+    for (int l=0; l <= lMax; ++l) {
+        powerSpectrumFactors[l] = PI*sqrt(8.0/(2*l+1));
+    }
+}
+
+int SOAPTabulated::getCoefficientIndex(int iSpecies, int l, int m) const
+{
+    // The coefficients are stored in the order species, l, m, n with the
+    // radial index running fastest. m runs from 0 to 2l.
+    return ((iSpecies*(lMax+1) + l)*(2*lMax+1) + m)*nMax;
+}
+
+void SOAPTabulated::getSolidHarmonics(double x, double y, double z, double r2, vector<double> &harmonics) const
+{
+    // The real solid harmonics r^l*Y_lm are calculated with the recursion for
+    // the associated Legendre polynomials, where the powers of sin(theta)
+    // and r are absorbed into the polynomials and the real and imaginary
+    // parts of (x+iy)^m.
+    double c = 1;
+    double s = 0;
+    double pmm = 1;
+    for (int m=0; m <= lMax; ++m) {
+        double p2 = 0;
+        double p1 = pmm;
+        for (int l=m; l <= lMax; ++l) {
+            double p;
+            if (l == m) {
+                p = pmm;
+            } else if (l == m+1) {
+                p = (2*m+1)*z*pmm;
+            } else {
+                const double* factors = &recursionFactors[2*(m*(lMax+1)+l)];
+                p = factors[0]*z*p1 - factors[1]*r2*p2;
+            }
+            if (l > m) {
+                p2 = p1;
+                p1 = p;
+            }
+            if (m == 0) {
+                harmonics[l*l+l] = harmonicNorms[l*l+l]*p;
+            } else {
+                harmonics[l*l+l+m] = harmonicNorms[l*l+l+m]*p*c;
+                harmonics[l*l+l-m] = harmonicNorms[l*l+l-m]*p*s;
+            }
+        }
+        double cNew = c*x - s*y;
+        s = c*y + s*x;
+        c = cNew;
+        pmm *= 2*m+1;
+    }
+}
+
+void SOAPTabulated::getSolidHarmonicsGradient(double x, double y, double z, double r2, vector<double> &harmonics, vector<double> &gradients) const
+{
+    // The same recursions as in getSolidHarmonics, where the gradient of
+    // each quantity with respect to (x, y, z) is carried along. The
+    // gradients are stored as contiguous triplets.
+    double c = 1;
+    double s = 0;
+    double dc[3] = {0, 0, 0};
+    double ds[3] = {0, 0, 0};
+    double dr2[3] = {2*x, 2*y, 2*z};
+    double pmm = 1;
+    for (int m=0; m <= lMax; ++m) {
+        double p2 = 0;
+        double p1 = pmm;
+        double dp2[3] = {0, 0, 0};
+        double dp1[3] = {0, 0, 0};
+        for (int l=m; l <= lMax; ++l) {
+            double p;
+            double dp[3] = {0, 0, 0};
+            if (l == m) {
+                p = pmm;
+            } else if (l == m+1) {
+                p = (2*m+1)*z*pmm;
+                dp[2] = (2*m+1)*pmm;
+            } else {
+                const double* factors = &recursionFactors[2*(m*(lMax+1)+l)];
+                p = factors[0]*z*p1 - factors[1]*r2*p2;
+                for (int d=0; d < 3; ++d) {
+                    dp[d] = factors[0]*z*dp1[d] - factors[1]*(r2*dp2[d] + dr2[d]*p2);
+                }
+                dp[2] += factors[0]*p1;
+            }
+            if (l > m) {
+                p2 = p1;
+                p1 = p;
+                for (int d=0; d < 3; ++d) {
+                    dp2[d] = dp1[d];
+                    dp1[d] = dp[d];
+                }
+            }
+            if (m == 0) {
+                double norm = harmonicNorms[l*l+l];
+                harmonics[l*l+l] = norm*p;
+                for (int d=0; d < 3; ++d) {
+                    gradients[3*(l*l+l)+d] = norm*dp[d];
+                }
+            } else {
+                double norm = harmonicNorms[l*l+l+m];
+                harmonics[l*l+l+m] = norm*p*c;
+                harmonics[l*l+l-m] = norm*p*s;
+                for (int d=0; d < 3; ++d) {
+                    gradients[3*(l*l+l+m)+d] = norm*(dp[d]*c + p*dc[d]);
+                    gradients[3*(l*l+l-m)+d] = norm*(dp[d]*s + p*ds[d]);
+                }
+            }
+        }
+        double cNew = c*x - s*y;
+        double sNew = c*y + s*x;
+        double dcNew[3];
+        double dsNew[3];
+        for (int d=0; d < 3; ++d) {
+            dcNew[d] = dc[d]*x - ds[d]*y;
+            dsNew[d] = dc[d]*y + ds[d]*x;
+        }
+        dcNew[0] += c;
+        dcNew[1] -= s;
+        dsNew[0] += s;
+        dsNew[1] += c;
+        c = cNew;
+        s = sNew;
+        for (int d=0; d < 3; ++d) {
+            dc[d] = dcNew[d];
+            ds[d] = dsNew[d];
+        }
+        pmm *= 2*m+1;
+    }
+}
+
+void SOAPTabulated::getRadialIntegrals(double r, vector<double> &radial, vector<double> &derivatives) const
+{
+    // The cubic spline and its derivative with respect to the distance
+    int interval = min((int)(r/spacing), nIntervals-1);
+    double t = r - interval*spacing;
+    int size = (lMax+1)*nMax;
+    const double* c0 = radialTable + 4*interval*size;
+    const double* c1 = c0 + size;
+    const double* c2 = c1 + size;
+    const double* c3 = c2 + size;
+    for (int i=0; i < size; ++i) {
+        radial[i] = c0[i] + t*(c1[i] + t*(c2[i] + t*c3[i]));
+        derivatives[i] = c1[i] + t*(2*c2[i] + 3*t*c3[i]);
+    }
+}
+
+void SOAPTabulated::getNeighbourDerivatives(double x, double y, double z, vector<double> &harmonics, vector<double> &gradients, vector<double> &radial, vector<double> &radialDerivatives, vector<double> &derivatives) const
+{
+    // The gradient of the contribution g(r)*Y_lm(u) of a single neighbour,
+    // where u is the unit vector towards the neighbour. The gradient of
+    // Y_lm(u) is (grad S_lm(u) - l*S_lm(u)*u)/r for the solid harmonics S_lm.
+    // At the center only l=1 has a nonzero gradient, g'(0)*grad S_1m. The
+    // gradients are stored for each direction in the layout of the
+    // coefficients of a single species.
+    int speciesSize = (lMax+1)*nMax*(2*lMax+1);
+    double r = sqrt(x*x + y*y + z*z);
+    double u[3] = {0, 0, 1};
+    if (r > 0) {
+        u[0] = x/r;
+        u[1] = y/r;
+        u[2] = z/r;
+    }
+    getSolidHarmonicsGradient(u[0], u[1], u[2], 1, harmonics, gradients);
+    getRadialIntegrals(r, radial, radialDerivatives);
+
+    for (int l=0; l <= lMax; ++l) {
+        const double* g = &radial[l*nMax];
+        const double* gp = &radialDerivatives[l*nMax];
+        for (int m=0; m < 2*l+1; ++m) {
+            double h = harmonics[l*l+m];
+            const double* dh = &gradients[3*(l*l+m)];
+            for (int d=0; d < 3; ++d) {
+                double* out = &derivatives[d*speciesSize + getCoefficientIndex(0, l, m)];
+                if (r > 0) {
+                    double radialPart = h*u[d];
+                    double angularPart = (dh[d] - l*h*u[d])/r;
+                    for (int n=0; n < nMax; ++n) {
+                        out[n] = gp[n]*radialPart + g[n]*angularPart;
+                    }
+                } else {
+                    for (int n=0; n < nMax; ++n) {
+                        out[n] = l == 1 ? gp[n]*dh[d] : 0;
+                    }
+                }
+            }
+        }
+    }
+}
+
+void SOAPTabulated::getRadialIntegrals(double r, vector<double> &radial) const
+{
+    // The cubic spline is evaluated for all pairs of l and n in the interval
+    // that contains the distance.
+    int interval = min((int)(r/spacing), nIntervals-1);
+    double t = r - interval*spacing;
+    int size = (lMax+1)*nMax;
+    const double* c0 = radialTable + 4*interval*size;
+    const double* c1 = c0 + size;
+    const double* c2 = c1 + size;
+    const double* c3 = c2 + size;
+    for (int i=0; i < size; ++i) {
+        radial[i] = c0[i] + t*(c1[i] + t*(c2[i] + t*c3[i]));
+    }
+}
+
+void SOAPTabulated::getCoefficients(vector<double> &coefficients, vector<char> &present, const double* displacements, const int* species, int start, int end) const
+{
+    // Only the species that are present in the environment are considered
+    fill(present.begin(), present.end(), 0);
+    for (int i=start; i < end; ++i) {
+        present[species[i]] = 1;
+    }
+    int speciesSize = (lMax+1)*nMax*(2*lMax+1);
+    for (int iSpecies=0; iSpecies < nSpecies; ++iSpecies) {
+        if (present[iSpecies]) {
+            fill(coefficients.begin() + iSpecies*speciesSize, coefficients.begin() + (iSpecies+1)*speciesSize, 0.0);
+        }
+    }
+
+    // The spherical harmonics are calculated as solid harmonics of the unit
+    // vector. For a neighbour at the center only l=0 contributes, and the
+    // direction is arbitrary.
+    vector<double> harmonics((lMax+1)*(lMax+1));
+    vector<double> radial((lMax+1)*nMax);
+    for (int i=start; i < end; ++i) {
+        double x = displacements[3*i];
+        double y = displacements[3*i+1];
+        double z = displacements[3*i+2];
+        double r = sqrt(x*x + y*y + z*z);
+        if (r > 0) {
+            getSolidHarmonics(x/r, y/r, z/r, 1, harmonics);
+        } else {
+            getSolidHarmonics(0, 0, 1, 1, harmonics);
+        }
+        getRadialIntegrals(r, radial);
+
+        for (int l=0; l <= lMax; ++l) {
+            const double* g = &radial[l*nMax];
+            double* c = &coefficients[getCoefficientIndex(species[i], l, 0)];
+            for (int m=0; m < 2*l+1; ++m) {
+                double h = harmonics[l*l+m];
+                for (int n=0; n < nMax; ++n) {
+                    c[m*nMax+n] += h*g[n];
+                }
+            }
+        }
+    }
+}
+
+void SOAPTabulated::getPowerSpectrumBlock(const double* c1, const double* c2, vector<double> &block, int l) const
+{
+    // The products of the coefficients for degree l are summed over m for
+    // all pairs of radial basis functions at once.
+    fill(block.begin(), block.end(), 0.0);
+    for (int m=0; m < 2*l+1; ++m) {
+        const double* c1m = c1 + m*nMax;
+        const double* c2m = c2 + m*nMax;
+        for (int n1=0; n1 < nMax; ++n1) {
+            double value = c1m[n1];
+            double* b = &block[n1*nMax];
+            for (int n2=0; n2 < nMax; ++n2) {
+                b[n2] += value*c2m[n2];
+            }
+        }
+    }
+}
+
+double SOAPTabulated::getPowerSpectrum(const vector<double> &coefficients, int iSpecies, int jSpecies, int l, int n1, int n2) const
+{
+    const double* c1 = &coefficients[getCoefficientIndex(iSpecies, l, 0)];
+    const double* c2 = &coefficients[getCoefficientIndex(jSpecies, l, 0)];
+    double value = 0;
+    for (int m=0; m < 2*l+1; ++m) {
+        value += c1[m*nMax+n1]*c2[m*nMax+n2];
+    }
+    return powerSpectrumFactors[l]*value;
+}
+
+void SOAPTabulated::getPowerSpectrumRow(const vector<double> &coefficients, const vector<char> &present, int n, vector<double> &block, double* row) const
+{
+    // The pairs of the n species (or channels) are ordered as the elements of
+    // an upper triangular matrix from left to right and top to bottom. Within
+    // each pair the features are ordered by l and then by the pair of radial
+    // basis functions n1 <= n2. Pairs with species that are not present in
+    // the environment are zero.
+    for (int iSpecies=0; iSpecies < n; ++iSpecies) {
+        int jEnd = crossover ? n : iSpecies+1;
+        for (int jSpecies=iSpecies; jSpecies < jEnd; ++jSpecies) {
+            if (!present[iSpecies] || !present[jSpecies]) {
+                fill(row, row + nElementFeatures, 0.0);
+                row += nElementFeatures;
+                continue;
+            }
+            for (int l=0; l <= lMax; ++l) {
+                getPowerSpectrumBlock(
+                    &coefficients[getCoefficientIndex(iSpecies, l, 0)],
+                    &coefficients[getCoefficientIndex(jSpecies, l, 0)],
+                    block,
+                    l
+                );
+                for (int n1=0; n1 < nMax; ++n1) {
+                    for (int n2=n1; n2 < nMax; ++n2) {
+                        *row++ = powerSpectrumFactors[l]*block[n1*nMax+n2];
+                    }
+                }
+            }
+        }
+    }
+}
+
+void SOAPTabulated::getMu1Nu1Row(const vector<double> &coefficients, const vector<char> &present, vector<double> &total, vector<double> &block, double* row) const
+{
+    // The coefficients of the total density are the sum over the species
+    int speciesSize = (lMax+1)*nMax*(2*lMax+1);
+    fill(total.begin(), total.begin() + speciesSize, 0.0);
+    for (int iSpecies=0; iSpecies < nSpecies; ++iSpecies) {
+        if (present[iSpecies]) {
+            const double* c = &coefficients[iSpecies*speciesSize];
+            for (int j=0; j < speciesSize; ++j) {
+                total[j] += c[j];
+            }
+        }
+    }
+
+    // For each species the features are ordered by l and then by all pairs
+    // of radial basis functions n1, n2, where n1 belongs to the species and
+    // n2 to the total density.
+    int nSpeciesFeatures = (lMax+1)*nMax*nMax;
+    for (int iSpecies=0; iSpecies < nSpecies; ++iSpecies) {
+        if (!present[iSpecies]) {
+            fill(row, row + nSpeciesFeatures, 0.0);
+            row += nSpeciesFeatures;
+            continue;
+        }
+        for (int l=0; l <= lMax; ++l) {
+            getPowerSpectrumBlock(
+                &coefficients[getCoefficientIndex(iSpecies, l, 0)],
+                &total[getCoefficientIndex(0, l, 0)],
+                block,
+                l
+            );
+            for (int j=0; j < nMax*nMax; ++j) {
+                *row++ = powerSpectrumFactors[l]*block[j];
+            }
+        }
+    }
+}
+
+void SOAPTabulated::getEmbeddedCoefficients(const vector<double> &coefficients, const vector<char> &present, vector<double> &embedded) const
+{
+    // The coefficients of each channel are a linear combination of the
+    // coefficients of the species present in the environment.
+    int speciesSize = (lMax+1)*nMax*(2*lMax+1);
+    fill(embedded.begin(), embedded.begin() + nChannels*speciesSize, 0.0);
+    for (int iSpecies=0; iSpecies < nSpecies; ++iSpecies) {
+        if (!present[iSpecies]) {
+            continue;
+        }
+        const double* c = &coefficients[iSpecies*speciesSize];
+        for (int k=0; k < nChannels; ++k) {
+            double weight = embedding[iSpecies*nChannels+k];
+            double* e = &embedded[k*speciesSize];
+            for (int j=0; j < speciesSize; ++j) {
+                e[j] += weight*c[j];
+            }
+        }
+    }
+}
+
+void SOAPTabulated::getColumnsRow(const vector<double> &coefficients, const vector<char> &present, const int* columns, int nColumns, double* row) const
+{
+    // Each column is given by the indices (iSpecies, jSpecies, l, n1, n2)
+    for (int j=0; j < nColumns; ++j) {
+        const int* column = columns + 5*j;
+        if (present[column[0]] && present[column[1]]) {
+            row[j] = getPowerSpectrum(coefficients, column[0], column[1], column[2], column[3], column[4]);
+        } else {
+            row[j] = 0;
+        }
+    }
+}
+
+void SOAPTabulated::getRow(const vector<double> &coefficients, const vector<char> &present, vector<double> &work, vector<double> &block, const int* columns, int nColumns, double* row) const
+{
+    if (columns != nullptr) {
+        getColumnsRow(coefficients, present, columns, nColumns, row);
+    } else if (compression == COMPRESSION_MU1NU1) {
+        getMu1Nu1Row(coefficients, present, work, block, row);
+    } else if (compression == COMPRESSION_EMBEDDING) {
+        getEmbeddedCoefficients(coefficients, present, work);
+        getPowerSpectrumRow(work, channelsPresent, nChannels, block, row);
+    } else {
+        getPowerSpectrumRow(coefficients, present, nSpecies, block, row);
+    }
+}
+
+void SOAPTabulated::compute(float* output, const int* columns, int nColumns, int average, const double* displacements, const int* species, const int* offsets, int nCenters) const
+{
+    int nOutput = columns == nullptr ? nFeatures : nColumns;
+    int speciesSize = (lMax+1)*nMax*(2*lMax+1);
+    vector<double> coefficients(nSpecies*speciesSize);
+    vector<char> present(nSpecies);
+    vector<double> block(nMax*nMax);
+    vector<double> row(nOutput);
+    vector<double> work(max(nChannels, 1)*speciesSize);
+
+    // The inner average is the power spectrum of the averaged expansion
+    // coefficients. They are accumulated over the centers in a single buffer.
+    if (average == AVERAGE_INNER) {
+        vector<double> total(nCoefficients, 0.0);
+        vector<char> totalPresent(nSpecies, 0);
+        addCoefficients(&total[0], &totalPresent[0], displacements, species, offsets, nCenters);
+        createInnerAverage(output, columns, nColumns, &total[0], &totalPresent[0], nCenters);
+        return;
+    }
+
+    // The outer average is the average of the power spectra of the centers.
+    // They are accumulated in a single buffer instead of storing the power
+    // spectrum of each center. The values are rounded to single precision
+    // first, so that the result is the average of the individual outputs.
+    vector<double> total(nOutput, 0.0);
+    for (int i=0; i < nCenters; ++i) {
+        getCoefficients(coefficients, present, displacements, species, offsets[i], offsets[i+1]);
+        getRow(coefficients, present, work, block, columns, nColumns, &row[0]);
+        if (average == AVERAGE_OUTER) {
+            for (int j=0; j < nOutput; ++j) {
+                total[j] += (float)row[j];
+            }
+        } else {
+            copy(row.begin(), row.end(), output + (long)i*nOutput);
+        }
+    }
+    if (average == AVERAGE_OUTER) {
+        for (int j=0; j < nOutput; ++j) {
+            output[j] = total[j]/nCenters;
+        }
+    }
+}
+
+void SOAPTabulated::addCoefficients(double* total, char* present, const double* displacements, const int* species, const int* offsets, int nCenters) const
+{
+    int speciesSize = (lMax+1)*nMax*(2*lMax+1);
+    vector<double> coefficients(nCoefficients);
+    vector<char> centerPresent(nSpecies);
+    for (int i=0; i < nCenters; ++i) {
+        getCoefficients(coefficients, centerPresent, displacements, species, offsets[i], offsets[i+1]);
+        for (int iSpecies=0; iSpecies < nSpecies; ++iSpecies) {
+            if (centerPresent[iSpecies]) {
+                present[iSpecies] = 1;
+                for (int j=iSpecies*speciesSize; j < (iSpecies+1)*speciesSize; ++j) {
+                    total[j] += coefficients[j];
+                }
+            }
+        }
+    }
+}
+
+void SOAPTabulated::createInnerAverage(float* output, const int* columns, int nColumns, const double* total, const char* present, int nCenters) const
+{
+    int nOutput = columns == nullptr ? nFeatures : nColumns;
+    int speciesSize = (lMax+1)*nMax*(2*lMax+1);
+    vector<double> coefficients(total, total + nCoefficients);
+    vector<char> averagePresent(present, present + nSpecies);
+    vector<double> block(nMax*nMax);
+    vector<double> row(nOutput);
+    vector<double> work(max(nChannels, 1)*speciesSize);
+    for (int j=0; j < nCoefficients; ++j) {
+        coefficients[j] /= nCenters;
+    }
+    getRow(coefficients, averagePresent, work, block, columns, nColumns, &row[0]);
+    copy(row.begin(), row.end(), output);
+}
+
+void SOAPTabulated::create(float* output, int average, const double* displacements, const int* species, const int* offsets, int nCenters) const
+{
+    compute(output, nullptr, 0, average, displacements, species, offsets, nCenters);
+}
+
+void SOAPTabulated::createColumns(float* output, const int* columns, int nColumns, int average, const double* displacements, const int* species, const int* offsets, int nCenters) const
+{
+    compute(output, columns, nColumns, average, displacements, species, offsets, nCenters);
+}
+
+void SOAPTabulated::createDerivatives(float* output, float* derivatives, const int* slots, const double* displacements, const int* species, const int* offsets, int nCenters) const
+{
+    int speciesSize = (lMax+1)*nMax*(2*lMax+1);
+    int nRadialPairs = nMax*(nMax+1)/2;
+    vector<double> coefficients(nSpecies*speciesSize);
+    vector<char> present(nSpecies);
+    vector<double> block(nMax*nMax);
+    vector<double> block2(nMax*nMax);
+    vector<double> row(nFeatures);
+    vector<double> harmonics((lMax+1)*(lMax+1));
+    vector<double> gradients(3*(lMax+1)*(lMax+1));
+    vector<double> radial((lMax+1)*nMax);
+    vector<double> radialDerivatives((lMax+1)*nMax);
+    vector<double> coefficientDerivatives(3*speciesSize);
+
+    for (int i=0; i < nCenters; ++i) {
+        getCoefficients(coefficients, present, displacements, species, offsets[i], offsets[i+1]);
+        getPowerSpectrumRow(coefficients, present, nSpecies, block, &row[0]);
+        copy(row.begin(), row.end(), output + (long)i*nFeatures);
+
+        // A neighbour only changes the coefficients of its own species, so
+        // only the species pairs that contain it are affected. The
+        // derivatives of the neighbours are summed into the slot of the atom
+        // they belong to.
+        for (int k=offsets[i]; k < offsets[i+1]; ++k) {
+            getNeighbourDerivatives(displacements[3*k], displacements[3*k+1], displacements[3*k+2], harmonics, gradients, radial, radialDerivatives, coefficientDerivatives);
+            int kSpecies = species[k];
+            float* out = derivatives + (long)slots[k]*3*nFeatures;
+            for (int jSpecies=0; jSpecies < nSpecies; ++jSpecies) {
+                if (!present[jSpecies] || (!crossover && jSpecies != kSpecies)) {
+                    continue;
+                }
+                int a = min(kSpecies, jSpecies);
+                int b = max(kSpecies, jSpecies);
+                int pairIndex = crossover ? b + a*nSpecies - a*(a+1)/2 : a;
+                for (int l=0; l <= lMax; ++l) {
+                    int offset = pairIndex*nElementFeatures + l*nRadialPairs;
+                    for (int d=0; d < 3; ++d) {
+                        const double* dc = &coefficientDerivatives[d*speciesSize + getCoefficientIndex(0, l, 0)];
+                        const double* ca = &coefficients[getCoefficientIndex(a, l, 0)];
+                        const double* cb = &coefficients[getCoefficientIndex(b, l, 0)];
+                        fill(block.begin(), block.end(), 0.0);
+                        fill(block2.begin(), block2.end(), 0.0);
+                        if (a == kSpecies) {
+                            getPowerSpectrumBlock(dc, cb, block, l);
+                        }
+                        if (b == kSpecies) {
+                            getPowerSpectrumBlock(ca, dc, block2, l);
+                        }
+                        float* o = out + d*nFeatures + offset;
+                        for (int n1=0; n1 < nMax; ++n1) {
+                            for (int n2=n1; n2 < nMax; ++n2) {
+                                *o++ += powerSpectrumFactors[l]*(block[n1*nMax+n2] + block2[n1*nMax+n2]);
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
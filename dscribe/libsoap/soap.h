@@ -0,0 +1,118 @@
+#ifndef SOAP_H
+#define SOAP_H
+
+#include <vector>
+
+#define PI 3.1415926535897932384626433832795028841971693993751058209749445923078164062
+
+// The averaging modes of the output
+#define AVERAGE_OFF 0
+#define AVERAGE_OUTER 1
+#define AVERAGE_INNER 2
+
+// The compression modes of the species
+#define COMPRESSION_OFF 0
+#define COMPRESSION_MU1NU1 1
+#define COMPRESSION_EMBEDDING 2
+
+using namespace std;
+
+
+/**
+ * Implementation for the performance-critical parts of SOAP.
+ *
+ * The radial part of the expansion coefficients is given as a table of cubic
+ * splines over the distance with a uniform spacing. For each interval the
+ * table contains the coefficients of the powers 0 to 3 of the distance from
+ * the start of the interval for each pair of l and n. This makes the
+ * implementation independent of the radial basis. The table is not copied
+ * and must outlive the instance.
+ *
+ * The atomic environments are given as a neighbour list in compressed row
+ * format: the neighbours of center i are the entries offsets[i] to
+ * offsets[i+1]-1 of the species and displacement arrays. The displacements
+ * are given as contiguous (x, y, z) triplets and the species as indices to
+ * the ordered list of all species of the descriptor. The output is written
+ * directly in the layout that contains all species pairs. When averaging,
+ * only a single row is written: the outer average is the average of the
+ * power spectra of the centers and the inner average is the power spectrum
+ * of the averaged expansion coefficients. The inner average can also be
+ * accumulated over several calls: addCoefficients() adds the expansion
+ * coefficients of the given centers to a buffer owned by the caller, and
+ * createInnerAverage() writes the power spectrum of their average.
+ *
+ * The species can be compressed so that the number of features grows
+ * linearly with the number of species. With COMPRESSION_MU1NU1 the
+ * coefficients of each species are combined with the coefficients of the
+ * total density of all species, giving all pairs of n and n' for each species
+ * and l. With COMPRESSION_EMBEDDING the coefficients are projected onto a
+ * fixed number of channels with the given embedding matrix of shape
+ * nSpecies x nChannels, and the channels are used in place of the species.
+ * The embedding matrix is not copied and must outlive the instance.
+ *
+ * The derivatives of the full output with respect to the neighbour
+ * positions can be calculated together with the output. The derivatives of
+ * each neighbour are added to the slot given for it, so that the periodic
+ * images of an atom can be summed together.
+ */
+class SOAPTabulated {
+
+    public:
+        SOAPTabulated(
+            int nMax,
+            int lMax,
+            const double* radialTable,
+            int nIntervals,
+            double spacing,
+            int nSpecies,
+            bool crossover,
+            int compression,
+            const double* embedding,
+            int nChannels
+        );
+
+        void create(float* output, int average, const double* displacements, const int* species, const int* offsets, int nCenters) const;
+        void createColumns(float* output, const int* columns, int nColumns, int average, const double* displacements, const int* species, const int* offsets, int nCenters) const;
+        void createDerivatives(float* output, float* derivatives, const int* slots, const double* displacements, const int* species, const int* offsets, int nCenters) const;
+        void addCoefficients(double* total, char* present, const double* displacements, const int* species, const int* offsets, int nCenters) const;
+        void createInnerAverage(float* output, const int* columns, int nColumns, const double* total, const char* present, int nCenters) const;
+
+        int nMax;
+        int lMax;
+        int nSpecies;
+        bool crossover;
+        int compression;
+        int nChannels;
+        int nElementFeatures;
+        int nFeatures;
+        int nCoefficients;
+
+    private:
+        void getCoefficients(vector<double> &coefficients, vector<char> &present, const double* displacements, const int* species, int start, int end) const;
+        void getSolidHarmonics(double x, double y, double z, double r2, vector<double> &harmonics) const;
+        void getSolidHarmonicsGradient(double x, double y, double z, double r2, vector<double> &harmonics, vector<double> &gradients) const;
+        void getNeighbourDerivatives(double x, double y, double z, vector<double> &harmonics, vector<double> &gradients, vector<double> &radial, vector<double> &radialDerivatives, vector<double> &derivatives) const;
+        void getPowerSpectrumBlock(const double* c1, const double* c2, vector<double> &block, int l) const;
+        double getPowerSpectrum(const vector<double> &coefficients, int iSpecies, int jSpecies, int l, int n1, int n2) const;
+        void getPowerSpectrumRow(const vector<double> &coefficients, const vector<char> &present, int n, vector<double> &block, double* row) const;
+        void getMu1Nu1Row(const vector<double> &coefficients, const vector<char> &present, vector<double> &total, vector<double> &block, double* row) const;
+        void getEmbeddedCoefficients(const vector<double> &coefficients, const vector<char> &present, vector<double> &embedded) const;
+        void getColumnsRow(const vector<double> &coefficients, const vector<char> &present, const int* columns, int nColumns, double* row) const;
+        void getRow(const vector<double> &coefficients, const vector<char> &present, vector<double> &work, vector<double> &block, const int* columns, int nColumns, double* row) const;
+        void compute(float* output, const int* columns, int nColumns, int average, const double* displacements, const int* species, const int* offsets, int nCenters) const;
+        int getCoefficientIndex(int iSpecies, int l, int m) const;
+
+        void getRadialIntegrals(double r, vector<double> &radial) const;
+        void getRadialIntegrals(double r, vector<double> &radial, vector<double> &derivatives) const;
+
+        const double* radialTable;
+        const double* embedding;
+        vector<char> channelsPresent;
+        int nIntervals;
+        double spacing;
+        vector<double> harmonicNorms;
+        vector<double> recursionFactors;
+        vector<double> powerSpectrumFactors;
+};
+
+#endif
@@ -0,0 +1,23 @@
+from libcpp cimport bool
+from libcpp.vector cimport vector
+
+cdef extern from "soap.cpp":
+    pass
+
+cdef extern from "soap.h":
+    cdef cppclass SOAPTabulated:
+        SOAPTabulated(int, int, const double*, int, double, int, bool, int, const double*, int) except +
+        void create(float*, int, const double*, const int*, const int*, int) nogil
+        void createColumns(float*, const int*, int, int, const double*, const int*, const int*, int) nogil
+        void createDerivatives(float*, float*, const int*, const double*, const int*, const int*, int) nogil
+        void addCoefficients(double*, char*, const double*, const int*, const int*, int) nogil
+        void createInnerAverage(float*, const int*, int, const double*, const char*, int) nogil
+        int nMax
+        int lMax
+        int nSpecies
+        bool crossover
+        int compression
+        int nChannels
+        int nElementFeatures
+        int nFeatures
+        int nCoefficients
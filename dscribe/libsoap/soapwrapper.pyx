@@ -0,0 +1,137 @@
+# distutils: language = c++
+
+import numpy as np
+from libcpp cimport bool
+from libcpp.vector cimport vector
+from soap cimport SOAPTabulated
+
+cdef class SOAPTabulatedWrapper:
+    cdef SOAPTabulated *thisptr      # hold a C++ instance which we're wrapping
+    cdef object radial_table         # the table is referenced by the C++ instance
+    cdef object embedding            # the embedding is referenced by the C++ instance
+
+    def __cinit__(self, int n_max, int l_max, double[:, :, :, ::1] radial_table, double spacing, int n_species, bool crossover, int compression=0, double[:, ::1] embedding=None):
+        """The compression is 0 for none, 1 for mu1nu1 and 2 for a species
+        embedding, in which case the embedding matrix of shape
+        (n_species, n_channels) must be given.
+        """
+        cdef const double *embedding_ptr = NULL
+        cdef int n_channels = 0
+        if radial_table.shape[1] != 4 or radial_table.shape[2] != l_max+1 or radial_table.shape[3] != n_max:
+            raise ValueError("The radial table does not match the given nmax and lmax.")
+        if compression == 2:
+            if embedding is None or embedding.shape[0] != n_species or embedding.shape[1] == 0:
+                raise ValueError("The embedding does not match the given number of species.")
+            embedding_ptr = &embedding[0, 0]
+            n_channels = embedding.shape[1]
+        self.radial_table = radial_table
+        self.embedding = embedding
+        self.thisptr = new SOAPTabulated(n_max, l_max, &radial_table[0, 0, 0, 0], radial_table.shape[0], spacing, n_species, crossover, compression, embedding_ptr, n_channels)
+
+    def __dealloc__(self):
+        del self.thisptr
+
+    def create(self, float[:, ::1] output, double[:, ::1] displacements, int[::1] species, int[::1] offsets, int average=0):
+        """Writes the full output for each center into the given array. With
+        averaging (1 for outer, 2 for inner) only the first row is written.
+        The calculation is done without holding the GIL.
+        """
+        cdef int n_centers = offsets.shape[0] - 1
+        cdef const double *displacements_ptr = NULL
+        cdef const int *species_ptr = NULL
+        if n_centers == 0:
+            return
+        if displacements.shape[0] != 0:
+            displacements_ptr = &displacements[0, 0]
+            species_ptr = &species[0]
+        with nogil:
+            self.thisptr.create(&output[0, 0], average, displacements_ptr, species_ptr, &offsets[0], n_centers)
+
+    def create_columns(self, float[:, ::1] output, int[:, ::1] columns, double[:, ::1] displacements, int[::1] species, int[::1] offsets, int average=0):
+        """Writes the given columns for each center into the given array. Each
+        column is defined by the indices (species i, species j, l, n, n').
+        With averaging (1 for outer, 2 for inner) only the first row is
+        written. The calculation is done without holding the GIL.
+        """
+        cdef int n_centers = offsets.shape[0] - 1
+        cdef int n_columns = columns.shape[0]
+        cdef const double *displacements_ptr = NULL
+        cdef const int *species_ptr = NULL
+        if n_centers == 0:
+            return
+        if displacements.shape[0] != 0:
+            displacements_ptr = &displacements[0, 0]
+            species_ptr = &species[0]
+        with nogil:
+            self.thisptr.createColumns(&output[0, 0], &columns[0, 0], n_columns, average, displacements_ptr, species_ptr, &offsets[0], n_centers)
+
+    def create_derivatives(self, float[:, ::1] output, float[:, :, ::1] derivatives, int[::1] slots, double[:, ::1] displacements, int[::1] species, int[::1] offsets):
+        """Writes the full output for each center and adds the derivatives
+        with respect to the position of each neighbour to the row of the
+        derivative array given by its slot. The calculation is done without
+        holding the GIL.
+        """
+        cdef int n_centers = offsets.shape[0] - 1
+        cdef const double *displacements_ptr = NULL
+        cdef const int *species_ptr = NULL
+        cdef const int *slots_ptr = NULL
+        cdef float *derivatives_ptr = NULL
+        if n_centers == 0:
+            return
+        if displacements.shape[0] != 0:
+            displacements_ptr = &displacements[0, 0]
+            species_ptr = &species[0]
+            slots_ptr = &slots[0]
+            derivatives_ptr = &derivatives[0, 0, 0]
+        with nogil:
+            self.thisptr.createDerivatives(&output[0, 0], derivatives_ptr, slots_ptr, displacements_ptr, species_ptr, &offsets[0], n_centers)
+
+    def add_coefficients(self, double[::1] total, unsigned char[::1] present, double[:, ::1] displacements, int[::1] species, int[::1] offsets):
+        """Adds the expansion coefficients of each center to the given buffer
+        of n_coefficients values and marks the species that are present in
+        the given array of n_species flags. Used to accumulate the inner
+        average over several calls. The calculation is done without holding
+        the GIL.
+        """
+        cdef int n_centers = offsets.shape[0] - 1
+        cdef const double *displacements_ptr = NULL
+        cdef const int *species_ptr = NULL
+        if total.shape[0] != self.thisptr.nCoefficients or present.shape[0] != self.thisptr.nSpecies:
+            raise ValueError("The coefficient buffers do not match the descriptor.")
+        if n_centers == 0:
+            return
+        if displacements.shape[0] != 0:
+            displacements_ptr = &displacements[0, 0]
+            species_ptr = &species[0]
+        with nogil:
+            self.thisptr.addCoefficients(&total[0], <char*>&present[0], displacements_ptr, species_ptr, &offsets[0], n_centers)
+
+    def create_inner_average(self, float[:, ::1] output, double[::1] total, unsigned char[::1] present, int n_centers, int[:, ::1] columns=None):
+        """Writes the power spectrum of the averaged expansion coefficients
+        into the first row of the given array. The coefficients are given as
+        the sum over n_centers centers accumulated with add_coefficients().
+        If columns are given, only they are written.
+        """
+        cdef const int *columns_ptr = NULL
+        cdef int n_columns = 0
+        if total.shape[0] != self.thisptr.nCoefficients or present.shape[0] != self.thisptr.nSpecies:
+            raise ValueError("The coefficient buffers do not match the descriptor.")
+        if n_centers == 0:
+            return
+        if columns is not None:
+            columns_ptr = &columns[0, 0]
+            n_columns = columns.shape[0]
+        with nogil:
+            self.thisptr.createInnerAverage(&output[0, 0], columns_ptr, n_columns, &total[0], <const char*>&present[0], n_centers)
+
+    @property
+    def n_features(self):
+        return self.thisptr.nFeatures
+
+    @property
+    def n_coefficients(self):
+        return self.thisptr.nCoefficients
+
+    @property
+    def n_species(self):
+        return self.thisptr.nSpecies
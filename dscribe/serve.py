@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+"""Copyright 2019 DScribe developers
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+from builtins import (bytes, str, open, super, range, zip, round, input, int, pow, object)
+
+import os
+import socket
+import struct
+import threading
+import time
+
+import socketserver
+import queue
+
+import numpy as np
+
+from scipy.sparse import csr_matrix, issparse
+
+from ase import Atoms
+
+from dscribe.descriptors import Descriptor
+
+# Every message is prefixed with its length as a little-endian unsigned 32-bit
+# integer. The rest of the message is a sequence of little-endian fields and
+# raw array buffers, see _encode_request() and _encode_response().
+_LENGTH = struct.Struct("<I")
+_MAX_FRAME_SIZE = 2**27
+_REQUEST_HEADER = struct.Struct("<HBBI")
+_RESPONSE_HEADER = struct.Struct("<BBII")
+
+_POSITIONS_NONE = 0
+_POSITIONS_INDICES = 1
+_POSITIONS_CARTESIAN = 2
+
+_STATUS_OK = 0
+_STATUS_ERROR = 1
+
+_FORMAT_DENSE = 0
+_FORMAT_CSR = 1
+
+
+class DescriptorServer(object):
+    """Hosts one or more configured descriptors in a long-lived process so
+    that short-lived clients do not have to pay for importing the package and
+    setting up the descriptors on every run.
+
+    The server listens either on a Unix domain socket or on a TCP socket bound
+    to a loopback address. The server does not authenticate its clients, so
+    binding to other addresses has to be explicitly allowed. Structures are sent as raw binary arrays and the results are
+    returned as raw dense or CSR buffers, see :class:`.DescriptorClient`.
+    Requests that arrive close to each other are coalesced into a single
+    :meth:`.Descriptor.create_parallel` call for each hosted descriptor.
+
+    Example::
+
+        server = DescriptorServer({"soap": soap, "mbtr": mbtr}, "/tmp/dscribe.sock")
+        server.serve_forever()
+    """
+    def __init__(
+            self,
+            descriptors,
+            address,
+            n_jobs=1,
+            max_batch_size=64,
+            max_delay=0.005,
+            max_frame_size=_MAX_FRAME_SIZE,
+            allow_remote=False,
+            ):
+        """
+        Args:
+            descriptors (dict): The hosted descriptors as a dictionary where
+                the key is the name used by the clients to refer to the
+                descriptor.
+            address (str or tuple): If a string is given, it is interpreted as
+                a path to a Unix domain socket. If a tuple (host, port) is
+                given, a TCP socket is used. Use port 0 to let the operating
+                system choose a free port, which can then be read from the
+                address-attribute.
+            n_jobs (int): Number of parallel jobs used for creating the
+                descriptors for a single batch of requests.
+            max_batch_size (int): Maximum number of requests that are
+                coalesced into a single batch.
+            max_delay (float): The maximum time in seconds that the first
+                request in a batch waits for other requests to arrive.
+            max_frame_size (int): The maximum size of a single request in
+                bytes. The connection is closed if a client announces a larger
+                request. Defaults to 128 MiB.
+            allow_remote (bool): Whether a TCP socket can be bound to an
+                address that is not a loopback address. The server does not
+                authenticate its clients, so anyone who can reach such an
+                address can use the hosted descriptors.
+        """
+        if len(descriptors) == 0:
+            raise ValueError("Please provide at least one descriptor to host.")
+        for name, descriptor in descriptors.items():
+            if not isinstance(descriptor, Descriptor):
+                raise ValueError(
+                    "The given object for '{}' is not a descriptor.".format(name)
+                )
+            if not descriptor._flatten:
+                raise ValueError(
+                    "Only descriptors with a flattened output can be hosted, "
+                    "please set flatten=True for '{}'.".format(name)
+                )
+        if max_batch_size < 1:
+            raise ValueError("The maximum batch size should be at least one.")
+        if max_delay < 0:
+            raise ValueError("The maximum delay cannot be negative.")
+        if max_frame_size < 1:
+            raise ValueError("The maximum frame size should be at least one byte.")
+
+        self.descriptors = dict(descriptors)
+        self.n_jobs = n_jobs
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_frame_size = max_frame_size
+
+        if isinstance(address, (tuple, list)):
+            if not allow_remote and not _is_loopback(address[0]):
+                raise ValueError(
+                    "The host '{}' is not a loopback address. Please set "
+                    "allow_remote=True to serve the descriptors to other "
+                    "machines.".format(address[0])
+                )
+            server = _ThreadingTCPServer(tuple(address), _RequestHandler)
+        else:
+            if not hasattr(socketserver, "UnixStreamServer"):
+                raise ValueError(
+                    "Unix domain sockets are not supported on this platform, "
+                    "please provide the address as a (host, port)-tuple."
+                )
+            server = _ThreadingUnixServer(address, _RequestHandler)
+        server.descriptor_server = self
+        self._server = server
+        self._queue = queue.Queue()
+        self._batch_thread = None
+        self._serve_thread = None
+
+    @property
+    def address(self):
+        """The address that the server is bound to.
+        """
+        return self._server.server_address
+
+    def start(self):
+        """Starts serving in a background thread and returns immediately.
+        """
+        self._start_batching()
+        self._serve_thread = threading.Thread(target=self._server.serve_forever)
+        self._serve_thread.daemon = True
+        self._serve_thread.start()
+
+    def serve_forever(self):
+        """Serves requests in the calling thread until shutdown() is called
+        from another thread.
+        """
+        self._start_batching()
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """Stops the server, finishes the requests that are already queued
+        and releases the socket.
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        if self._batch_thread is not None:
+            self._queue.put(None)
+            self._batch_thread.join()
+            self._batch_thread = None
+        if self._serve_thread is not None:
+            self._serve_thread.join()
+            self._serve_thread = None
+        if self._server.address_family == getattr(socket, "AF_UNIX", None):
+            try:
+                os.remove(self._server.server_address)
+            except OSError:
+                pass
+
+    def _start_batching(self):
+        if self._batch_thread is None:
+            self._batch_thread = threading.Thread(target=self._batch_loop)
+            self._batch_thread.daemon = True
+            self._batch_thread.start()
+
+    def _submit(self, name, args):
+        """Used by the connection handlers to queue a request and to wait for
+        its result.
+        """
+        job = _Job(name, args)
+        self._queue.put(job)
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _batch_loop(self):
+        """Collects the queued requests into batches. A batch is closed when
+        it is full or when max_delay has passed since its first request.
+        """
+        running = True
+        while running:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            deadline = time.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    job = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if job is None:
+                    running = False
+                    break
+                batch.append(job)
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        """Creates the output for a batch of requests with one
+        create_parallel()-call per descriptor.
+        """
+        groups = {}
+        for job in batch:
+            groups.setdefault(job.name, []).append(job)
+
+        for name, jobs in groups.items():
+            descriptor = self.descriptors.get(name)
+            if descriptor is None:
+                for job in jobs:
+                    job.finish(error=ValueError(
+                        "Unknown descriptor '{}'. The available descriptors "
+                        "are: {}".format(name, sorted(self.descriptors.keys()))
+                    ))
+                continue
+            try:
+                inp = [job.args for job in jobs]
+                n_jobs = min(self.n_jobs, len(inp))
+                outputs = descriptor.create_parallel(inp, descriptor.create_single, n_jobs)
+            except Exception:
+                # A single invalid request should not fail the whole batch, so
+                # the requests are retried one by one to find the culprit.
+                for job in jobs:
+                    try:
+                        job.finish(result=descriptor.project(descriptor.create_single(*job.args)))
+                    except Exception as e:
+                        job.finish(error=e)
+            else:
+                for job, output in zip(jobs, outputs):
+                    job.finish(result=output)
+
+
+class DescriptorClient(object):
+    """Client for a :class:`.DescriptorServer`. A single connection is kept
+    open for the lifetime of the client.
+    """
+    def __init__(self, address, timeout=None):
+        """
+        Args:
+            address (str or tuple): The address of the server: a path to a
+                Unix domain socket or a (host, port)-tuple.
+            timeout (float): Socket timeout in seconds. Defaults to blocking
+                mode without a timeout.
+        """
+        if isinstance(address, (tuple, list)):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            address = tuple(address)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        self._socket = sock
+
+    def create(self, name, system, positions=None, sparse=False):
+        """Requests the output of a hosted descriptor for a single system.
+
+        Args:
+            name (str): Name of the hosted descriptor.
+            system (:class:`ase.Atoms` | :class:`.System`): Input system.
+            positions (list): Atomic indices or cartesian positions that are
+                passed to descriptors that support local output. Mixed lists
+                are sent as cartesian positions.
+            sparse (bool): Whether to return the output as a
+                scipy.sparse.csr_matrix instead of a dense numpy array.
+
+        Returns:
+            np.ndarray | scipy.sparse.csr_matrix: The descriptor output.
+
+        Raises:
+            ValueError: If the server could not create the output.
+        """
+        request = _encode_request(name, system, positions, sparse)
+        _send_frame(self._socket, request)
+        response = _recv_frame(self._socket)
+        return _decode_response(response)
+
+    def close(self):
+        """Closes the connection to the server.
+        """
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _Job(object):
+    """A single queued request.
+    """
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.done.set()
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """Handles all the requests sent through a single client connection.
+    """
+    def handle(self):
+        server = self.server.descriptor_server
+        while True:
+            try:
+                frame = _recv_frame(self.request, server.max_frame_size)
+            except EOFError:
+                return
+            except ValueError as e:
+                # The rest of the oversized frame is not read, so the
+                # connection cannot be used anymore.
+                try:
+                    _send_frame(self.request, _encode_error(e))
+                except socket.error:
+                    pass
+                return
+            try:
+                name, args, sparse = _decode_request(frame)
+                output = server._submit(name, args)
+                response = _encode_response(output, sparse)
+            except Exception as e:
+                response = _encode_error(e)
+            _send_frame(self.request, response)
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class _ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def _is_loopback(host):
+    """Checks that the given host only resolves to loopback addresses.
+    """
+    try:
+        infos = socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM)
+    except socket.gaierror:
+        return False
+    for info in infos:
+        ip = info[4][0]
+        if not (ip.startswith("127.") or ip == "::1"):
+            return False
+    return len(infos) != 0
+
+
+def _send_frame(sock, payload):
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+def _recv_exactly(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        n_new = sock.recv_into(view[received:], n - received)
+        if n_new == 0:
+            raise EOFError("The connection was closed.")
+        received += n_new
+    return buf
+
+
+def _recv_frame(sock, max_size=None):
+    length, = _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))
+    if max_size is not None and length > max_size:
+        raise ValueError(
+            "The received message of {} bytes is larger than the maximum "
+            "size of {} bytes.".format(length, max_size)
+        )
+    return _recv_exactly(sock, length)
+
+
+def _encode_request(name, system, positions, sparse):
+    """Packs a request into bytes. The layout is: header, descriptor name,
+    atomic numbers (int32), positions (float64), cell (float64, 3x3),
+    periodicity (uint8, 3) and the optional positions as int64 indices or
+    float64 cartesian coordinates.
+    """
+    name = name.encode("utf-8")
+    numbers = np.ascontiguousarray(system.get_atomic_numbers(), dtype="<i4")
+    cart = np.ascontiguousarray(system.get_positions(), dtype="<f8")
+    cell = np.ascontiguousarray(system.get_cell(), dtype="<f8")
+    pbc = np.ascontiguousarray(system.get_pbc(), dtype=np.uint8)
+
+    if positions is None:
+        kind = _POSITIONS_NONE
+        pos = np.empty(0, dtype="<f8")
+    elif all(np.issubdtype(type(i), np.integer) for i in positions):
+        kind = _POSITIONS_INDICES
+        pos = np.ascontiguousarray(positions, dtype="<i8")
+    else:
+        kind = _POSITIONS_CARTESIAN
+        all_pos = system.get_positions()
+        pos = [all_pos[i] if np.issubdtype(type(i), np.integer) else i for i in positions]
+        pos = np.ascontiguousarray(pos, dtype="<f8")
+        if pos.ndim != 2 or pos.shape[1] != 3:
+            raise ValueError(
+                "The argument 'positions' should contain atomic indices or "
+                "cartesian coordinates with x, y and z components."
+            )
+    n_pos = len(pos)
+
+    header = _REQUEST_HEADER.pack(len(name), int(sparse), kind, len(numbers))
+    return b"".join([
+        header,
+        name,
+        numbers.tobytes(),
+        cart.tobytes(),
+        cell.tobytes(),
+        pbc.tobytes(),
+        _LENGTH.pack(n_pos),
+        pos.tobytes(),
+    ])
+
+
+def _decode_request(frame):
+    """Unpacks a request created by _encode_request() into the arguments of
+    the create_single()-function of the requested descriptor.
+    """
+    reader = _FrameReader(frame)
+    n_name, sparse, kind, n_atoms = reader.unpack(_REQUEST_HEADER)
+    name = reader.bytes(n_name).decode("utf-8")
+    numbers = reader.array("<i4", n_atoms)
+    cart = reader.array("<f8", 3*n_atoms).reshape(n_atoms, 3)
+    cell = reader.array("<f8", 9).reshape(3, 3)
+    pbc = reader.array(np.uint8, 3).astype(bool)
+    n_pos, = reader.unpack(_LENGTH)
+
+    system = Atoms(numbers=numbers, positions=cart, cell=cell, pbc=pbc)
+    if kind == _POSITIONS_NONE:
+        args = (system,)
+    elif kind == _POSITIONS_INDICES:
+        args = (system, [int(i) for i in reader.array("<i8", n_pos)])
+    else:
+        args = (system, reader.array("<f8", 3*n_pos).reshape(n_pos, 3).tolist())
+
+    return name, args, bool(sparse)
+
+
+def _encode_response(output, sparse):
+    """Packs the descriptor output into bytes as a dense float32 buffer or as
+    the int32 indptr, int32 indices and float32 data arrays of a CSR matrix.
+    """
+    if sparse:
+        output = csr_matrix(output, dtype=np.float32)
+        n_rows, n_cols = output.shape
+        header = _RESPONSE_HEADER.pack(_STATUS_OK, _FORMAT_CSR, n_rows, n_cols)
+        return b"".join([
+            header,
+            _LENGTH.pack(output.nnz),
+            np.ascontiguousarray(output.indptr, dtype="<i4").tobytes(),
+            np.ascontiguousarray(output.indices, dtype="<i4").tobytes(),
+            np.ascontiguousarray(output.data, dtype="<f4").tobytes(),
+        ])
+    else:
+        if issparse(output):
+            output = output.toarray()
+        output = np.ascontiguousarray(np.atleast_2d(output), dtype="<f4")
+        n_rows, n_cols = output.shape
+        header = _RESPONSE_HEADER.pack(_STATUS_OK, _FORMAT_DENSE, n_rows, n_cols)
+        return header + output.tobytes()
+
+
+def _encode_error(error):
+    message = "{}: {}".format(type(error).__name__, error).encode("utf-8")
+    return _RESPONSE_HEADER.pack(_STATUS_ERROR, 0, 0, 0) + message
+
+
+def _decode_response(frame):
+    reader = _FrameReader(frame)
+    status, fmt, n_rows, n_cols = reader.unpack(_RESPONSE_HEADER)
+    if status != _STATUS_OK:
+        raise ValueError(
+            "The descriptor server returned an error: {}"
+            .format(reader.bytes().decode("utf-8"))
+        )
+    if fmt == _FORMAT_DENSE:
+        return reader.array("<f4", n_rows*n_cols).reshape(n_rows, n_cols)
+
+    nnz, = reader.unpack(_LENGTH)
+    indptr = reader.array("<i4", n_rows+1)
+    indices = reader.array("<i4", nnz)
+    data = reader.array("<f4", nnz)
+    return csr_matrix((data, indices, indptr), shape=(n_rows, n_cols))
+
+
+class _FrameReader(object):
+    """Reads consecutive fields from a received message without copying the
+    array buffers.
+    """
+    def __init__(self, frame):
+        self.frame = memoryview(frame)
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.frame, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def bytes(self, count=None):
+        end = len(self.frame) if count is None else self.offset + count
+        value = bytes(self.frame[self.offset:end])
+        self.offset = end
+        return value
+
+    def array(self, dtype, count):
+        value = np.frombuffer(self.frame, dtype=dtype, count=count, offset=self.offset)
+        self.offset += value.nbytes
+        return value
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""Copyright 2019 DScribe developers
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+from builtins import (bytes, str, open, super, range, zip, round, input, int, pow, object)
+
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+from scipy.interpolate import CubicSpline
+from scipy.linalg import sqrtm
+from scipy.special import ive
+
+import soaplite
+
+# Increased whenever the contents of the tables change so that old cache
+# files are not used.
+TABLE_VERSION = 1
+
+# The spacing of the distance grid in angstroms
+TABLE_SPACING = 0.01
+
+# Tables that have already been loaded or created in this process
+_tables = {}
+
+
+def get_cache_directory():
+    """Returns the directory where the radial tables are stored. The
+    directory can be set with the environment variable DSCRIBE_CACHE_DIR, and
+    setting it to an empty string disables the on-disk cache.
+
+    Returns:
+        str: The cache directory or None if the cache is disabled.
+    """
+    directory = os.environ.get("DSCRIBE_CACHE_DIR")
+    if directory is None:
+        directory = os.path.join(os.path.expanduser("~"), ".cache", "dscribe")
+    if directory == "":
+        return None
+    return directory
+
+
+def get_radial_table(rcut, nmax, lmax, sigma, rbf):
+    """Returns the tabulated radial part of the expansion coefficients of a
+    gaussian atomic density in the SOAP radial basis. The tables are created
+    once for each set of parameters and are stored both in memory and in an
+    on-disk cache.
+
+    The table contains the coefficients of a cubic spline for each pair of
+    radial basis function n and angular degree l over the distance between the
+    center and the neighbour. The spline covers the distances up to the hard
+    cutoff rcut+5 with a uniform spacing, and the expansion coefficient for a
+    neighbour is given by the spline value multiplied by the spherical
+    harmonic in the direction of the neighbour.
+
+    Args:
+        rcut (float): The radial cutoff.
+        nmax (int): The number of radial basis functions.
+        lmax (int): The maximum degree of spherical harmonics.
+        sigma (float): The standard deviation of the gaussian atomic density.
+        rbf (str): The radial basis, either "gto" or "polynomial".
+
+    Returns:
+        dict: The table with the keys "spacing" for the grid spacing and
+        "coefficients" for the spline coefficients as an array of shape
+        [n_intervals, 4, lmax+1, nmax], where the second axis is the power of
+        the distance from the start of the interval. For the GTO basis the
+        basis parameters are provided in the keys "alphas" and "betas".
+    """
+    key = (rbf, float(rcut), int(nmax), int(lmax), float(sigma))
+    table = _tables.get(key)
+    if table is not None:
+        return table
+
+    directory = get_cache_directory()
+    filename = None
+    if directory is not None:
+        filename = os.path.join(
+            directory,
+            "soap-{}-rcut{!r}-nmax{}-lmax{}-sigma{!r}-v{}.npz".format(*(key + (TABLE_VERSION,)))
+        )
+        names = ["coefficients", "spacing"]
+        if rbf == "gto":
+            names += ["alphas", "betas"]
+        try:
+            with np.load(filename) as data:
+                table = {name: data[name] for name in names}
+        except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile):
+            table = None
+
+    # Missing, truncated or otherwise unreadable tables are created again and
+    # the file is overwritten.
+    if table is None:
+        table = create_radial_table(*key[1:], rbf=rbf)
+
+        # The file is first written to a temporary file and then moved in
+        # place so that concurrent processes never see partially written
+        # tables. An existing table is replaced, also on Windows. An
+        # unwritable cache is not an error, but the temporary file is not
+        # left behind.
+        if filename is not None:
+            path = None
+            try:
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                fd, path = tempfile.mkstemp(suffix=".npz", dir=directory)
+                with os.fdopen(fd, "wb") as fout:
+                    np.savez(fout, **table)
+                _replace_file(path, filename)
+            except (IOError, OSError):
+                if path is not None and os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    _tables[key] = table
+    return table
+
+
+def _replace_file(source, destination):
+    """Moves the source file in place of the destination file, replacing an
+    existing file. Python 2 lacks os.replace() and os.rename() does not
+    replace existing files on Windows, so the destination is removed first on
+    that platform.
+    """
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+    else:
+        if os.name == "nt" and os.path.exists(destination):
+            os.remove(destination)
+        os.rename(source, destination)
+
+
+def create_radial_table(rcut, nmax, lmax, sigma, rbf):
+    """Used to create the spline table returned by get_radial_table().
+
+    Args:
+        rcut (float): The radial cutoff.
+        nmax (int): The number of radial basis functions.
+        lmax (int): The maximum degree of spherical harmonics.
+        sigma (float): The standard deviation of the gaussian atomic density.
+        rbf (str): The radial basis, either "gto" or "polynomial".
+
+    Returns:
+        dict: The table as described in get_radial_table().
+    """
+    rcut_hard = rcut + 5
+    n_intervals = int(np.ceil(rcut_hard/TABLE_SPACING))
+    r = np.arange(n_intervals+1)*TABLE_SPACING
+    eta = 1/(2*sigma**2)
+
+    table = {}
+    if rbf == "gto":
+        alphas, betas = soaplite.genBasis.getBasisFunc(rcut, nmax)
+        values = get_gto_radial_integrals(r, alphas, betas, lmax, eta)
+        table["alphas"] = alphas
+        table["betas"] = betas
+    elif rbf == "polynomial":
+        values = get_polynomial_radial_integrals(r, rcut, nmax, lmax, eta)
+
+    # The polynomial coefficients are stored with increasing power for each
+    # interval.
+    spline = CubicSpline(r, values, axis=0)
+    table["coefficients"] = np.ascontiguousarray(np.moveaxis(spline.c[::-1], 0, 1))
+    table["spacing"] = np.array(TABLE_SPACING)
+
+    return table
+
+
+def get_gto_radial_integrals(r, alphas, betas, lmax, eta):
+    """Calculates the radial part of the overlap between a gaussian atomic
+    density and the orthonormalized GTO basis.
+
+    The overlap of the gaussian density at distance r with the primitive
+    gaussian r^l*exp(-alpha*r^2) has the analytical form
+    pi^(3/2)*eta^l/(alpha+eta)^(l+3/2)*r^l*exp(-eta*alpha/(alpha+eta)*r^2)
+    when multiplied by the spherical harmonic.
+
+    Args:
+        r (np.ndarray): The distances.
+        alphas (np.ndarray): The exponents of the primitive gaussians as an
+            array of shape [10, nmax].
+        betas (np.ndarray): The orthonormalization coefficients as an array of
+            shape [10, nmax, nmax].
+        lmax (int): The maximum degree of spherical harmonics.
+        eta (float): The exponent of the gaussian atomic density.
+
+    Returns:
+        np.ndarray: The values as an array of shape [len(r), lmax+1, nmax].
+    """
+    nmax = alphas.shape[1]
+    values = np.empty((len(r), lmax+1, nmax))
+    r2 = r[:, np.newaxis]**2
+    for l in range(lmax+1):
+        alpha = alphas[l]
+        factors = np.pi**1.5*eta**l/(alpha+eta)**(l+1.5)
+        primitives = factors*r[:, np.newaxis]**l*np.exp(-eta*alpha/(alpha+eta)*r2)
+        values[:, l, :] = np.dot(primitives, betas[l].T)
+
+    return values
+
+
+def get_polynomial_radial_integrals(r, rcut, nmax, lmax, eta):
+    """Calculates the radial part of the overlap between a gaussian atomic
+    density and the orthonormalized polynomial basis by numerical integration.
+
+    The integration uses the same quadrature and normalization as the
+    polynomial basis in SOAPLite so that the results are directly comparable.
+
+    Args:
+        r (np.ndarray): The distances.
+        rcut (float): The radial cutoff.
+        nmax (int): The number of radial basis functions.
+        lmax (int): The maximum degree of spherical harmonics.
+        eta (float): The exponent of the gaussian atomic density.
+
+    Returns:
+        np.ndarray: The values as an array of shape [len(r), lmax+1, nmax].
+    """
+    # The quadrature points span the range up to the hard cutoff
+    rcut_hard = rcut + 5
+    x, w = np.polynomial.legendre.leggauss(100)
+    rx = 0.5*rcut_hard*(x + 1)
+
+    # The basis functions (rcut-r)^(n+2) are orthonormalized with the inverse
+    # square root of their analytical overlap matrix.
+    n = np.arange(1, nmax+1)
+    S = 2*rcut**(7+n[:, np.newaxis]+n)/((5+n[:, np.newaxis]+n)*(6+n[:, np.newaxis]+n)*(7+n[:, np.newaxis]+n))
+    betas = sqrtm(np.linalg.inv(S))
+    if betas.dtype == np.complex128:
+        raise ValueError(
+            "Could not calculate normalization factors for the polynomial basis"
+            " in the domain of real numbers. Lowering the number of radial "
+            "basis functions is advised."
+        )
+    basis = np.dot(betas, (rcut - np.clip(rx, 0, rcut))**(n[:, np.newaxis]+2))
+    weights = w*rx**2*basis
+
+    # The angular integral of the gaussian density gives the modified
+    # spherical Bessel functions i_l(2*eta*r*d). They are evaluated through the
+    # exponentially scaled modified Bessel functions, which stay accurate at
+    # both small and large arguments. The density at the center is handled
+    # separately.
+    values = np.zeros((len(r), lmax+1, nmax))
+    center = r == 0
+    d = r[~center, np.newaxis]
+    x = 2*eta*d*rx
+    decay = np.exp(-eta*(rx - d)**2)*np.sqrt(np.pi/(2*x))
+    for l in range(lmax+1):
+        values[~center, l, :] = np.dot(decay*ive(l+0.5, x), weights.T)
+    values[center, 0, :] = np.dot(np.exp(-eta*rx**2), weights.T)
+
+    # Normalization that is consistent with SOAPLite
+    values *= 2*np.pi*rcut_hard
+
+    return values
@@ -7,12 +7,16 @@ import numpy as np
 import unittest
 
 from dscribe.core import System
-from dscribe.descriptors import ACSF
+from dscribe.descriptors import ACSF, SOAP, MBTR
 from dscribe.utils.species import symbols_to_numbers
 
 from ase.lattice.cubic import SimpleCubicFactory
+from ase.build import molecule
 import ase.data
 
+from sklearn.decomposition import IncrementalPCA, PCA
+from sklearn.random_projection import SparseRandomProjection
+
 
 class GeometryTests(unittest.TestCase):
 
@@ -239,12 +243,94 @@ class SpeciesTests(unittest.TestCase):
             true_atomic_number = ase.data.chemical_symbols.index(chemical_symbol)
             self.assertEqual(atomic_number, true_atomic_number)
 
+
+class ProjectionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.systems = [molecule(name) for name in ["H2O", "CH4", "CH3OH", "HCOOH", "C2H6", "CO2"]]
+
+    def test_matrix(self):
+        """Tests that a projection matrix is applied to the output of single
+        and multiple systems, both from dense and sparse descriptors.
+        """
+        soap = SOAP(species=[1, 6, 8], rcut=4, nmax=2, lmax=2, sparse=False)
+        mbtr = MBTR(
+            species=[1, 6, 8],
+            k=[1],
+            grid={"k1": {"min": 1, "max": 8, "sigma": 0.1, "n": 50}},
+            periodic=False,
+            sparse=True,
+        )
+        for desc in [soap, mbtr]:
+            full_single = desc.create(self.systems[0])
+            full_multiple = desc.create(self.systems, n_jobs=2)
+            if mbtr is desc:
+                full_single = full_single.toarray()
+                full_multiple = full_multiple.toarray()
+            matrix = np.random.RandomState(0).rand(desc.get_number_of_features(), 5)
+            desc.projection = matrix
+            self.assertEqual(desc.get_number_of_projected_features(), 5)
+
+            single = desc.create(self.systems[0])
+            multiple = desc.create(self.systems, n_jobs=2)
+            self.assertTrue(type(multiple) == np.ndarray)
+            self.assertEqual(multiple.dtype, np.float32)
+            self.assertTrue(np.allclose(single, full_single.dot(matrix), rtol=1e-5))
+            self.assertTrue(np.allclose(multiple, full_multiple.dot(matrix), rtol=1e-5))
+
+            desc.projection = None
+            self.assertEqual(desc.get_number_of_projected_features(), desc.get_number_of_features())
+
+    def test_fit(self):
+        """Tests fitting transformers in batches.
+        """
+        desc = SOAP(species=[1, 6, 8], rcut=4, nmax=2, lmax=2, sparse=False)
+        full = desc.create(self.systems)
+
+        # Incremental fitting on every batch of a generator
+        pca = desc.fit_projection((system for system in self.systems), IncrementalPCA(n_components=3), batch_size=3)
+        self.assertTrue(desc.projection is pca)
+        self.assertTrue(np.allclose(desc.create(self.systems), pca.transform(full), atol=1e-4))
+
+        # Other transformers are fitted on the first batch
+        projection = desc.fit_projection(self.systems, SparseRandomProjection(n_components=4, random_state=0), batch_size=2)
+        self.assertEqual(desc.create(self.systems).shape, (full.shape[0], 4))
+        self.assertTrue(np.allclose(desc.create(self.systems, n_jobs=2), projection.transform(full), atol=1e-4))
+
+        # Positions are iterated together with the systems
+        positions = [[0] for system in self.systems]
+        pca = desc.fit_projection(self.systems, PCA(n_components=2), batch_size=10, positions=positions)
+        self.assertEqual(desc.create(self.systems, positions=positions).shape, (len(self.systems), 2))
+
+        # The previous projection is kept if the fitting fails
+        with self.assertRaises(ValueError):
+            desc.fit_projection(self.systems, PCA(n_components=100), batch_size=2)
+        self.assertTrue(desc.projection is pca)
+
+    def test_errors(self):
+        """Tests invalid projections.
+        """
+        desc = SOAP(species=[1, 6, 8], rcut=4, nmax=2, lmax=2, sparse=False)
+        with self.assertRaises(ValueError):
+            desc.projection = np.ones((desc.get_number_of_features()+1, 2))
+        with self.assertRaises(ValueError):
+            desc.projection = np.ones(desc.get_number_of_features())
+        with self.assertRaises(ValueError):
+            desc.projection = PCA(n_components=2)
+        with self.assertRaises(ValueError):
+            desc.fit_projection(self.systems, PCA(n_components=2), batch_size=0)
+        mbtr = MBTR(species=[1], k=[1], grid={"k1": {"min": 1, "max": 8, "sigma": 0.1, "n": 50}}, periodic=False, flatten=False, sparse=False)
+        with self.assertRaises(ValueError):
+            mbtr.projection = np.ones((mbtr.get_number_of_features(), 2))
+
+
 if __name__ == '__main__':
     suites = []
     suites.append(unittest.TestLoader().loadTestsFromTestCase(ASETests))
     suites.append(unittest.TestLoader().loadTestsFromTestCase(GeometryTests))
     suites.append(unittest.TestLoader().loadTestsFromTestCase(GaussianTests))
     suites.append(unittest.TestLoader().loadTestsFromTestCase(SpeciesTests))
+    suites.append(unittest.TestLoader().loadTestsFromTestCase(ProjectionTests))
     alltests = unittest.TestSuite(suites)
     result = unittest.TextTestRunner(verbosity=0).run(alltests)
 
@@ -518,8 +518,7 @@ class LMBTRTests(TestBaseClass, unittest.TestCase):
         """
         lmbtr = LMBTR(species=[1, 8], k=[2], grid=default_grid, virtual_positions=False, periodic=False)
         lmbtr.create(H2O, positions=[1])
-        geoms = lmbtr._k2_geoms
-        weights = lmbtr._k2_weights
+        geoms, weights = self.geoms_and_weights_dicts(lmbtr, 2)
 
         # Test against the assumed geom values
         pos = H2O.get_positions()
@@ -537,7 +536,7 @@ class LMBTRTests(TestBaseClass, unittest.TestCase):
         # Test against system with different indexing
         lmbtr = LMBTR(species=[1, 8], k=[2], grid=default_grid, virtual_positions=False, periodic=False)
         lmbtr.create(H2O_2, positions=[0])
-        geoms2 = lmbtr._k2_geoms
+        geoms2, _ = self.geoms_and_weights_dicts(lmbtr, 2)
         self.dict_comparison(geoms, geoms2)
 
     def test_k3_weights_and_geoms_finite(self):
@@ -559,8 +558,7 @@ class LMBTRTests(TestBaseClass, unittest.TestCase):
 
         lmbtr = LMBTR(species=[1, 8], k=[3], grid=default_grid, virtual_positions=False, periodic=False)
         lmbtr.create(system, positions=[0])
-        geoms = lmbtr._k3_geoms
-        weights = lmbtr._k3_weights
+        geoms, weights = self.geoms_and_weights_dicts(lmbtr, 3)
 
         # Test against the assumed geom values.
         assumed_geoms = {
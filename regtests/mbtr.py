@@ -9,6 +9,7 @@ import scipy.sparse
 from scipy.signal import find_peaks_cwt
 
 from dscribe.descriptors import MBTR
+from dscribe.core import BlockSparseTensor
 
 from ase.build import bulk
 from ase.build import molecule
@@ -94,17 +95,6 @@ class MBTRTests(unittest.TestCase):
     def test_constructor(self):
         """Tests different valid and invalid constructor values.
         """
-        # Cannot create a sparse and non-flattened output.
-        with self.assertRaises(ValueError):
-            MBTR(
-                species=[1],
-                k=[1],
-                grid=default_grid,
-                periodic=False,
-                flatten=False,
-                sparse=True,
-            )
-
         # Invalid k value not in an iterable
         with self.assertRaises(ValueError):
             MBTR(
@@ -162,6 +152,27 @@ class MBTRTests(unittest.TestCase):
                 periodic=True,
             )
 
+        # Missing cutoff radius
+        with self.assertRaises(ValueError):
+            MBTR(
+                species=[1],
+                k={3},
+                grid=default_grid,
+                weighting={"k3": {"function": "smooth_cutoff", "sharpness": 3}},
+                periodic=True,
+            )
+
+        # Non-positive cutoff radius or sharpness
+        for weight_info in [{"r_cut": 0}, {"r_cut": -2}, {"r_cut": 5, "sharpness": 0}, {"r_cut": 5, "sharpness": -1}]:
+            with self.assertRaises(ValueError):
+                MBTR(
+                    species=[1],
+                    k={2},
+                    grid=default_grid,
+                    weighting={"k2": dict(function="smooth_cutoff", **weight_info)},
+                    periodic=True,
+                )
+
         # Weighting not provided for finite system is fine
         MBTR(
             species=[1],
@@ -311,6 +322,302 @@ class MBTRTests(unittest.TestCase):
         vec = desc.create(H2O)
         self.assertTrue(type(vec) == scipy.sparse.coo_matrix)
 
+        # Sparse and non-flattened
+        desc = MBTR(species=[1, 8], k=[1], grid=default_grid, periodic=False, flatten=False, sparse=True)
+        vec = desc.create(H2O)
+        self.assertTrue(type(vec["k1"]) == BlockSparseTensor)
+
+    def test_columns(self):
+        """Tests that a subset of the columns can be selected with indices or
+        with a boolean mask.
+        """
+        system = molecule("CH3CH2OH")
+        settings = dict(
+            species=[1, 6, 8],
+            k=[1, 2, 3],
+            grid=default_grid,
+            weighting={
+                "k2": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+                "k3": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+            },
+            periodic=False,
+            sparse=False,
+        )
+        full = MBTR(**settings).create(system)
+        n_features = full.shape[1]
+
+        # Indices in arbitrary order, spanning all terms
+        columns = [n_features-10, 12, 12, 400, 190]
+        desc = MBTR(columns=columns, **settings)
+        self.assertEqual(desc.get_number_of_features(), 5)
+        self.assertEqual(desc.get_number_of_full_features(), n_features)
+        self.assertTrue(np.allclose(desc.create(system), full[:, columns]))
+
+        # Boolean mask selecting part of the k3 term only
+        mask = np.zeros(n_features, dtype=bool)
+        mask[-1000:-900] = True
+        settings["sparse"] = True
+        desc = MBTR(columns=mask, **settings)
+        output = desc.create(system)
+        self.assertTrue(type(output) == scipy.sparse.coo_matrix)
+        self.assertTrue(np.allclose(output.toarray(), full[:, mask]))
+
+        # Selecting columns requires a flattened output
+        with self.assertRaises(ValueError):
+            MBTR(species=[1, 8], k=[1], grid=default_grid, periodic=False, flatten=False, sparse=False, columns=[0])
+
+    def test_window(self):
+        """Tests that the gaussians are only evaluated within the given
+        window and that the default window matches the full broadening.
+        """
+        system = molecule("CH3CH2OH")
+        settings = dict(
+            species=[1, 6, 8],
+            k=[1, 2, 3],
+            weighting={
+                "k2": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+                "k3": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+            },
+            periodic=False,
+            sparse=False,
+        )
+
+        def create(window):
+            grid = {}
+            for key, value in default_grid.items():
+                grid[key] = dict(value)
+                if window is not None:
+                    grid[key]["window"] = window
+            return MBTR(grid=grid, **settings).create(system)
+
+        default = create(None)
+        full = create(1000)
+        self.assertTrue(np.allclose(default, full, rtol=1e-6, atol=1e-6))
+
+        # A narrow window cuts off the tails of the gaussians
+        narrow = create(1)
+        self.assertFalse(np.allclose(narrow, full, rtol=1e-6, atol=1e-6))
+        self.assertTrue(np.all(narrow <= full + 1e-6))
+
+    def test_fft_broadening(self):
+        """Tests that the broadening through the fast Fourier transform
+        matches the direct broadening within the accuracy given by the
+        resolution.
+        """
+        system = bulk("NaCl", "rocksalt", a=5.64)
+        weighting = {
+            "k2": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+            "k3": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+        }
+
+        def create(normalize_gaussians, columns=None, **grid_settings):
+            grid = {}
+            for key, value in default_grid.items():
+                grid[key] = dict(value, **grid_settings)
+            desc = MBTR(
+                species=[1, 11, 17],
+                k=[1, 2, 3],
+                grid=grid,
+                weighting=weighting,
+                periodic=True,
+                normalize_gaussians=normalize_gaussians,
+                columns=columns,
+                sparse=False,
+            )
+            return desc.create(system)
+
+        for normalize_gaussians in [True, False]:
+            direct = create(normalize_gaussians)
+            scale = np.abs(direct).max()
+            errors = []
+            for resolution in [5, 20]:
+                fft = create(normalize_gaussians, broadening="fft", resolution=resolution)
+                errors.append(np.abs(fft - direct).max()/scale)
+            self.assertTrue(errors[0] < 1e-3)
+            self.assertTrue(errors[1] < errors[0]/4)
+
+            # Column selection
+            columns = np.arange(0, direct.shape[1], 7)
+            fft = create(normalize_gaussians, columns=columns, broadening="fft")
+            self.assertTrue(np.allclose(fft, direct[:, columns], rtol=0, atol=1e-3*scale))
+
+        # Invalid broadening
+        with self.assertRaises(ValueError):
+            create(True, broadening="fourier")
+
+    def test_k3_cutoff(self):
+        """Tests that the triplets enumerated within the perimeter given by
+        the weighting cutoff are the same as the ones found by checking all
+        triplets.
+        """
+        system = molecule("C6H6")
+        scale = 0.5
+        cutoff = 1e-2
+        desc = MBTR(
+            species=[1, 6],
+            k=[3],
+            grid=default_grid,
+            weighting={"k3": {"function": "exponential", "scale": scale, "cutoff": cutoff}},
+            periodic=False,
+        )
+        desc.create(system)
+        counts = {}
+        for key, geoms, weights in desc.get_geoms_and_weights(3):
+            counts[key] = len(geoms)
+            self.assertTrue(np.all(weights >= cutoff))
+
+        # Count the triplets that pass the weighting by checking all of them
+        numbers = system.get_atomic_numbers()
+        index = {1: 0, 6: 1}
+        distances = system.get_all_distances()
+        n_atoms = len(system)
+        expected = {}
+        for i in range(n_atoms):
+            for j in range(n_atoms):
+                for k in range(i+1, n_atoms):
+                    if j == i or j == k:
+                        continue
+                    perimeter = distances[i, j] + distances[j, k] + distances[k, i]
+                    if np.exp(-scale*perimeter) < cutoff:
+                        continue
+                    key = (index[numbers[i]], index[numbers[j]], index[numbers[k]])
+                    if key[2] < key[0]:
+                        key = key[::-1]
+                    expected[key] = expected.get(key, 0) + 1
+
+        self.assertTrue(len(expected) > 0)
+        self.assertEqual(counts, expected)
+
+    def test_periodic_images(self):
+        """Tests that the periodic extension covers all atoms within the
+        cutoff also for anisotropic and skewed cells, so that the output does
+        not depend on how the lattice is described.
+        """
+        desc = MBTR(
+            species=["H", "C"],
+            k=[2, 3],
+            grid={
+                "k2": {"min": 0, "max": 1, "sigma": 0.02, "n": 100},
+                "k3": {"min": -1, "max": 1, "sigma": 0.05, "n": 100},
+            },
+            weighting={
+                "k2": {"function": "exponential", "scale": 0.6, "cutoff": 1e-2},
+                "k3": {"function": "exponential", "scale": 0.6, "cutoff": 1e-2},
+            },
+            periodic=True,
+            sparse=False,
+        )
+        positions = [[0.1, 0.2, 0.3], [1.0, 1.1, 5.0]]
+        cells = [
+            [[2.1, 0, 0], [0, 2.3, 0], [0, 0, 9.0]],
+            [[0, 0, 9.0], [2.1, 0, 0], [0, 2.3, 0]],
+            [[2.1, 0, 0], [8.4, 2.3, 0], [0, 6.9, 9.0]],
+        ]
+        outputs = [
+            desc.create(Atoms("HC", positions=positions, cell=cell, pbc=True))
+            for cell in cells
+        ]
+        for output in outputs[1:]:
+            self.assertTrue(np.allclose(output, outputs[0], rtol=1e-5, atol=1e-6))
+
+    def test_shared_terms(self):
+        """Tests that the terms calculated together from a single extended
+        system are equal to the terms calculated separately, also when the
+        terms reach to different distances.
+        """
+        system = Atoms(
+            "HCH",
+            positions=[[0.1, 0.2, 0.3], [1.0, 1.1, 1.5], [2.0, 0.3, 0.9]],
+            cell=[[3.1, 0, 0], [0.5, 2.7, 0], [0, 0, 3.4]],
+            pbc=True
+        )
+        grid = {
+            "k1": {"min": 0, "max": 7, "sigma": 0.1, "n": 50},
+            "k2": {"min": 0, "max": 1, "sigma": 0.02, "n": 100},
+            "k3": {"min": -1, "max": 1, "sigma": 0.05, "n": 100},
+        }
+        for k2_scale, k3_scale in [(1.2, 0.3), (0.3, 1.2)]:
+            weighting = {
+                "k2": {"function": "exponential", "scale": k2_scale, "cutoff": 1e-3},
+                "k3": {"function": "exponential", "scale": k3_scale, "cutoff": 1e-3},
+            }
+            desc = MBTR(species=["H", "C"], k=[1, 2, 3], grid=grid, weighting=weighting, periodic=True, flatten=False, sparse=False)
+            output = desc.create(system)
+            for k in [1, 2, 3]:
+                desc_k = MBTR(species=["H", "C"], k=[k], grid=grid, weighting=weighting, periodic=True, flatten=False, sparse=False)
+                output_k = desc_k.create(system)["k{}".format(k)]
+                self.assertTrue(np.array_equal(output["k{}".format(k)], output_k))
+
+    def test_smooth_cutoff(self):
+        """Tests that the smooth cutoff weights are calculated for the pairs
+        and triplets within the cutoff radius.
+        """
+        r_cut = 3.0
+        weighting = {
+            "k2": {"function": "smooth_cutoff", "r_cut": r_cut},
+            "k3": {"function": "smooth_cutoff", "r_cut": r_cut, "sharpness": 3},
+        }
+        desc = MBTR(species=["H", "O"], k=[2, 3], grid=default_grid, weighting=weighting, periodic=False, flatten=False, sparse=False)
+        desc.create(H2O)
+
+        def cutoff(x, y):
+            return 1 + y*(x/r_cut)**(y+1) - (y+1)*(x/r_cut)**y
+
+        distances = H2O.get_all_distances()
+        n_atoms = len(H2O)
+        k2_weights = [
+            cutoff(distances[i, j], 2)
+            for i in range(n_atoms) for j in range(i+1, n_atoms)
+            if distances[i, j] < r_cut
+        ]
+        k3_weights = [
+            cutoff(distances[i, j], 3)*cutoff(distances[j, k], 3)
+            for j in range(n_atoms) for i in range(n_atoms) for k in range(i+1, n_atoms)
+            if j not in (i, k) and distances[i, j] < r_cut and distances[j, k] < r_cut
+        ]
+        self.assertTrue(np.allclose(np.sort(desc._k2_values[3]), np.sort(k2_weights), atol=1e-6))
+        self.assertTrue(np.allclose(np.sort(desc._k3_values[3]), np.sort(k3_weights), atol=1e-6))
+
+        # The pairs beyond the cutoff radius are left out
+        desc = MBTR(species=["H", "O"], k=[2], grid=default_grid, weighting={"k2": {"function": "smooth_cutoff", "r_cut": 1.2}}, periodic=False, flatten=False, sparse=False)
+        desc.create(H2O)
+        self.assertEqual(len(desc._k2_values[3]), 2)
+
+    def test_periodic_neighbour_list(self):
+        """Tests that the geometries and weights calculated from the
+        neighbour list of a periodic system are equal to the ones calculated
+        from the extended system.
+        """
+        system = Atoms(
+            "HCH",
+            positions=[[0.1, 0.2, 0.3], [1.0, 1.1, 1.5], [2.0, 0.3, 0.9]],
+            cell=[[3.1, 0, 0], [0.5, 2.7, 0], [0, 0, 3.4]],
+            pbc=True
+        )
+        exponential = {"function": "exponential", "scale": 0.8, "cutoff": 1e-3}
+        smooth_cutoff = {"function": "smooth_cutoff", "r_cut": 3.0}
+        for weight_info in [exponential, smooth_cutoff]:
+            weighting = {"k2": weight_info, "k3": weight_info}
+            desc = MBTR(species=["H", "C"], k=[2, 3], grid=default_grid, weighting=weighting, periodic=True, flatten=False, sparse=False)
+            desc.create(system)
+            values = {2: desc._k2_values, 3: desc._k3_values}
+
+            for k, geoms_and_weights in [(2, desc.k2_geoms_and_weights), (3, desc.k3_geoms_and_weights)]:
+                desc._k2_values = None
+                desc._k3_values = None
+                positions, numbers = desc.create_extended_system(system, k)
+                geoms_and_weights(desc.create_wrapper(positions, numbers))
+                species, offsets, geoms, weights = values[k]
+                ext_species, ext_offsets, ext_geoms, ext_weights = desc._k2_values if k == 2 else desc._k3_values
+                self.assertTrue(np.array_equal(species, ext_species))
+                for i in range(len(species)):
+                    block = slice(offsets[i], offsets[i+1])
+                    ext_block = slice(ext_offsets[i], ext_offsets[i+1])
+                    order = np.lexsort((weights[block], geoms[block]))
+                    ext_order = np.lexsort((ext_weights[ext_block], ext_geoms[ext_block]))
+                    self.assertTrue(np.allclose(geoms[block][order], ext_geoms[ext_block][ext_order], atol=1e-5))
+                    self.assertTrue(np.allclose(weights[block][order], ext_weights[ext_block][ext_order], atol=1e-6))
+
     def test_parallel_dense(self):
         """Tests creating dense output parallelly.
         """
@@ -423,6 +730,115 @@ class MBTRTests(unittest.TestCase):
         assumed[1, :] = desc.create(samples[1]).toarray()
         self.assertTrue(np.allclose(output, assumed))
 
+    def test_sparse_output(self):
+        """Tests that the sparse output is equal to the dense output and
+        only contains the nonzero values.
+        """
+        weighting = {
+            "k2": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+            "k3": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+        }
+        system = bulk("NaCl", "rocksalt", a=5.64)
+        for k in [[1, 2, 3], [2], [1, 3]]:
+            kwargs = dict(species=[1, 8, 11, 17], k=k, grid=default_grid, weighting=weighting, periodic=True, normalize_by_volume=True)
+            dense = MBTR(sparse=False, **kwargs).create(system)
+            sparse = MBTR(sparse=True, **kwargs).create(system)
+            self.assertTrue(scipy.sparse.issparse(sparse))
+            self.assertEqual(sparse.shape, dense.shape)
+            self.assertTrue(np.all(sparse.data != 0))
+            self.assertEqual(sparse.nnz, np.count_nonzero(dense))
+            self.assertTrue(np.array_equal(sparse.toarray(), dense))
+
+    def test_block_sparse_output(self):
+        """Tests that the non-flattened sparse output only stores the element
+        combinations present in the system and is equal to the dense output.
+        """
+        system = molecule("CH3OH")
+        weighting = {
+            "k2": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+            "k3": {"function": "exponential", "scale": 0.5, "cutoff": 1e-3},
+        }
+        for normalize_by_volume in [False, True]:
+            settings = {
+                "species": [1, 6, 7, 8],
+                "k": [1, 2, 3],
+                "grid": default_grid,
+                "weighting": weighting,
+                "periodic": False,
+                "flatten": False,
+                "normalize_by_volume": normalize_by_volume,
+            }
+            if normalize_by_volume:
+                system.set_cell([5, 5, 5])
+            dense = MBTR(sparse=False, **settings).create(system)
+            sparse = MBTR(sparse=True, **settings).create(system)
+
+            for k in [1, 2, 3]:
+                tensor = sparse["k{}".format(k)]
+                expected = dense["k{}".format(k)]
+                self.assertEqual(tensor.shape, expected.shape)
+                self.assertTrue(np.array_equal(tensor.toarray(), expected))
+                self.assertTrue(np.array_equal(np.asarray(tensor), expected))
+
+                # Only the nonzero blocks are stored, and the missing blocks
+                # are zero
+                nonzero = np.argwhere(np.any(expected != 0, axis=-1))
+                self.assertEqual(sorted(tensor.keys()), sorted(map(tuple, nonzero.tolist())))
+                for key in tensor:
+                    self.assertTrue(np.array_equal(tensor[key], expected[key]))
+                self.assertFalse((2,)*k in tensor)
+                self.assertTrue(np.array_equal(tensor[(2,)*k], np.zeros(default_grid["k{}".format(k)]["n"])))
+
+    def test_create_with_grids(self):
+        """Tests that the output for several grids is equal to the output of
+        descriptors created separately with each grid.
+        """
+        samples = [molecule("CO"), molecule("N2O"), molecule("CH3OH")]
+        grids = [
+            {
+                "k1": {"min": 1, "max": 8, "sigma": sigma, "n": n},
+                "k2": {"min": 0, "max": 1.5, "sigma": sigma, "n": n},
+            }
+            for sigma, n in [(0.1, 50), (0.05, 120)]
+        ]
+        weighting = {"k2": {"function": "exponential", "scale": 0.5, "cutoff": 1e-2}}
+        for flatten, sparse in [(True, False), (True, True), (False, False)]:
+            desc = MBTR(species=[1, 6, 7, 8], k=[1, 2], periodic=False, grid=grids[0], weighting=weighting, flatten=flatten, sparse=sparse)
+            for n_jobs in [1, 2]:
+                outputs = desc.create_with_grids(samples, grids, n_jobs=n_jobs)
+                self.assertEqual(len(outputs), len(grids))
+                for grid, output in zip(grids, outputs):
+                    desc_grid = MBTR(species=[1, 6, 7, 8], k=[1, 2], periodic=False, grid=grid, weighting=weighting, flatten=flatten, sparse=sparse)
+                    assumed = desc_grid.create(samples)
+                    if not flatten:
+                        for i_sample in range(len(samples)):
+                            for key in ["k1", "k2"]:
+                                self.assertTrue(np.array_equal(output[i_sample][key], assumed[i_sample][key]))
+                    elif sparse:
+                        self.assertTrue(scipy.sparse.issparse(output))
+                        self.assertTrue(np.array_equal(output.toarray(), assumed.toarray()))
+                    else:
+                        self.assertTrue(np.array_equal(output, assumed))
+
+            # Single system
+            outputs = desc.create_with_grids(samples[0], grids)
+            desc_grid = MBTR(species=[1, 6, 7, 8], k=[1, 2], periodic=False, grid=grids[1], weighting=weighting, flatten=flatten, sparse=sparse)
+            assumed = desc_grid.create(samples[0])
+            if not flatten:
+                self.assertTrue(np.array_equal(outputs[1]["k2"], assumed["k2"]))
+            elif sparse:
+                self.assertTrue(np.array_equal(outputs[1].toarray(), assumed.toarray()))
+            else:
+                self.assertTrue(np.array_equal(outputs[1], assumed))
+
+            # The grid of the descriptor is not modified
+            self.assertEqual(desc.grid, grids[0])
+
+        # Column selections depend on the grid
+        desc = MBTR(species=[1, 6, 7, 8], k=[1, 2], periodic=False, grid=grids[0], weighting=weighting, columns=[0, 1])
+        with self.assertRaises(ValueError):
+            desc.create_with_grids(samples, grids)
+
     # def test_k1_weights_and_geoms_finite(self):
         # """Tests that the values of the weight and geometry functions are
         # correct for the k=1 term.
@@ -0,0 +1,207 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+from builtins import (bytes, str, open, super, range, zip, round, input, int, pow, object)
+
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+import scipy.sparse
+
+from dscribe.descriptors import SOAP, MBTR, ACSF
+from dscribe.serve import DescriptorServer, DescriptorClient, _recv_frame, _decode_response
+
+from ase.build import molecule, bulk
+
+
+class DescriptorServerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.soap = SOAP(species=[1, 6, 7, 8], rcut=4, nmax=3, lmax=3, sparse=False)
+        self.mbtr = MBTR(
+            species=[1, 6, 7, 8],
+            k=[1, 2],
+            grid={
+                "k1": {"min": 1, "max": 8, "sigma": 0.1, "n": 50},
+                "k2": {"min": 0, "max": 1/0.7, "sigma": 0.1, "n": 50},
+            },
+            periodic=False,
+            sparse=True,
+        )
+        self.acsf = ACSF(species=[1, 6, 7, 8], rcut=4, g2_params=[[1, 2], [4, 5]])
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def start_server(self, address, **kwargs):
+        server = DescriptorServer(
+            {"soap": self.soap, "mbtr": self.mbtr, "acsf": self.acsf},
+            address,
+            **kwargs
+        )
+        server.start()
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_constructor(self):
+        """Tests different valid and invalid constructor values.
+        """
+        address = os.path.join(self.tmpdir, "constructor.sock")
+
+        # No descriptors
+        with self.assertRaises(ValueError):
+            DescriptorServer({}, address)
+
+        # Non-flattened output cannot be served
+        mbtr = MBTR(species=[1], k=[1], grid={"k1": {"min": 1, "max": 8, "sigma": 0.1, "n": 50}}, periodic=False, flatten=False, sparse=False)
+        with self.assertRaises(ValueError):
+            DescriptorServer({"mbtr": mbtr}, address)
+
+        # Invalid batching settings
+        with self.assertRaises(ValueError):
+            DescriptorServer({"soap": self.soap}, address, max_batch_size=0)
+        with self.assertRaises(ValueError):
+            DescriptorServer({"soap": self.soap}, address, max_frame_size=0)
+
+        # Hosts that are not loopback addresses are refused by default
+        for host in ["0.0.0.0", ""]:
+            with self.assertRaises(ValueError):
+                DescriptorServer({"soap": self.soap}, (host, 0))
+        for host, allow_remote in [("0.0.0.0", True), ("localhost", False)]:
+            server = DescriptorServer({"soap": self.soap}, (host, 0), allow_remote=allow_remote)
+            server.start()
+            server.shutdown()
+
+    def test_unix_socket(self):
+        """Tests that the output received through a Unix domain socket is
+        identical to the one created locally, both in dense and CSR form.
+        """
+        server = self.start_server(os.path.join(self.tmpdir, "dscribe.sock"))
+        system = molecule("CH3CH2OH")
+
+        with DescriptorClient(server.address) as client:
+            # All atoms
+            output = client.create("soap", system)
+            self.assertTrue(np.allclose(output, self.soap.create(system)))
+
+            # Indices and cartesian positions
+            output = client.create("soap", system, positions=[0, 2])
+            self.assertTrue(np.allclose(output, self.soap.create(system, positions=[0, 2])))
+            output = client.create("soap", system, positions=[[0, 0, 0], 1])
+            assumed = self.soap.create(system, positions=[[0, 0, 0], system.get_positions()[1].tolist()])
+            self.assertTrue(np.allclose(output, assumed))
+
+            # CSR output from a sparse descriptor
+            output = client.create("mbtr", system, sparse=True)
+            self.assertTrue(type(output) == scipy.sparse.csr_matrix)
+            self.assertTrue(np.allclose(output.toarray(), self.mbtr.create(system).toarray()))
+
+            # Dense output from a sparse descriptor
+            output = client.create("mbtr", system)
+            self.assertTrue(type(output) == np.ndarray)
+            self.assertTrue(np.allclose(output, self.mbtr.create(system).toarray()))
+
+            # CSR output from a dense descriptor
+            output = client.create("acsf", system, positions=[1, 3], sparse=True)
+            self.assertTrue(np.allclose(output.toarray(), self.acsf.create(system, positions=[1, 3])))
+
+    def test_tcp_socket(self):
+        """Tests serving through a TCP socket bound to localhost with periodic
+        systems.
+        """
+        server = self.start_server(("127.0.0.1", 0))
+        self.soap._periodic = True
+        system = bulk("NaCl", "rocksalt", a=5.64)
+        system.set_atomic_numbers([6, 8])
+
+        with DescriptorClient(server.address) as client:
+            output = client.create("soap", system)
+            self.assertTrue(np.allclose(output, self.soap.create(system)))
+
+    def test_errors(self):
+        """Tests that errors are reported to the client without affecting the
+        other requests.
+        """
+        server = self.start_server(os.path.join(self.tmpdir, "errors.sock"))
+        system = molecule("H2O")
+
+        with DescriptorClient(server.address) as client:
+            # Unknown descriptor
+            with self.assertRaises(ValueError):
+                client.create("lmbtr", system)
+
+            # Species not defined for the descriptor
+            with self.assertRaises(ValueError):
+                client.create("soap", molecule("NaCl"))
+
+            # The connection is still usable
+            output = client.create("soap", system)
+            self.assertTrue(np.allclose(output, self.soap.create(system)))
+
+    def test_max_frame_size(self):
+        """Tests that a request larger than the maximum frame size is refused
+        before it is received and that the connection is then closed.
+        """
+        server = self.start_server(os.path.join(self.tmpdir, "frame.sock"), max_frame_size=1000)
+        with DescriptorClient(server.address) as client:
+            output = client.create("soap", molecule("H2O"))
+            self.assertTrue(np.allclose(output, self.soap.create(molecule("H2O"))))
+            with self.assertRaises(ValueError):
+                client.create("soap", molecule("C60"))
+            with self.assertRaises((EOFError, socket.error)):
+                client.create("soap", molecule("H2O"))
+
+        # A bogus length prefix does not make the server allocate the buffer
+        with DescriptorClient(server.address) as client:
+            client._socket.sendall(struct.pack("<I", 2**32 - 1))
+            with self.assertRaises(ValueError):
+                _decode_response(_recv_frame(client._socket))
+
+    def test_batching(self):
+        """Tests that concurrent requests are coalesced into batches and that
+        each client receives its own output.
+        """
+        server = self.start_server(
+            os.path.join(self.tmpdir, "batching.sock"),
+            max_batch_size=8,
+            max_delay=0.05,
+        )
+        batch_sizes = []
+        original_run_batch = server._run_batch
+
+        def run_batch(batch):
+            batch_sizes.append(len(batch))
+            original_run_batch(batch)
+        server._run_batch = run_batch
+
+        names = ["H2O", "NH3", "CH4", "CO2", "C2H6", "CH3OH", "HCOOH", "N2O"]
+        systems = [molecule(name) for name in names]
+        outputs = [None]*len(systems)
+
+        def request(i):
+            with DescriptorClient(server.address) as client:
+                outputs[i] = client.create("soap", systems[i])
+
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(len(systems))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for system, output in zip(systems, outputs):
+            self.assertTrue(np.allclose(output, self.soap.create(system)))
+        self.assertEqual(sum(batch_sizes), len(systems))
+        self.assertTrue(max(batch_sizes) > 1)
+
+
+if __name__ == '__main__':
+    suites = []
+    suites.append(unittest.TestLoader().loadTestsFromTestCase(DescriptorServerTests))
+    alltests = unittest.TestSuite(suites)
+    result = unittest.TextTestRunner(verbosity=0).run(alltests)
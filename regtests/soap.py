@@ -2,6 +2,9 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 from builtins import (bytes, str, open, super, range, zip, round, input, int, pow, object)
 
 import math
+import os
+import shutil
+import tempfile
 import unittest
 
 import numpy as np
@@ -12,10 +15,11 @@ from scipy.integrate import tplquad
 from scipy.linalg import sqrtm
 
 from dscribe.descriptors import SOAP
+from dscribe.utils import radialbasis
 from testbaseclass import TestBaseClass
 
 from ase import Atoms
-from ase.build import molecule
+from ase.build import molecule, bulk
 
 
 H2O = Atoms(
@@ -171,6 +175,290 @@ class SoapTests(TestBaseClass, unittest.TestCase):
         vec = desc.create(H2O)
         self.assertTrue(type(vec) == scipy.sparse.coo_matrix)
 
+        # The sparse output is identical to the dense one also when not all
+        # species are present in the system
+        system = molecule("CH3CH2OH")
+        for crossover in [True, False]:
+            for average in [False, True]:
+                outputs = []
+                for sparse in [False, True]:
+                    desc = SOAP(species=[1, 6, 7, 8], rcut=4, nmax=3, lmax=3, crossover=crossover, average=average, sparse=sparse, backend="soaplite")
+                    outputs.append(desc.create(system))
+                self.assertTrue(np.array_equal(outputs[0], outputs[1].toarray()))
+
+    def test_backends(self):
+        """Tests that the built-in implementation produces the same output as
+        SOAPLite.
+        """
+        molecule_system = molecule("CH3CH2OH")
+        periodic_system = Atoms(
+            symbols=["C", "H", "O"],
+            scaled_positions=[[0, 0, 0], [0.3, 0.2, 0.1], [0.6, 0.5, 0.8]],
+            cell=[[3, 0, 0], [1.0, 3.2, 0], [0.5, 0.7, 4.1]],
+            pbc=True,
+        )
+        for rbf in ["gto", "polynomial"]:
+            for system, periodic in [(molecule_system, False), (periodic_system, True)]:
+                for positions in [None, [0, [0.5, 0.5, 0.5]]]:
+                    outputs = []
+                    for backend in ["native", "soaplite"]:
+                        desc = SOAP(species=[1, 6, 8], rcut=4, nmax=4, lmax=4, sigma=0.5, rbf=rbf, periodic=periodic, sparse=False, backend=backend)
+                        outputs.append(desc.create(system, positions=positions))
+                    self.assertTrue(np.allclose(outputs[0], outputs[1], rtol=1e-5, atol=1e-6))
+
+        # Species not present in the system and disabled crossover
+        native = SOAP(species=[1, 6, 7, 8], rcut=4, nmax=4, lmax=4, crossover=False, sparse=False).create(molecule_system)
+        soaplite = SOAP(species=[1, 6, 8], rcut=4, nmax=4, lmax=4, crossover=False, sparse=False, backend="soaplite").create(molecule_system)
+        n_elem_features = int(native.shape[1]/4)
+        self.assertTrue(np.array_equal(native[:, 2*n_elem_features:3*n_elem_features], np.zeros((9, n_elem_features))))
+        self.assertTrue(np.allclose(np.delete(native, np.s_[2*n_elem_features:3*n_elem_features], axis=1), soaplite, rtol=1e-5, atol=1e-6))
+
+        # Invalid backend
+        with self.assertRaises(ValueError):
+            SOAP(species=[1, 6, 8], rcut=4, nmax=4, lmax=4, backend="unknown")
+
+    def test_radial_table(self):
+        """Tests that the tabulated radial integrals correspond to the exact
+        values and that the tables are stored in the on-disk cache.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        environ = os.environ.get("DSCRIBE_CACHE_DIR")
+        os.environ["DSCRIBE_CACHE_DIR"] = directory
+        try:
+            tables = {}
+            for rbf in ["gto", "polynomial"]:
+                tables[rbf] = radialbasis.get_radial_table(3.0, 3, 2, 0.45, rbf)
+
+            # Unreadable, truncated and incomplete tables in the cache are
+            # replaced, and a table that cannot be written leaves no temporary
+            # files behind
+            with open(os.path.join(directory, os.listdir(directory)[0]), "rb") as fin:
+                valid = fin.read()
+            broken = os.path.join(directory, "broken")
+            os.mkdir(broken)
+            os.environ["DSCRIBE_CACHE_DIR"] = broken
+            filenames = []
+            for nmax in [2, 4, 5, 6, 7]:
+                filename = os.path.join(broken, "soap-gto-rcut3.0-nmax{}-lmax2-sigma0.45-v{}.npz".format(nmax, radialbasis.TABLE_VERSION))
+                filenames.append(filename)
+            with open(filenames[0], "w") as fout:
+                fout.write("invalid")
+            os.mkdir(filenames[1])
+            with open(filenames[2], "wb") as fout:
+                fout.write(b"PK\x03\x04garbage")
+            with open(filenames[3], "wb") as fout:
+                fout.write(valid[:len(valid)//2])
+            with open(filenames[4], "wb") as fout:
+                np.savez(fout, spacing=0.01)
+            for nmax in [2, 4, 5, 6, 7]:
+                radialbasis.get_radial_table(3.0, nmax, 2, 0.45, "gto")
+            for filename in filenames[:1] + filenames[2:]:
+                with np.load(filename) as data:
+                    self.assertTrue("coefficients" in data.files)
+            self.assertEqual(sorted(os.listdir(broken)), sorted(os.path.basename(x) for x in filenames))
+            shutil.rmtree(broken)
+        finally:
+            if environ is None:
+                del os.environ["DSCRIBE_CACHE_DIR"]
+            else:
+                os.environ["DSCRIBE_CACHE_DIR"] = environ
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+        # The tables are read from the cache when not found in memory
+        for rbf, table in tables.items():
+            filename = os.path.join(directory, sorted(os.listdir(directory))[0 if rbf == "gto" else 1])
+            with np.load(filename) as data:
+                self.assertTrue(np.array_equal(data["coefficients"], table["coefficients"]))
+
+        # The interpolated values between the grid points
+        eta = 1/(2*0.45**2)
+        for rbf, table in tables.items():
+            coefficients = table["coefficients"]
+            spacing = float(table["spacing"])
+            t = 0.3*spacing
+            r = np.arange(len(coefficients))*spacing + t
+            interpolated = coefficients[:, 0] + t*(coefficients[:, 1] + t*(coefficients[:, 2] + t*coefficients[:, 3]))
+            if rbf == "gto":
+                exact = radialbasis.get_gto_radial_integrals(r, table["alphas"], table["betas"], 2, eta)
+            else:
+                exact = radialbasis.get_polynomial_radial_integrals(r, 3.0, 3, 2, eta)
+            self.assertTrue(np.allclose(interpolated, exact, rtol=0, atol=1e-6*np.abs(exact).max()))
+
+    def test_compression(self):
+        """Tests the compressed outputs where the number of features grows
+        linearly with the number of species.
+        """
+        system = molecule("CH3CH2OH")
+        species = ["H", "C", "N", "O"]
+        full = SOAP(species=species, rcut=4, nmax=3, lmax=2, sparse=False, backend="native").create(system)
+
+        # A one-hot embedding gives the uncompressed output
+        one_hot = {"H": [1, 0, 0, 0], "C": [0, 1, 0, 0], 7: [0, 0, 1, 0], "O": [0, 0, 0, 1]}
+        desc = SOAP(species=species, rcut=4, nmax=3, lmax=2, sparse=False, compression={"mode": "embedding", "embedding": one_hot}, backend="native")
+        self.assertTrue(np.array_equal(desc.create(system), full))
+
+        # A single channel with equal weights gives the output for an
+        # element-agnostic density
+        agnostic_system = system.copy()
+        agnostic_system.set_atomic_numbers([1]*len(system))
+        agnostic = SOAP(species=[1], rcut=4, nmax=3, lmax=2, sparse=False, backend="native").create(agnostic_system)
+        desc = SOAP(species=species, rcut=4, nmax=3, lmax=2, sparse=False, compression={"mode": "embedding", "embedding": {s: [1] for s in species}}, backend="native")
+        self.assertEqual(desc.get_number_of_features(), agnostic.shape[1])
+        self.assertTrue(np.allclose(desc.create(system), agnostic, rtol=1e-5))
+
+        # The mu1nu1 blocks of all species sum up to the element-agnostic
+        # output
+        desc = SOAP(species=species, rcut=4, nmax=3, lmax=2, sparse=False, compression={"mode": "mu1nu1"}, backend="native")
+        self.assertEqual(desc.get_number_of_features(), 4*3*3*3)
+        mu1nu1 = desc.create(system).reshape(len(system), 4, 3, 3, 3).sum(axis=1)
+        i_n, j_n = np.triu_indices(3)
+        mu1nu1 = mu1nu1[:, :, i_n, j_n].reshape(len(system), -1)
+        self.assertTrue(np.allclose(mu1nu1, agnostic, rtol=1e-5, atol=1e-4))
+
+        # Invalid settings
+        with self.assertRaises(ValueError):
+            SOAP(species=species, rcut=4, nmax=3, lmax=2, compression={"mode": "mu2"}, backend="native")
+        with self.assertRaises(ValueError):
+            SOAP(species=species, rcut=4, nmax=3, lmax=2, compression={"mode": "embedding", "embedding": {"H": [1]}}, backend="native")
+        with self.assertRaises(ValueError):
+            SOAP(species=species, rcut=4, nmax=3, lmax=2, compression={"mode": "mu1nu1"}, backend="soaplite")
+        with self.assertRaises(ValueError):
+            SOAP(species=species, rcut=4, nmax=3, lmax=2, compression={"mode": "mu1nu1"}, columns=[0], backend="native")
+
+    def test_derivatives(self):
+        """Tests the analytic derivatives against finite differences.
+        """
+        def check(desc, system, positions=None):
+            pairs, derivatives, output = desc.derivatives(system, positions)
+            self.assertTrue(np.array_equal(output, desc.create(system, positions)))
+            self.assertEqual(derivatives.shape, (len(pairs), 3, desc.get_number_of_features()))
+            h = 1e-3
+            for (center, atom), derivative in zip(pairs, derivatives):
+                for d in range(3):
+                    plus = system.copy()
+                    plus.positions[atom, d] += h
+                    minus = system.copy()
+                    minus.positions[atom, d] -= h
+                    numerical = (desc.create(plus, positions)[center].astype(np.float64) - desc.create(minus, positions)[center])/(2*h)
+                    self.assertTrue(np.allclose(derivative[d], numerical, rtol=1e-3, atol=1e-3*np.abs(derivatives).max()))
+
+        # Finite system with centers that are bound to atoms and free
+        # centers, with and without crossover
+        system = molecule("H2O")
+        for crossover in [True, False]:
+            desc = SOAP(species=[1, 8], rcut=3, nmax=2, lmax=2, crossover=crossover, sparse=False, backend="native")
+            check(desc, system)
+            check(desc, system, positions=[[0.1, 0.2, 0.3], 1])
+
+        # Periodic system where the images of an atom are summed together
+        system = bulk("NaCl", "rocksalt", a=5.64)
+        system.rattle(0.1, seed=1)
+        desc = SOAP(species=[11, 17], rcut=3, nmax=2, lmax=2, periodic=True, sparse=False, backend="native")
+        check(desc, system)
+
+        # The derivatives are available only for the plain output of the
+        # built-in implementation
+        system = molecule("H2O")
+        for kwargs in [
+                {"backend": "soaplite"},
+                {"average": "outer", "backend": "native"},
+                {"compression": {"mode": "mu1nu1"}, "backend": "native"},
+                {"columns": [0], "backend": "native"}]:
+            desc = SOAP(species=[1, 8], rcut=3, nmax=2, lmax=2, **kwargs)
+            with self.assertRaises(ValueError):
+                desc.derivatives(system)
+
+    def test_chunk_size(self):
+        """Tests that processing the centers in chunks gives the same output
+        as processing them at once.
+        """
+        system = bulk("Cu", "fcc", a=3.6, cubic=True)*(2, 2, 2)
+        system.rattle(0.05, seed=3)
+        for kwargs in [{}, {"average": "outer"}, {"average": "inner"}, {"average": "inner", "columns": [0, 5, 7]}, {"columns": [0, 5, 7]}]:
+            for sparse in [True, False]:
+                full = SOAP(species=[29], rcut=4, nmax=3, lmax=3, periodic=True, sparse=sparse, backend="native", **kwargs).create(system)
+                chunked = SOAP(species=[29], rcut=4, nmax=3, lmax=3, periodic=True, sparse=sparse, chunk_size=7, backend="native", **kwargs).create(system)
+                if sparse:
+                    self.assertTrue(type(chunked) == scipy.sparse.coo_matrix)
+                    full = full.toarray()
+                    chunked = chunked.toarray()
+                self.assertTrue(np.allclose(full, chunked, rtol=1e-6))
+
+        # Invalid chunk sizes
+        with self.assertRaises(ValueError):
+            SOAP(species=[29], rcut=4, nmax=3, lmax=3, chunk_size=0, backend="native")
+        with self.assertRaises(ValueError):
+            SOAP(species=[29], rcut=4, nmax=3, lmax=3, chunk_size=10, backend="soaplite")
+
+    def test_multiscale(self):
+        """Tests that the multiscale output is the same as the output of
+        separate descriptors for each scale and angular resolution.
+        """
+        system = bulk("NaCl", "rocksalt", a=5.64)
+        for kwargs in [{}, {"average": "inner"}, {"compression": {"mode": "mu1nu1"}}]:
+            desc = SOAP(species=[11, 17], rcut=4, nmax=2, lmax=3, periodic=True, sparse=False, backend="native", **kwargs)
+            outputs = desc.create_multiscale(system, [(2, 0.5), (4, 1.0)], lmax=[1, 3])
+            self.assertEqual(len(outputs), 4)
+            for (rcut, sigma, lmax), output in outputs.items():
+                assumed = SOAP(species=[11, 17], rcut=rcut, sigma=sigma, nmax=2, lmax=lmax, periodic=True, sparse=False, backend="native", **kwargs).create(system)
+                self.assertTrue(np.allclose(output, assumed, rtol=1e-5, atol=1e-6))
+
+        # Concatenated sparse output
+        desc = SOAP(species=[11, 17], rcut=4, nmax=2, lmax=3, periodic=True, sparse=True, backend="native")
+        outputs = desc.create_multiscale(system, [(2, 0.5), (4, 1.0)], lmax=[1, 3], positions=[0])
+        output = desc.create_multiscale(system, [(2, 0.5), (4, 1.0)], lmax=[1, 3], positions=[0], concatenate=True)
+        self.assertTrue(type(output) == scipy.sparse.coo_matrix)
+        assumed = np.hstack([outputs[key].toarray() for key in [(2, 0.5, 1), (2, 0.5, 3), (4, 1.0, 1), (4, 1.0, 3)]])
+        self.assertTrue(np.array_equal(output.toarray(), assumed))
+
+        # Invalid settings
+        with self.assertRaises(ValueError):
+            desc.create_multiscale(system, [(2, 0.5)], lmax=[4])
+        with self.assertRaises(ValueError):
+            desc.create_multiscale(system, [])
+        with self.assertRaises(ValueError):
+            SOAP(species=[11, 17], rcut=4, nmax=2, lmax=3, backend="soaplite").create_multiscale(system, [(2, 0.5)])
+
+    def test_columns(self):
+        """Tests that a subset of the columns can be selected with indices or
+        with a boolean mask.
+        """
+        system = molecule("CH3CH2OH")
+        desc = SOAP(species=[1, 6, 8], rcut=5, nmax=3, lmax=3, sparse=False)
+        full = desc.create(system)
+        n_features = desc.get_number_of_features()
+        n_elem_features = desc.get_number_of_element_features()
+
+        # Indices in arbitrary order, spanning all element pairs
+        columns = [n_features-1, 0, 3*n_elem_features+2, n_elem_features+5]
+        desc = SOAP(species=[1, 6, 8], rcut=5, nmax=3, lmax=3, sparse=False, columns=columns)
+        self.assertEqual(desc.get_number_of_features(), 4)
+        self.assertEqual(desc.get_number_of_full_features(), n_features)
+        self.assertTrue(np.allclose(desc.create(system), full[:, columns]))
+        self.assertTrue(np.allclose(desc.create(system, positions=[2, 5]), full[[2, 5]][:, columns]))
+
+        # Boolean mask selecting only the H-H pair, for which the other atoms
+        # are left out
+        mask = np.zeros(n_features, dtype=bool)
+        mask[1:n_elem_features:2] = True
+        desc = SOAP(species=[1, 6, 8], rcut=5, nmax=3, lmax=3, sparse=True, columns=mask)
+        output = desc.create(system)
+        self.assertTrue(type(output) == scipy.sparse.coo_matrix)
+        self.assertTrue(np.allclose(output.toarray(), full[:, mask]))
+
+        # Columns for element pairs that are not present in the system
+        desc = SOAP(species=[1, 6, 8], rcut=5, nmax=3, lmax=3, sparse=False, columns=[n_features-1])
+        self.assertTrue(np.array_equal(desc.create(molecule("CH4")), np.zeros((5, 1))))
+
+        # Invalid columns
+        with self.assertRaises(ValueError):
+            SOAP(species=[1, 8], rcut=5, nmax=3, lmax=3, columns=[])
+        with self.assertRaises(ValueError):
+            SOAP(species=[1, 8], rcut=5, nmax=3, lmax=3, columns=[10000])
+        with self.assertRaises(ValueError):
+            SOAP(species=[1, 8], rcut=5, nmax=3, lmax=3, columns=[True, False])
+
     def test_positions(self):
         """Tests that different positions are handled correctly.
         """
@@ -197,6 +485,16 @@ class SoapTests(TestBaseClass, unittest.TestCase):
         with self.assertRaises(ValueError):
             desc.create(H2O, positions=['a'])
 
+        # Index arrays, coordinate arrays and mixed lists give the same output
+        desc = SOAP(species=[1, 6, 8], rcut=5.0, nmax=2, lmax=1, sparse=False)
+        mixed = desc.create(H2O, positions=[0, [0.1, 0.2, 0.3], np.int64(2), (1.0, 2, 3), np.array([0, 1, 2.0])])
+        cartesian = np.array([H2O.positions[0], [0.1, 0.2, 0.3], H2O.positions[2], [1, 2, 3], [0, 1, 2]])
+        self.assertTrue(np.array_equal(mixed, desc.create(H2O, positions=cartesian)))
+        self.assertTrue(np.array_equal(desc.create(H2O, positions=np.array([2, 0])), desc.create(H2O, positions=[2, 0])))
+        for positions in [[], [[1, 2]], [1.5], np.zeros((2, 2)), np.array([1.5, 2.0])]:
+            with self.assertRaises(ValueError):
+                desc.create(H2O, positions=positions)
+
     def test_parallel_dense(self):
         """Tests creating dense output parallelly.
         """
@@ -469,6 +767,18 @@ class SoapTests(TestBaseClass, unittest.TestCase):
         self.assertAlmostEqual(np.sum(cubic_cell[:3] - cubic_suce[:3]), 0)
         self.assertAlmostEqual(np.sum(triclinic_cell[:3] - triclinic_suce[:3]), 0)
 
+        # A strongly skewed cell describing the same lattice, with the atoms
+        # translated by lattice vectors far outside the cell. The native
+        # backend finds the periodic images with a cell list.
+        desc = SOAP(species=[1, 6, 8], rcut=10.0, nmax=2, lmax=0, periodic=True, crossover=True, backend="native")
+        triclinic_cell = desc.create(molecule, positions=[[0, 0, 0]]).toarray()
+        skewed = molecule.copy()
+        cell = np.array(molecule.get_cell())
+        skewed.set_cell(np.dot([[1, 0, 0], [3, 1, 0], [-2, 4, 1]], cell))
+        skewed.translate(np.dot([[3, -2, 1], [0, 4, -3], [-5, 1, 2]], cell))
+        skewed_cell = desc.create(skewed, positions=[[0, 0, 0]]).toarray()
+        self.assertTrue(np.allclose(triclinic_cell, skewed_cell, rtol=1e-5, atol=1e-5))
+
     def test_symmetries(self):
         """Tests that the descriptor has the correct invariances.
         """
@@ -544,6 +854,30 @@ class SoapTests(TestBaseClass, unittest.TestCase):
         assumed_average = (first+second)/2
         self.assertTrue(np.array_equal(average, assumed_average))
 
+        # The outer average can also be requested explicitly, and it matches
+        # the one from SOAPLite
+        for backend in ["native", "soaplite"]:
+            desc = SOAP(species=[1, 6, 8], rcut=5, nmax=3, lmax=5, average="outer", sparse=False, backend=backend)
+            self.assertTrue(np.allclose(desc.create(sys)[0, :], assumed_average, rtol=1e-5, atol=1e-6))
+
+        # With a single radial basis function and l=0 the power spectrum of
+        # each species is proportional to the square of a single positive
+        # expansion coefficient, so the inner average can be recovered from
+        # the individual outputs.
+        system = molecule("CH3CH2OH")
+        desc = SOAP(species=[1, 6, 8], rcut=4, nmax=1, lmax=0, crossover=False, sparse=False, backend="native")
+        individual = desc.create(system)
+        desc = SOAP(species=[1, 6, 8], rcut=4, nmax=1, lmax=0, crossover=False, average="inner", sparse=False, backend="native")
+        inner = desc.create(system)
+        self.assertEqual(inner.shape, (1, 3))
+        self.assertTrue(np.allclose(inner[0, :], np.mean(np.sqrt(individual), axis=0)**2, rtol=1e-5))
+
+        # Invalid averaging modes
+        with self.assertRaises(ValueError):
+            SOAP(species=[1, 6, 8], rcut=5, nmax=3, lmax=5, average="sum")
+        with self.assertRaises(ValueError):
+            SOAP(species=[1, 6, 8], rcut=5, nmax=3, lmax=5, average="inner", backend="soaplite")
+
     def test_basis(self):
         """Tests that the output vectors behave correctly as a basis.
         """
@@ -103,6 +103,18 @@ class TestBaseClass(ABC):
 
         return is_perm_sym
 
+    def geoms_and_weights_dicts(self, descriptor, k):
+        """Used to convert the geometry and weighting function values of a
+        MBTR term into dictionaries of lists keyed by the element indices.
+        """
+        geoms = {}
+        weights = {}
+        for key, k_geoms, k_weights in descriptor.get_geoms_and_weights(k):
+            geoms[key] = k_geoms.tolist()
+            weights[key] = k_weights.tolist()
+
+        return geoms, weights
+
     def dict_comparison(self, first, second):
         """Used to compare values in two dictionaries.
         """
@@ -16,6 +16,7 @@ import lmbtr
 import soap
 import elementaldistribution
 import kernels
+import serve
 
 # Initialize the test suite
 loader = unittest.TestLoader()
@@ -33,6 +34,7 @@ suite.addTests(loader.loadTestsFromModule(lmbtr))
 suite.addTests(loader.loadTestsFromModule(soap))
 suite.addTests(loader.loadTestsFromModule(elementaldistribution))
 suite.addTests(loader.loadTestsFromModule(kernels))
+suite.addTests(loader.loadTestsFromModule(serve))
 
 # Initialize a runner, pass it the suite and run it
 runner = unittest.TextTestRunner(verbosity=3)
@@ -28,6 +28,16 @@ extensions = [
         include_dirs=["dscribe/libmbtr"],
         extra_compile_args=cpp_extra_compile_args,
     ),
+    # The SOAP C++ extension, wrapped with cython
+    Extension(
+        "dscribe.libsoap.soapwrapper",
+        [
+            "dscribe/libsoap/soapwrapper.cpp",
+        ],
+        language='c++',
+        include_dirs=["dscribe/libsoap"],
+        extra_compile_args=cpp_extra_compile_args,
+    ),
 ]
 
 if __name__ == "__main__":